@@ -77,6 +77,10 @@ def main(args):
     note_str = "|".join([note for note in notes if note is not None])
     df["RIVM-specific notes"] = note_str
 
+    # Record which SeqSero2 mode produced the prediction
+    if args.tier is not None:
+        df["SeqSero2 mode"] = args.tier.read_text().strip()
+
     # Write to output
     logging.info(f"Writing to {args.output}")
     df.to_csv(args.output, sep="\t", index=False)
@@ -90,6 +94,12 @@ if __name__ == "__main__":
     parser.add_argument("-i", "--input", required=True, type=Path)
     parser.add_argument("-o", "--output", required=True, type=Path)
     parser.add_argument("-c", "--context", required=True, type=Path)
+    parser.add_argument(
+        "-t",
+        "--tier",
+        type=Path,
+        help="File with the SeqSero2 mode that produced the prediction",
+    )
     parser.add_argument("--verbose", action="store_true")
 
     args = parser.parse_args()
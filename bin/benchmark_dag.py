@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Measure how long Snakemake needs to parse the pipeline and build the DAG (dry
+run) for an increasing number of samples. Synthetic samples (empty input
+files, mixed genera) are used, so no real data or databases are needed. Run
+it inside the juno_typing conda environment.
+"""
+
+import argparse
+import json
+import logging
+import pathlib
+import subprocess
+import tempfile
+import time
+
+import pandas as pd
+import yaml
+
+PIPELINE_DIR = pathlib.Path(__file__).parent.parent
+
+# Genus -> MLST7 scheme of the synthetic samples (every genus has its own
+# serotyper rules)
+GENERA = {
+    "salmonella": "senterica",
+    "escherichia": "ecoli",
+    "streptococcus": "spneumoniae",
+    "neisseria": "neisseria",
+    "bordetella": "bpertussis",
+    "listeria": "lmonocytogenes",
+    "campylobacter": None,
+}
+
+
+def make_samples(n_samples, input_dir):
+    """Sample sheet with n_samples samples and their (empty) input files"""
+    input_dir.mkdir(parents=True, exist_ok=True)
+    genera = list(GENERA)
+    samples = {}
+    for i in range(n_samples):
+        sample = f"sample{i:06d}"
+        genus = genera[i % len(genera)]
+        samples[sample] = {
+            "R1": str(input_dir.joinpath(f"{sample}_R1.fastq.gz")),
+            "R2": str(input_dir.joinpath(f"{sample}_R2.fastq.gz")),
+            "assembly": str(input_dir.joinpath(f"{sample}.fasta")),
+            "genus": genus,
+            "species": "species",
+            "species-mlst7": GENERA[genus],
+            "genome_size": 5000000,
+            "priority": "routine",
+        }
+        for key in ["R1", "R2", "assembly"]:
+            pathlib.Path(samples[sample][key]).touch()
+    return samples
+
+
+def make_config(work_dir, sample_sheet, sample_sheet_json):
+    """Pipeline parameters and the default user parameters of juno_typing.py"""
+    db_dir = work_dir.joinpath("db")
+    db_dir.joinpath("mlst7_db", "senterica").mkdir(parents=True, exist_ok=True)
+    db_dir.joinpath("mlst7_db", "senterica", "senterica.length.b").touch()
+    with open(PIPELINE_DIR.joinpath("config", "pipeline_parameters.yaml")) as file_:
+        config = yaml.safe_load(file_)
+    config.update(
+        {
+            "sample_sheet": str(sample_sheet),
+            "sample_sheet_json": str(sample_sheet_json or ""),
+            "input_dir": str(work_dir.joinpath("input")),
+            "out": str(work_dir.joinpath("output")),
+            "db_dir": str(db_dir),
+            "mlst7_db": str(db_dir.joinpath("mlst7_db")),
+            "seroba_db": str(db_dir.joinpath("seroba_db")),
+            "seroba_db_build": str(db_dir.joinpath("seroba_db_builds", "dry_k71")),
+            "serotypefinder_db": str(db_dir.joinpath("serotypefinder_db")),
+            "db_staging_dir": "",
+            "db_versions": {},
+            "mlst7": {
+                "input": "reads",
+                "caller": "cge-mlst",
+                "index_dir": str(db_dir.joinpath("mlst7_kmer_index")),
+            },
+            "serotypefinder": {"min_cov": 0.6, "identity_thresh": 0.85},
+            "seroba": {"min_cov": 20, "kmer_size": 71},
+            "stage_reads": {"enabled": False, "staging_dir": ""},
+            "subsample": {"enabled": False, "coverage": 100, "seed": 100},
+            "bordetella_vaccine_antigen_scheme": "bordetella",
+            "bordetella_vaccine_antigen_blastdb": str(
+                db_dir.joinpath("bordetella", "bordetella.fa")
+            ),
+            "barrnap_batch_size": 1,
+            "result_cache": {"enabled": False, "store_dir": "", "keys": {}},
+            "seqsero_context": str(
+                PIPELINE_DIR.joinpath("files", "SeqSero2_context.tsv")
+            ),
+            "seqsero": {"mode": "microassembly"},
+        }
+    )
+    return config
+
+
+def time_dag(n_samples, work_dir, sample_sheet_format):
+    """Wall time (s) of a dry run of the pipeline with n_samples samples"""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    samples = make_samples(n_samples, work_dir.joinpath("input"))
+    sample_sheet = work_dir.joinpath("sample_sheet.yaml")
+    with open(sample_sheet, "w") as file_:
+        yaml.dump(samples, file_, default_flow_style=False)
+    sample_sheet_json = None
+    if sample_sheet_format == "json":
+        sample_sheet_json = work_dir.joinpath("sample_sheet.json")
+        with open(sample_sheet_json, "w") as file_:
+            json.dump(samples, file_)
+    config_file = work_dir.joinpath("config.yaml")
+    with open(config_file, "w") as file_:
+        yaml.dump(
+            make_config(work_dir, sample_sheet, sample_sheet_json),
+            file_,
+            default_flow_style=False,
+        )
+    start = time.perf_counter()
+    subprocess.run(
+        [
+            "snakemake",
+            "--snakefile",
+            str(PIPELINE_DIR.joinpath("Snakefile")),
+            "--directory",
+            str(work_dir),
+            "--configfile",
+            str(config_file),
+            "--cores",
+            "1",
+            "--dryrun",
+            "--quiet",
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def main(args):
+    results = []
+    for n_samples in args.samples:
+        for sample_sheet_format in args.formats:
+            with tempfile.TemporaryDirectory(dir=args.tmp_dir) as work_dir:
+                seconds = time_dag(
+                    n_samples, pathlib.Path(work_dir), sample_sheet_format
+                )
+            logging.info(
+                f"{n_samples} samples ({sample_sheet_format}): {seconds:.1f} s"
+            )
+            results.append(
+                {
+                    "samples": n_samples,
+                    "sample_sheet": sample_sheet_format,
+                    "dag_seconds": round(seconds, 2),
+                }
+            )
+    pd.DataFrame(results).to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-n",
+        "--samples",
+        nargs="+",
+        type=int,
+        default=[1000, 5000, 10000, 50000],
+        help="Number of samples of every benchmarked run.",
+    )
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=["json", "yaml"],
+        default=["json", "yaml"],
+        help="Sample sheet read by the Snakefile.",
+    )
+    parser.add_argument(
+        "--tmp_dir",
+        type=pathlib.Path,
+        default=None,
+        help="Directory for the synthetic input files (they are removed afterwards).",
+    )
+    parser.add_argument("-o", "--output", type=pathlib.Path, required=True)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    main(args)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Compare the wall time and the results of the native 7-locus MLST caller
+(mlst7_caller.py) with those of cge-mlst (KMA) on the reads of real samples.
+Every sample in the sample sheet with an MLST7 scheme is typed with both
+tools. Run it inside the mlst7 conda environment (envs/mlst7.yaml), on the
+same kind of node as the pipeline jobs.
+"""
+
+import argparse
+import json
+import logging
+import pathlib
+import subprocess
+import tempfile
+import time
+
+import pandas as pd
+import yaml
+
+from mlst7_caller import load_scheme_index
+
+BIN_DIR = pathlib.Path(__file__).parent
+
+
+def time_command(command):
+    """Wall time (s) and exit code of a command"""
+    start = time.perf_counter()
+    process = subprocess.run(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return time.perf_counter() - start, process.returncode
+
+
+def read_st(output_dir):
+    data_json = pathlib.Path(output_dir).joinpath("data.json")
+    if not data_json.exists():
+        return None
+    with open(data_json) as json_file:
+        return json.load(json_file)["mlst"]["results"]["sequence_type"]
+
+
+def benchmark_sample(sample, sample_info, database, index_dir, work_dir):
+    reads = [sample_info["R1"], sample_info["R2"]]
+    species = sample_info["species-mlst7"]
+    native_out = work_dir.joinpath(sample, "native")
+    kma_out = work_dir.joinpath(sample, "kma")
+    kma_out.mkdir(parents=True, exist_ok=True)
+    native_seconds, native_exit = time_command(
+        [
+            "python",
+            str(BIN_DIR.joinpath("mlst7_caller.py")),
+            "-i",
+            *reads,
+            "-o",
+            str(native_out),
+            "-s",
+            species,
+            "--database",
+            str(database),
+            "--index_dir",
+            str(index_dir),
+        ]
+    )
+    kma_seconds, _ = time_command(
+        [
+            "python",
+            str(BIN_DIR.joinpath("cge-mlst", "mlst.py")),
+            "-i",
+            *reads,
+            "-o",
+            str(kma_out),
+            "-s",
+            species,
+            "--database",
+            str(database),
+            "-mp",
+            "kma",
+            "-x",
+        ]
+    )
+    native_st = read_st(native_out)
+    kma_st = read_st(kma_out)
+    return {
+        "sample": sample,
+        "scheme": species,
+        "native_seconds": round(native_seconds, 2),
+        "kma_seconds": round(kma_seconds, 2),
+        # The native caller leaves samples with novel or ambiguous alleles to
+        # cge-mlst, which then runs as well
+        "native_fallback": native_exit != 0,
+        "native_st": native_st,
+        "kma_st": kma_st,
+        "concordant": native_st is None or native_st == kma_st,
+    }
+
+
+def main(args):
+    with open(args.sample_sheet) as file_:
+        samples = yaml.safe_load(file_)
+    samples = {
+        sample: sample_info
+        for sample, sample_info in samples.items()
+        if sample_info.get("species-mlst7") and "R1" in sample_info
+    }
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as work_dir:
+        index_dir = args.index_dir or pathlib.Path(work_dir, "index")
+        # The index is built only once per scheme in the pipeline, so it is
+        # not part of the timing of the samples
+        for scheme in {
+            sample_info["species-mlst7"] for sample_info in samples.values()
+        }:
+            load_scheme_index(args.database, scheme, index_dir)
+        for sample, sample_info in samples.items():
+            result = benchmark_sample(
+                sample, sample_info, args.database, index_dir, pathlib.Path(work_dir)
+            )
+            logging.info(
+                f"{sample}: native {result['native_seconds']} s, "
+                f"KMA {result['kma_seconds']} s"
+            )
+            results.append(result)
+    df = pd.DataFrame(results)
+    df.to_csv(args.output, index=False)
+    if df.empty:
+        print("No samples with reads and an MLST7 scheme in the sample sheet.")
+        return
+    typed = df[~df["native_fallback"]]
+    print(
+        f"Median wall time per sample: native {df['native_seconds'].median():.1f} s "
+        f"(cge-mlst runs as well for {df['native_fallback'].sum()} of "
+        f"{df.shape[0]} samples), KMA {df['kma_seconds'].median():.1f} s. "
+        f"Discordant STs: {(~typed['concordant']).sum()}."
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-s",
+        "--sample_sheet",
+        type=pathlib.Path,
+        required=True,
+        help="Sample sheet of a previous run (<output>/audit_trail/sample_sheet.yaml).",
+    )
+    parser.add_argument(
+        "--database",
+        type=pathlib.Path,
+        required=True,
+        help="Path to the MLST7 database (<db_dir>/mlst7_db).",
+    )
+    parser.add_argument(
+        "--index_dir",
+        type=pathlib.Path,
+        default=None,
+        help="Directory with the k-mer indexes of the native caller "
+        "(<db_dir>/mlst7_kmer_index). A temporary one is used by default.",
+    )
+    parser.add_argument(
+        "--tmp_dir",
+        type=pathlib.Path,
+        default=None,
+        help="Directory for the results of both tools (removed afterwards).",
+    )
+    parser.add_argument("-o", "--output", type=pathlib.Path, required=True)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    main(args)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark the 7-locus MLST calculated from the reads (KMA) against the one
+calculated from the assembly (BLAST). For every sample in a juno-typing sample
+sheet, cge-mlst is run in both modes and the wall time and results are
+compared. It should be run in an environment containing the dependencies of
+envs/mlst7.yaml.
+"""
+
+import argparse
+import logging
+import pathlib
+import subprocess
+import time
+
+import pandas as pd
+import yaml
+
+from mlst7_multireport import extract_from_mlst7
+
+MLST7_SCRIPT = pathlib.Path(__file__).parent.joinpath("cge-mlst", "mlst.py")
+
+
+def run_mlst7(input_files, output_dir, species, mlst7_db, method):
+    """Run cge-mlst for one sample and return the wall time in seconds"""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    start = time.perf_counter()
+    subprocess.run(
+        [
+            "python",
+            str(MLST7_SCRIPT),
+            "-i",
+            *input_files,
+            "-o",
+            str(output_dir),
+            "-s",
+            species,
+            "--database",
+            str(mlst7_db),
+            "-mp",
+            method,
+            "-x",
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def benchmark_sample(sample, sample_info, mlst7_db, output_dir):
+    result = {"Sample": sample}
+    modes = {
+        "reads": ([sample_info["R1"], sample_info["R2"]], "kma"),
+        "assembly": ([sample_info["assembly"]], "blastn"),
+    }
+    for mode, (input_files, method) in modes.items():
+        sample_dir = output_dir.joinpath(mode, "mlst7", sample)
+        logging.info(f"Running MLST7 for {sample} using the {mode}")
+        result[f"wall_time_{mode}"] = run_mlst7(
+            input_files, sample_dir, sample_info["species-mlst7"], mlst7_db, method
+        )
+        _, st, _, _, alleles = extract_from_mlst7(str(sample_dir.joinpath("data.json")))
+        result[f"ST_{mode}"] = st
+        result[f"alleles_{mode}"] = alleles
+    result["concordant"] = (result["ST_reads"] == result["ST_assembly"]) and (
+        result["alleles_reads"] == result["alleles_assembly"]
+    )
+    return result
+
+
+def main(args):
+    with open(args.sample_sheet) as sample_sheet_file:
+        samples = yaml.safe_load(sample_sheet_file)
+    results = [
+        benchmark_sample(sample, sample_info, args.mlst7_db, args.output_dir)
+        for sample, sample_info in samples.items()
+        if sample_info.get("species-mlst7") is not None
+    ]
+    report = pd.DataFrame(results)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    report.to_csv(args.output_dir.joinpath("mlst7_input_benchmark.csv"), index=False)
+    if report.shape[0] > 0:
+        print(
+            f"Samples: {report.shape[0]}\n"
+            f"Total wall time reads: {report['wall_time_reads'].sum():.1f} s\n"
+            f"Total wall time assembly: {report['wall_time_assembly'].sum():.1f} s\n"
+            f"Concordant results: {report['concordant'].sum()}/{report.shape[0]}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-s",
+        "--sample_sheet",
+        type=pathlib.Path,
+        required=True,
+        help="Sample sheet of a juno-typing run (audit_trail/sample_sheet.yaml).",
+    )
+    parser.add_argument(
+        "-d",
+        "--mlst7_db",
+        type=pathlib.Path,
+        required=True,
+        help="Path to the MLST7 database (<db_dir>/mlst7_db).",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_dir",
+        type=pathlib.Path,
+        default="mlst7_input_benchmark",
+        help="Output directory for the MLST7 results and the benchmark report.",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    main(args)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Summarize the Snakemake benchmark files of a juno-typing run
+(<output>/log/benchmark/<rule>/<sample>.tsv, or <rule>.tsv for jobs that
+process all samples at once) per tool and per tool and genus. The report
+contains the median and 95th percentile of the wall time, the CPU efficiency
+(CPU time divided by wall time and threads) and the peak memory, which can be
+used to tune config/pipeline_parameters.yaml.
+"""
+
+import argparse
+import pathlib
+
+import pandas as pd
+import yaml
+
+# Rule -> key of its threads in pipeline_parameters.yaml (rules not listed use
+# 1 thread)
+RULE_THREADS = {
+    "stage_reads": "stage_reads",
+    "subsample_reads": "subsample",
+    "mlst7": "cgemlst",
+    "salmonella_serotyper": "seqsero2",
+    "add_context_salmonella_serotyper": "other",
+    "convert_blastxml_to_csv": "other",
+    "ecoli_serotyper": "serotypefinder",
+    "seroba": "seroba",
+    "characterize_neisseria_capsule": "characterize_neisseria_capsule",
+    "vaccine_antigen_mlst_bordetella": "tseemann_mlst",
+    "serotype_multireports": "other",
+    "extract_16s": "barrnap",
+    "extract_16s_batch": "barrnap",
+}
+
+BENCHMARK_COLUMNS = ["s", "max_rss", "cpu_time"]
+
+
+def read_benchmarks(benchmark_dir, samples, threads):
+    """
+    Read all the benchmark files of a run
+
+    Parameters
+    ----------
+    benchmark_dir : pathlib.Path
+        Directory with the benchmark files (<output>/log/benchmark)
+    samples : dict
+        Sample sheet of the run (used to get the genus of every sample)
+    threads : dict
+        Threads per tool as set in pipeline_parameters.yaml
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per job with the rule, sample, genus, wall time (s), CPU
+        efficiency and maximum memory (MB)
+    """
+    benchmark_dir = pathlib.Path(benchmark_dir)
+    jobs = []
+    for benchmark in sorted(benchmark_dir.rglob("*.tsv")):
+        if benchmark.parent == benchmark_dir:
+            rule, sample = benchmark.stem, "-"
+        else:
+            rule, sample = benchmark.parent.name, benchmark.stem
+        values = pd.read_csv(benchmark, sep="\t")
+        if values.shape[0] == 0 or not set(BENCHMARK_COLUMNS).issubset(values):
+            continue
+        values = values[BENCHMARK_COLUMNS].apply(pd.to_numeric, errors="coerce")
+        rule_threads = threads.get(RULE_THREADS.get(rule), 1)
+        wall_time = values["s"].iloc[0]
+        cpu_efficiency = float("nan")
+        if wall_time > 0:
+            cpu_efficiency = values["cpu_time"].iloc[0] / (wall_time * rule_threads)
+        jobs.append(
+            {
+                "rule": rule,
+                "sample": sample,
+                "genus": samples.get(sample, {}).get("genus", "-"),
+                "wall_time_s": wall_time,
+                "cpu_efficiency": cpu_efficiency,
+                "max_rss_mb": values["max_rss"].iloc[0],
+            }
+        )
+    return pd.DataFrame(
+        jobs,
+        columns=[
+            "rule",
+            "sample",
+            "genus",
+            "wall_time_s",
+            "cpu_efficiency",
+            "max_rss_mb",
+        ],
+    )
+
+
+def summarize(jobs, by):
+    """Summary statistics of the jobs grouped by the columns in by"""
+    summary = jobs.groupby(by).agg(
+        jobs=("wall_time_s", "size"),
+        wall_time_p50_s=("wall_time_s", lambda x: x.quantile(0.5)),
+        wall_time_p95_s=("wall_time_s", lambda x: x.quantile(0.95)),
+        wall_time_total_s=("wall_time_s", "sum"),
+        cpu_efficiency_mean=("cpu_efficiency", "mean"),
+        max_rss_p95_mb=("max_rss_mb", lambda x: x.quantile(0.95)),
+        max_rss_peak_mb=("max_rss_mb", "max"),
+    )
+    return summary.reset_index().round(2)
+
+
+def make_report(jobs):
+    """Report per tool (genus 'all') and per tool and genus"""
+    per_tool = summarize(jobs, ["rule"])
+    per_tool.insert(1, "genus", "all")
+    per_genus = summarize(jobs, ["rule", "genus"])
+    return (
+        pd.concat([per_tool, per_genus], ignore_index=True)
+        .sort_values("rule", kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+def main(args):
+    with open(args.sample_sheet) as file_:
+        samples = yaml.safe_load(file_) or {}
+    with open(args.parameters) as file_:
+        threads = yaml.safe_load(file_)["threads"]
+    jobs = read_benchmarks(args.benchmark_dir, samples, threads)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    make_report(jobs).to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-b",
+        "--benchmark_dir",
+        type=pathlib.Path,
+        required=True,
+        help="Directory with the benchmark files (<output>/log/benchmark).",
+    )
+    parser.add_argument(
+        "-s",
+        "--sample_sheet",
+        type=pathlib.Path,
+        required=True,
+        help="Sample sheet of the run (<output>/audit_trail/sample_sheet.yaml).",
+    )
+    parser.add_argument(
+        "-p",
+        "--parameters",
+        type=pathlib.Path,
+        default=pathlib.Path(__file__).parent.parent.joinpath(
+            "config", "pipeline_parameters.yaml"
+        ),
+        help="Pipeline parameters (to get the threads of every tool).",
+    )
+    parser.add_argument("-o", "--output", type=pathlib.Path, required=True)
+    main(parser.parse_args())
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Calibrate the memory coefficients of resource_scaling (in
+config/pipeline_parameters.yaml) from the benchmark files of previous
+juno-typing runs. For every tool, the maximum memory used by a job (max_rss)
+is fitted as a linear function of the size of its input, and the intercept is
+raised so that all the benchmarked jobs would have had enough memory.
+"""
+
+import argparse
+import logging
+import math
+import pathlib
+
+import pandas as pd
+import yaml
+
+# Tool (key in pipeline_parameters.yaml) -> rule with the benchmark files and
+# the input of the rule in the sample sheet
+BENCHMARKED_TOOLS = {
+    "cgemlst": ("mlst7", ["R1", "R2"]),
+    "seqsero2": ("salmonella_serotyper", ["R1", "R2"]),
+    "serotypefinder": ("ecoli_serotyper", ["assembly"]),
+    "seroba": ("seroba", ["R1", "R2"]),
+    "shigatyper": ("shigatyper", ["R1", "R2"]),
+}
+
+
+def input_size_gb(files, gz_expansion, uncompressed_size=None):
+    """Same estimate of the input size as used in bin/rules/resources.smk
+    (uncompressed_size: sizes measured by the pre-flight check, by file)"""
+    uncompressed_size = uncompressed_size or {}
+    size = 0
+    for file_ in files:
+        if str(file_) in uncompressed_size:
+            size += uncompressed_size[str(file_)]
+            continue
+        file_ = pathlib.Path(file_)
+        if not file_.exists():
+            continue
+        file_size = file_.stat().st_size
+        if file_.suffix == ".gz":
+            file_size *= gz_expansion
+        size += file_size
+    return size / 1024**3
+
+
+def collect_benchmarks(run_dirs, gz_expansion, mlst7_input="reads"):
+    """
+    Get the input size and maximum memory of every benchmarked job
+
+    Parameters
+    ----------
+    run_dirs : list
+        Output directories of juno-typing runs
+    gz_expansion : float
+        Factor used for the size of compressed input files
+    mlst7_input : str
+        Input used for MLST7 in these runs ('reads' or 'assembly')
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per job with the columns tool, sample, input_gb and mem_gb
+    """
+    records = []
+    for run_dir in run_dirs:
+        run_dir = pathlib.Path(run_dir)
+        with open(run_dir.joinpath("audit_trail", "sample_sheet.yaml")) as file_:
+            samples = yaml.safe_load(file_)
+        for tool, (rule, input_keys) in BENCHMARKED_TOOLS.items():
+            if tool == "cgemlst" and mlst7_input == "assembly":
+                input_keys = ["assembly"]
+            for benchmark in run_dir.joinpath("log", "benchmark", rule).glob("*.tsv"):
+                sample = benchmark.stem
+                if sample not in samples:
+                    continue
+                max_rss = pd.read_csv(benchmark, sep="\t")["max_rss"]
+                max_rss = pd.to_numeric(max_rss, errors="coerce").max()
+                if math.isnan(max_rss):
+                    continue
+                input_files = [samples[sample][key] for key in input_keys]
+                uncompressed_size = {
+                    samples[sample][key]: size
+                    for key, size in samples[sample]
+                    .get("uncompressed_size", {})
+                    .items()
+                }
+                records.append(
+                    {
+                        "tool": tool,
+                        "sample": sample,
+                        "input_gb": input_size_gb(
+                            input_files, gz_expansion, uncompressed_size
+                        ),
+                        "mem_gb": max_rss / 1024,
+                    }
+                )
+    return pd.DataFrame(records, columns=["tool", "sample", "input_gb", "mem_gb"])
+
+
+def fit_memory(benchmarks):
+    """
+    Fit mem_gb = mem_gb_base + mem_gb_per_input_gb * input_gb
+
+    The slope is the least squares fit (not negative) and the intercept is the
+    smallest one for which no benchmarked job is underestimated.
+    """
+    x = benchmarks["input_gb"]
+    y = benchmarks["mem_gb"]
+    slope = 0.0
+    if x.nunique() > 1:
+        covariance = ((x - x.mean()) * (y - y.mean())).sum()
+        slope = max(covariance / ((x - x.mean()) ** 2).sum(), 0.0)
+    base = (y - slope * x).max()
+    return {
+        "mem_gb_base": max(math.ceil(round(base * 10, 6)) / 10, 1),
+        "mem_gb_per_input_gb": math.ceil(round(slope * 100, 6)) / 100,
+    }
+
+
+def main(args):
+    with open(args.parameters) as file_:
+        parameters = yaml.safe_load(file_)
+    scaling = parameters["resource_scaling"]
+    benchmarks = collect_benchmarks(
+        args.runs, scaling["gz_expansion"], mlst7_input=args.mlst7_input
+    )
+    for tool, tool_benchmarks in benchmarks.groupby("tool"):
+        if tool_benchmarks.shape[0] < args.min_jobs:
+            logging.warning(
+                f"Only {tool_benchmarks.shape[0]} benchmarked jobs for {tool}, "
+                "keeping the current coefficients"
+            )
+            continue
+        tool_scaling = scaling["tools"].setdefault(
+            tool, {"mem_gb_max": parameters["mem_gb"][tool]}
+        )
+        tool_scaling.update(fit_memory(tool_benchmarks))
+        logging.info(f"{tool}: {tool_scaling} ({tool_benchmarks.shape[0]} jobs)")
+    print(yaml.dump({"resource_scaling": scaling}, default_flow_style=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-r",
+        "--runs",
+        nargs="+",
+        type=pathlib.Path,
+        required=True,
+        help="Output directories of previous juno-typing runs.",
+    )
+    parser.add_argument(
+        "-p",
+        "--parameters",
+        type=pathlib.Path,
+        default=pathlib.Path(__file__).parent.parent.joinpath(
+            "config", "pipeline_parameters.yaml"
+        ),
+        help="Current pipeline parameters.",
+    )
+    parser.add_argument(
+        "--mlst7_input",
+        choices=["reads", "assembly"],
+        default="reads",
+        help="--mlst7_input used in the benchmarked runs.",
+    )
+    parser.add_argument(
+        "--min_jobs",
+        type=int,
+        default=10,
+        help="Minimum number of benchmarked jobs to calibrate a tool.",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    main(args)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Find the samples affected by a database update. The content of the databases
+is summarized per MLST7 scheme (allele sequences, profiles and scheme
+definition), for the SerotypeFinder database and for the Seroba build, and
+compared with the summary saved by the previous run in the same output
+directory (audit_trail/database_contents.yaml). Only the samples whose scheme
+or serotyper database changed need to be typed again.
+"""
+
+import argparse
+import hashlib
+import pathlib
+import subprocess
+
+import yaml
+
+CONTENTS_FILE = "database_contents.yaml"
+
+# Outputs (relative to the output directory) that are removed to re-type a
+# sample with a rule
+RULE_OUTPUTS = {
+    "mlst7": [
+        "mlst7/{sample}/data.json",
+        "mlst7/{sample}/results.txt",
+        "mlst7/{sample}/MLST_allele_seq.fsa",
+    ],
+    "ecoli_serotyper": [
+        "serotype/{sample}/data.json",
+        "serotype/{sample}/result_serotype.csv",
+    ],
+    "seroba": ["serotype/{sample}/pred.tsv"],
+}
+
+
+def hash_files(files, root):
+    signature = hashlib.sha1()
+    for file_ in sorted(files):
+        signature.update(str(file_.relative_to(root)).encode())
+        signature.update(file_.read_bytes())
+    return signature.hexdigest()
+
+
+def get_mlst7_scheme_contents(mlst7_db):
+    """Hash of the allele sequences, profiles and config line of every
+    scheme"""
+    mlst7_db = pathlib.Path(mlst7_db)
+    config_lines = {}
+    with open(mlst7_db.joinpath("config")) as config:
+        for line in config:
+            if not line.startswith("#") and "\t" in line:
+                config_lines[line.split("\t")[0]] = line
+    contents = {}
+    for scheme, line in config_lines.items():
+        scheme_dir = mlst7_db.joinpath(scheme)
+        files = [
+            file_
+            for suffix in ["fsa", "tsv"]
+            for file_ in scheme_dir.glob(f"*.{suffix}")
+        ]
+        contents[scheme] = hashlib.sha1(
+            (line + hash_files(files, mlst7_db)).encode()
+        ).hexdigest()
+    return contents
+
+
+def get_git_commit(repo_dir):
+    try:
+        return subprocess.run(
+            ["git", "-C", str(repo_dir), "rev-parse", "HEAD"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def get_database_contents(db_dir, seroba_kmersize):
+    """
+    Summary of the content of the databases that can change the results of a
+    sample
+
+    Parameters
+    ----------
+    db_dir : pathlib.Path
+        Database directory (--db_dir)
+    seroba_kmersize : int
+        Kmer size of the Seroba build
+
+    Returns
+    -------
+    dict
+        Hash per MLST7 scheme ('mlst7_scheme'), hash of the SerotypeFinder
+        database ('serotypefinder_db') and version of the Seroba build
+        ('seroba_db')
+    """
+    db_dir = pathlib.Path(db_dir)
+    serotypefinder_db = db_dir.joinpath("serotypefinder_db")
+    return {
+        "mlst7_scheme": get_mlst7_scheme_contents(db_dir.joinpath("mlst7_db")),
+        "serotypefinder_db": hash_files(
+            list(serotypefinder_db.glob("*.fsa")), serotypefinder_db
+        ),
+        "seroba_db": "{}_k{}".format(
+            get_git_commit(db_dir.joinpath("seroba_db")), seroba_kmersize
+        ),
+    }
+
+
+def get_sample_db_content(db_contents, rule, sample_info):
+    """Part of the database contents used by a rule for a sample (None if the
+    rule does not use any of these databases)"""
+    if rule == "mlst7":
+        return db_contents["mlst7_scheme"].get(sample_info.get("species-mlst7"))
+    if rule == "ecoli_serotyper":
+        return db_contents["serotypefinder_db"]
+    if rule == "seroba":
+        return db_contents["seroba_db"]
+    return None
+
+
+def find_affected_samples(samples, old_contents, new_contents, output_dir):
+    """
+    Samples with results in the output directory that were made with a
+    different version of their scheme or serotyper database
+
+    Returns
+    -------
+    dict
+        Rule as key and list of affected samples as value
+    """
+    output_dir = pathlib.Path(output_dir)
+    affected = {rule: [] for rule in RULE_OUTPUTS}
+    for rule, outputs in RULE_OUTPUTS.items():
+        for sample, sample_info in samples.items():
+            if not output_dir.joinpath(outputs[0].format(sample=sample)).exists():
+                continue
+            old = get_sample_db_content(old_contents, rule, sample_info)
+            new = get_sample_db_content(new_contents, rule, sample_info)
+            if old != new:
+                affected[rule].append(sample)
+    return affected
+
+
+def remove_outputs(output_dir, affected):
+    """Remove the outputs of the affected samples so Snakemake runs their
+    jobs again"""
+    for rule, samples in affected.items():
+        for sample in samples:
+            for output in RULE_OUTPUTS[rule]:
+                output_file = pathlib.Path(output_dir).joinpath(
+                    output.format(sample=sample)
+                )
+                output_file.unlink(missing_ok=True)
+
+
+def read_contents(contents_file):
+    with open(contents_file) as file_:
+        return yaml.safe_load(file_)
+
+
+def write_contents(contents_file, db_contents):
+    with open(contents_file, "w") as file_:
+        yaml.dump(db_contents, file_, default_flow_style=False)
+
+
+def main(args):
+    with open(args.output_dir.joinpath("audit_trail", "sample_sheet.yaml")) as file_:
+        samples = yaml.safe_load(file_)
+    old_contents = read_contents(args.output_dir.joinpath("audit_trail", CONTENTS_FILE))
+    new_contents = get_database_contents(args.db_dir, args.seroba_kmersize)
+    affected = find_affected_samples(
+        samples, old_contents, new_contents, args.output_dir
+    )
+    for rule, rule_samples in affected.items():
+        print(f"{rule}: {len(rule_samples)} sample(s) affected")
+        for sample in rule_samples:
+            print(f"\t{sample}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-o",
+        "--output_dir",
+        type=pathlib.Path,
+        required=True,
+        help="Output directory of a previous juno-typing run.",
+    )
+    parser.add_argument(
+        "-d",
+        "--db_dir",
+        type=pathlib.Path,
+        required=True,
+        help="Database directory with the updated databases.",
+    )
+    parser.add_argument(
+        "--seroba_kmersize",
+        type=int,
+        default=71,
+        help="Kmer size used for the Seroba database.",
+    )
+    main(parser.parse_args())
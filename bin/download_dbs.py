@@ -1,6 +1,9 @@
 import argparse
+import os
 import pathlib
+import shutil
 import subprocess
+import time
 
 import juno_library.helper_functions as hf
 
@@ -19,11 +22,15 @@ class DownloadsJunoTyping:
         serotypefinder_db_asked_version="master",
         seroba_db_asked_version="master",
         seroba_kmersize=71,
+        seroba_db_retention_days=30,
+        seroba_build_fallback_dir=None,
     ):
         self.db_dir = pathlib.Path(db_dir)
         self.bin_dir = pathlib.Path(__file__).parent.absolute()
         self.update_dbs = update_dbs
         self.seroba_kmersize = seroba_kmersize
+        self.seroba_db_retention_days = seroba_db_retention_days
+        self.seroba_build_fallback_dir = seroba_build_fallback_dir
         self.downloaded_versions = self.get_downloads_juno_typing(
             cge_mlst_asked_version=cge_mlst_asked_version,
             characterize_neisseria_capsule_asked_version=characterize_neisseria_capsule_asked_version,
@@ -103,34 +110,26 @@ class DownloadsJunoTyping:
         return version
 
     def copy_neisseria_db(self):
-        """Function to copy the neisseria db from mnt/db/juno to the bin folder of the neisseria tool.
-        It is necessary for the tool to run the database from this location."""
+        """Function to link the neisseria db from mnt/db/juno to the bin folder of the neisseria tool.
+        It is necessary for the tool to run the database from this location.
+        The database is linked instead of copied to avoid duplicating it."""
         characterize_neisseria_capsule_db_dir = self.bin_dir.joinpath(
             "characterize_neisseria_capsule"
         )
-        if not characterize_neisseria_capsule_db_dir.joinpath(
+        neisseria_db_link = characterize_neisseria_capsule_db_dir.joinpath(
             "neisseria_capsule_DB"
-        ).exists():
-            try:
-                print(
-                    f"Copying neisseria db from /mnt/db/juno to: {characterize_neisseria_capsule_db_dir}"
-                )
-                build = subprocess.run(
-                    [
-                        "cp",
-                        "-R",
-                        "/mnt/db/juno/neisseria_capsule_DB",
-                        f"{characterize_neisseria_capsule_db_dir}",
-                    ],
-                    cwd=str(characterize_neisseria_capsule_db_dir),
-                    check=True,
-                    timeout=3000,
-                )
-            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as err:
-                build.kill()
+        )
+        if not neisseria_db_link.exists():
+            neisseria_db = pathlib.Path("/mnt/db/juno/neisseria_capsule_DB")
+            if not neisseria_db.exists():
                 raise Exception(
                     "Error building neisseria db, this currently only works on RIVM HPC"
-                ) from err
+                )
+            print(f"Linking neisseria db from {neisseria_db} to: {neisseria_db_link}")
+            if neisseria_db_link.is_symlink():
+                # Broken link (e.g. the database was moved)
+                neisseria_db_link.unlink()
+            neisseria_db_link.symlink_to(neisseria_db, target_is_directory=True)
         else:
             return print("Neisseria db is available, continue analysis")
 
@@ -211,6 +210,34 @@ class DownloadsJunoTyping:
         version = hf.get_commit_git(seroba_db_dir)
         return version
 
+    def evict_seroba_builds(self, current_build_dir):
+        """
+        Function to remove Seroba database builds that have not been used
+        for longer than the retention period. The build used in the current
+        run is marked as used and never removed.
+        """
+        current_build_dir = pathlib.Path(current_build_dir)
+        try:
+            current_build_dir.mkdir(parents=True, exist_ok=True)
+            current_build_dir.joinpath("last_used").touch()
+        except PermissionError:
+            # Shared databases (e.g. /mnt/db/juno/typing_db) are read-only
+            # for most users and are maintained by the bioinformatics team
+            print(f"No write access to {current_build_dir.parent}, skipping clean-up")
+            return
+        oldest_allowed = time.time() - self.seroba_db_retention_days * 24 * 60 * 60
+        for build_dir in current_build_dir.parent.iterdir():
+            if build_dir == current_build_dir or not build_dir.is_dir():
+                continue
+            last_used = build_dir.joinpath("last_used")
+            if last_used.exists():
+                last_used_time = last_used.stat().st_mtime
+            else:
+                last_used_time = build_dir.stat().st_mtime
+            if last_used_time < oldest_allowed:
+                print(f"Removing unused Seroba database build {build_dir}")
+                shutil.rmtree(build_dir)
+
     def get_downloads_juno_typing(
         self,
         cge_mlst_asked_version,
@@ -247,10 +274,88 @@ class DownloadsJunoTyping:
             ),
             "characterize_neisseria_capsule_db": self.copy_neisseria_db(),
         }
+        software_version["seroba_kmersize"] = self.seroba_kmersize
+        self.seroba_build_dir = find_seroba_build_dir(
+            self.db_dir,
+            software_version["seroba_db"],
+            self.seroba_kmersize,
+            self.seroba_build_fallback_dir,
+        )
+        if self.seroba_build_dir.parent == self.db_dir.joinpath(SEROBA_BUILDS_DIR):
+            self.evict_seroba_builds(self.seroba_build_dir)
+        else:
+            print(f"Using the Seroba database build in {self.seroba_build_dir}")
 
         return software_version
 
 
+SEROBA_BUILDS_DIR = "seroba_db_builds"
+
+
+def get_seroba_build_dir(db_dir, seroba_db_version, kmersize):
+    """
+    Directory where the Seroba database is built for a given database commit
+    and k-mer size. The build itself is done in a Snakemake rule.
+    """
+    return pathlib.Path(db_dir).joinpath(
+        SEROBA_BUILDS_DIR, f"{seroba_db_version}_k{kmersize}"
+    )
+
+
+def get_downloaded_seroba_version(db_dir):
+    """Commit of the downloaded Seroba database (None if it is not
+    downloaded yet)"""
+    seroba_db_dir = pathlib.Path(db_dir).joinpath("seroba_db")
+    if not seroba_db_dir.joinpath("database", "cdhit_cluster").is_file():
+        return None
+    return hf.get_commit_git(seroba_db_dir)
+
+
+def has_seroba_build(build_dir, kmersize):
+    """True if build_dir contains a Seroba database built with kmersize"""
+    kmer_size_file = pathlib.Path(build_dir).joinpath("database", "kmer_size.txt")
+    return kmer_size_file.is_file() and kmer_size_file.read_text().strip() == str(
+        kmersize
+    )
+
+
+def is_writable(directory):
+    """True if directory (or the nearest existing parent, if it does not
+    exist yet) can be written to"""
+    directory = pathlib.Path(directory).absolute()
+    while not directory.exists():
+        directory = directory.parent
+    return os.access(directory, os.W_OK)
+
+
+def find_seroba_build_dir(db_dir, seroba_db_version, kmersize, fallback_dir=None):
+    """
+    Directory with the Seroba database build for the given database commit
+    and k-mer size. In order of preference:
+    1. the existing build in <db_dir>/seroba_db_builds
+    2. the database built in place (<db_dir>/seroba_db/database, as done by
+       earlier versions of the pipeline), if it was built with the same k-mer
+       size
+    3. a new build in <db_dir>/seroba_db_builds, if it can be written to
+    4. a new build in fallback_dir (e.g. in the output directory), for users
+       without write access to a shared database directory
+    """
+    db_dir = pathlib.Path(db_dir)
+    build_dir = get_seroba_build_dir(db_dir, seroba_db_version, kmersize)
+    if has_seroba_build(build_dir, kmersize):
+        return build_dir
+    in_place_build_dir = db_dir.joinpath("seroba_db")
+    if has_seroba_build(in_place_build_dir, kmersize):
+        return in_place_build_dir
+    if fallback_dir is None or is_writable(build_dir):
+        return build_dir
+    print(
+        f"No write access to {build_dir.parent}, the Seroba database will be "
+        f"built in {fallback_dir}"
+    )
+    return pathlib.Path(fallback_dir).joinpath(build_dir.name)
+
+
 if __name__ == "__main__":
     argument_parser = argparse.ArgumentParser(
         description="Download databases for the typing pipeline."
@@ -303,6 +408,12 @@ if __name__ == "__main__":
         default=71,
         help="Kmer size to be used to build Seroba's database.",
     )
+    argument_parser.add_argument(
+        "--seroba-db-retention-days",
+        type=int,
+        default=30,
+        help="Seroba database builds that were not used for this many days are removed.",
+    )
     argument_parser.add_argument("--update", dest="update_dbs", action="store_true")
     args = argument_parser.parse_args()
     downloads = DownloadsJunoTyping(
@@ -314,5 +425,6 @@ if __name__ == "__main__":
         serotypefinder_db_asked_version=args.serotypefinder_db_version,
         seroba_db_asked_version=args.seroba_db_version,
         seroba_kmersize=args.seroba_kmer_size,
+        seroba_db_retention_days=args.seroba_db_retention_days,
     )
     print(downloads.downloaded_versions)
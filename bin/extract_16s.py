@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Extract the 16S rRNA sequences predicted by barrnap (GFF3, read from stdin or
+a file) directly from the assembly. The assembly is read in place, so no copy
+or .fai index of it is needed. The record names follow the names written by
+barrnap --outseq (e.g. 16S_rRNA::contig_1:100-1637(+)).
+
+If barrnap was run on several assemblies at once (contig names prefixed with
+'<sample>|'), the sequences can be split into one file per sample with
+--samples and --output_dir.
+"""
+
+import argparse
+import logging
+import pathlib
+import sys
+
+from Bio import SeqIO
+
+SAMPLE_SEPARATOR = "|"
+
+
+def read_gff(gff, gene="16S_rRNA"):
+    """
+    Get the location of the predictions of a gene in a barrnap GFF3 file
+
+    Parameters
+    ----------
+    gff : iterable
+        Lines of the GFF3 file
+    gene : str
+        Name of the rRNA gene (Name attribute) to keep
+
+    Returns
+    -------
+    dict
+        Contig name as key and a list of (start, end, strand) as value, with
+        start 0-based and end exclusive
+    """
+    locations = {}
+    for line in gff:
+        if line.startswith("#") or not line.strip():
+            continue
+        fields = line.rstrip("\n").split("\t")
+        attributes = dict(
+            attribute.split("=", 1)
+            for attribute in fields[8].split(";")
+            if "=" in attribute
+        )
+        if attributes.get("Name") == gene:
+            locations.setdefault(fields[0], []).append(
+                (int(fields[3]) - 1, int(fields[4]), fields[6])
+            )
+    return locations
+
+
+def extract_records(assembly, locations, gene="16S_rRNA"):
+    """Yield the predicted sequences while streaming through the assembly"""
+    for record in SeqIO.parse(assembly, "fasta"):
+        for start, end, strand in locations.get(record.id, []):
+            sub_record = record[start:end]
+            if strand == "-":
+                sub_record = sub_record.reverse_complement()
+            sub_record.id = f"{gene}::{record.id}:{start}-{end}({strand})"
+            sub_record.description = ""
+            yield sub_record
+
+
+def write_per_sample(records, samples, output_dir, gene="16S_rRNA"):
+    """
+    Split the sequences of a batched barrnap run per sample
+
+    The sample prefix is removed from the contig names and every sample gets a
+    <output_dir>/<sample>/16S_seq.fasta file, also if no sequence was found.
+    """
+    records_per_sample = {sample: [] for sample in samples}
+    prefix = f"{gene}::"
+    for record in records:
+        sample, name = record.id[len(prefix) :].split(SAMPLE_SEPARATOR, 1)
+        record.id = f"{prefix}{name}"
+        records_per_sample[sample].append(record)
+    for sample, sample_records in records_per_sample.items():
+        sample_dir = pathlib.Path(output_dir).joinpath(sample)
+        sample_dir.mkdir(parents=True, exist_ok=True)
+        SeqIO.write(sample_records, sample_dir.joinpath("16S_seq.fasta"), "fasta")
+
+
+def main(args):
+    if args.gff is None:
+        locations = read_gff(sys.stdin)
+    else:
+        with open(args.gff) as gff:
+            locations = read_gff(gff)
+    logging.info(
+        f"{sum(len(loc) for loc in locations.values())} 16S sequence(s) predicted"
+    )
+    records = extract_records(args.assembly, locations)
+    if args.samples is None:
+        SeqIO.write(records, args.output, "fasta")
+    else:
+        write_per_sample(records, args.samples, args.output_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-a", "--assembly", required=True, type=pathlib.Path)
+    parser.add_argument(
+        "-g",
+        "--gff",
+        type=pathlib.Path,
+        default=None,
+        help="barrnap GFF3 output. Read from stdin if not given.",
+    )
+    parser.add_argument("-o", "--output", type=pathlib.Path)
+    parser.add_argument(
+        "-s",
+        "--samples",
+        nargs="+",
+        default=None,
+        help="Samples in a batched barrnap run (contig names prefixed with "
+        "'<sample>|'). Use together with --output_dir.",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=pathlib.Path,
+        help="Directory in which a folder per sample is written when using "
+        "--samples.",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if args.samples is None and args.output is None:
+        parser.error("Use either --output or --samples with --output_dir.")
+    if args.samples is not None and args.output_dir is None:
+        parser.error("--samples requires --output_dir.")
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    main(args)
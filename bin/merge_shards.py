@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Merge the results of a juno-typing run that was split in shards (--shards and
+--shard_index, one output directory per shard). The MLST7 and serotyper
+multireports are made again from the results of every sample of all the
+shards, sorted by sample name, so the merged multireports do not depend on the
+order in which the shards are given or finished.
+"""
+
+import argparse
+import pathlib
+
+import pandas as pd
+import yaml
+
+from mlst7_multireport import extract_from_mlst7
+from serotyper_multireport import ChooseMultireport
+
+SHARD_FILE = "shard.yaml"
+
+# Result files used for the serotyper multireports (as in the
+# serotype_multireports rule)
+SEROTYPER_RESULT_FILES = [
+    "SeqSero_result_with_context.tsv",
+    "result_serotype.csv",
+    "command.txt",
+    "shigatyper.csv",
+    "shigella_screen.txt",
+    "neisseriatyper.tab",
+    "pred.tsv",
+]
+
+MLST7_COLUMNS = ["Sample", "ST_type", "Scheme_used", "genes_in_scheme", "alleles"]
+
+
+def read_shards(shard_dirs):
+    """
+    Read the shard number and sample sheet of every shard, and check that
+    they form one complete run
+
+    Returns
+    -------
+    dict
+        Sample name as key and the output directory of its shard as value
+    """
+    shard_indexes = {}
+    shard_counts = set()
+    sample_dirs = {}
+    for shard_dir in map(pathlib.Path, shard_dirs):
+        with open(shard_dir.joinpath("audit_trail", SHARD_FILE)) as file_:
+            shard = yaml.safe_load(file_)
+        with open(shard_dir.joinpath("audit_trail", "sample_sheet.yaml")) as file_:
+            samples = yaml.safe_load(file_) or {}
+        if shard["shard_index"] in shard_indexes:
+            raise ValueError(
+                f"Shard {shard['shard_index']} is given twice ({shard_dir} and "
+                f"{shard_indexes[shard['shard_index']]})"
+            )
+        shard_indexes[shard["shard_index"]] = shard_dir
+        shard_counts.add(shard["shards"])
+        for sample in samples:
+            if sample in sample_dirs:
+                raise ValueError(
+                    f"Sample {sample} is in more than one shard ({shard_dir} "
+                    f"and {sample_dirs[sample]})"
+                )
+            sample_dirs[sample] = shard_dir
+    if len(shard_counts) > 1:
+        raise ValueError(
+            "The shards were made with a different number of shards "
+            f"({', '.join(map(str, sorted(shard_counts)))})"
+        )
+    shard_count = shard_counts.pop()
+    missing = set(range(1, shard_count + 1)) - set(shard_indexes)
+    if missing:
+        raise ValueError(
+            f"The results of shard(s) {', '.join(map(str, sorted(missing)))} "
+            f"of {shard_count} are missing"
+        )
+    return sample_dirs
+
+
+def merge_mlst7(sample_dirs, output_file):
+    """MLST7 multireport of all the samples, sorted by sample name"""
+    multireport = [
+        extract_from_mlst7(
+            str(sample_dirs[sample].joinpath("mlst7", sample, "data.json"))
+        )
+        for sample in sorted(sample_dirs)
+    ]
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(multireport, columns=MLST7_COLUMNS).to_csv(output_file, index=False)
+
+
+def get_serotyper_result_files(sample_dirs):
+    """Serotyper results of all the samples, sorted by sample name"""
+    result_files = []
+    for sample in sorted(sample_dirs):
+        sample_dir = sample_dirs[sample].joinpath("serotype", sample)
+        result_files.extend(
+            str(sample_dir.joinpath(name))
+            for name in sorted(SEROTYPER_RESULT_FILES)
+            if sample_dir.joinpath(name).exists()
+        )
+    return result_files
+
+
+def merge_serotypes(sample_dirs, output_dir):
+    output_dir.mkdir(parents=True, exist_ok=True)
+    # Some multireports are appended to, so the ones of a previous merge are
+    # removed first
+    for multireport in output_dir.glob("serotyper_multireport*.csv"):
+        multireport.unlink()
+    result_files = get_serotyper_result_files(sample_dirs)
+    if len(result_files) == 0:
+        output_dir.joinpath("serotyper_multireport.csv").touch()
+    else:
+        ChooseMultireport(result_files, output_dir)
+
+
+def main(args):
+    sample_dirs = read_shards(args.shard_dirs)
+    merge_mlst7(sample_dirs, args.output_dir.joinpath("mlst7", "mlst7_multireport.csv"))
+    merge_serotypes(sample_dirs, args.output_dir.joinpath("serotype"))
+    audit_dir = args.output_dir.joinpath("audit_trail")
+    audit_dir.mkdir(parents=True, exist_ok=True)
+    with open(audit_dir.joinpath("merged_shards.yaml"), "w") as file_:
+        yaml.dump(
+            {sample: str(shard_dir) for sample, shard_dir in sample_dirs.items()},
+            file_,
+            default_flow_style=False,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-s",
+        "--shard_dirs",
+        nargs="+",
+        type=pathlib.Path,
+        required=True,
+        help="Output directories of all the shards of the run.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_dir",
+        type=pathlib.Path,
+        required=True,
+        help="Directory where the merged multireports are written.",
+    )
+    main(parser.parse_args())
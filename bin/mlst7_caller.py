@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Fast 7-locus MLST caller for samples in which every locus is an exact, known
+allele. A k-mer index is built once per MLST scheme (of the CGE mlst_db) and
+cached on disk. If any locus has a novel or ambiguous allele, no result is
+written and the script exits with FALLBACK_EXIT_CODE so that cge-mlst can be
+used instead. The output files follow the layout of cge-mlst (data.json,
+results.txt, results_tab.tsv, MLST_allele_seq.fsa and Hit_in_genome_seq.fsa).
+"""
+
+import argparse
+import fcntl
+import gzip
+import json
+import logging
+import pathlib
+import pickle
+import sys
+import time
+from collections import Counter
+
+from stage_db import get_db_version
+
+FALLBACK_EXIT_CODE = 3
+KMER_SIZE = 31
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+
+
+class FallbackToCgeMlst(Exception):
+    """The sample cannot be typed by exact matching of known alleles"""
+
+
+def reverse_complement(seq):
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def open_file(file_path):
+    with open(file_path, "rb") as fh:
+        gzipped = fh.read(2) == b"\x1f\x8b"
+    if gzipped:
+        return gzip.open(file_path, "rt")
+    return open(file_path)
+
+
+def read_fasta(file_path):
+    """Yield (name, sequence) for every record in a (gzipped) fasta file"""
+    name = None
+    seq = []
+    with open_file(file_path) as fasta:
+        for line in fasta:
+            line = line.strip()
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, "".join(seq).upper()
+                name = line[1:].split()[0]
+                seq = []
+            else:
+                seq.append(line)
+    if name is not None:
+        yield name, "".join(seq).upper()
+
+
+def read_fastq_sequences(file_path):
+    """Yield the sequence of every read in a (gzipped) fastq file"""
+    with open_file(file_path) as fastq:
+        for line_number, line in enumerate(fastq):
+            if line_number % 4 == 1:
+                yield line.strip().upper()
+
+
+def get_scheme_organism(mlst7_db, species):
+    """Get the organism name of a scheme from the config file of the database"""
+    config_file = pathlib.Path(mlst7_db).joinpath("config")
+    if config_file.exists():
+        with open(config_file) as config:
+            for line in config:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) > 1 and fields[0] == species:
+                    return fields[1]
+    return species
+
+
+def build_scheme_index(scheme_dir, species):
+    """
+    Build the k-mer index for one MLST scheme
+
+    Parameters
+    ----------
+    scheme_dir : Path
+        Directory of the scheme in the CGE mlst_db (e.g. mlst7_db/senterica)
+    species : str
+        Name of the scheme (e.g. senterica)
+
+    Returns
+    -------
+    dict
+        Index containing the allele sequences, the anchor k-mers used to find
+        alleles in an assembly, the k-mers of every allele (used for reads)
+        and the ST profiles
+    """
+    alleles = {}
+    for allele_name, seq in read_fasta(scheme_dir.joinpath(f"{species}.fsa")):
+        alleles[allele_name] = seq
+    loci = {allele_name.rsplit("_", 1)[0] for allele_name in alleles}
+
+    exact = {seq: allele_name for allele_name, seq in alleles.items()}
+    anchors = {}
+    kmer_ids = {}
+    allele_kmers = {}
+    for allele_name, seq in alleles.items():
+        if len(seq) < KMER_SIZE:
+            continue
+        anchors.setdefault(seq[:KMER_SIZE], set()).add(len(seq))
+        ids = set()
+        for i in range(len(seq) - KMER_SIZE + 1):
+            kmer = seq[i : i + KMER_SIZE]
+            if kmer not in kmer_ids:
+                # Both orientations share an id, so reads do not have to be
+                # reverse complemented
+                kmer_id = len(kmer_ids) // 2
+                kmer_ids[kmer] = kmer_id
+                kmer_ids.setdefault(reverse_complement(kmer), kmer_id)
+            ids.add(kmer_ids[kmer])
+        allele_kmers[allele_name] = sorted(ids)
+
+    with open(scheme_dir.joinpath(f"{species}.tsv")) as profiles_file:
+        header = profiles_file.readline().rstrip("\n").split("\t")
+        locus_order = [col for col in header[1:] if col in loci]
+        locus_columns = [header.index(locus) for locus in locus_order]
+        profiles = {}
+        for line in profiles_file:
+            fields = line.rstrip("\n").split("\t")
+            profile = tuple(fields[col] for col in locus_columns)
+            profiles[profile] = fields[0]
+
+    return {
+        "alleles": alleles,
+        "exact": exact,
+        "anchors": anchors,
+        "kmer_ids": kmer_ids,
+        "allele_kmers": allele_kmers,
+        "locus_order": locus_order,
+        "profiles": profiles,
+    }
+
+
+def load_scheme_index(mlst7_db, species, index_dir):
+    """
+    Load the k-mer index of a scheme from the cache, building it if it does
+    not exist yet or if the scheme has changed. A lock file makes sure that
+    only one job builds the index.
+    """
+    scheme_dir = pathlib.Path(mlst7_db).joinpath(species)
+    index_dir = pathlib.Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    version = get_db_version(scheme_dir)
+    index_file = index_dir.joinpath(f"{species}_{version[:12]}.pkl")
+    with open(index_dir.joinpath(f"{species}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not index_file.exists():
+            logging.info(f"Building k-mer index for {species} in {index_file}")
+            for old_index in index_dir.glob(f"{species}_*.pkl"):
+                old_index.unlink()
+            index = build_scheme_index(scheme_dir, species)
+            tmp_file = index_file.with_suffix(".tmp")
+            with open(tmp_file, "wb") as index_fh:
+                pickle.dump(index, index_fh, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_file.rename(index_file)
+            return index
+    logging.info(f"Loading k-mer index from {index_file}")
+    with open(index_file, "rb") as index_fh:
+        return pickle.load(index_fh)
+
+
+def find_alleles_in_assembly(index, assembly):
+    """Find every exact occurrence of a known allele in an assembly (both
+    strands). Returns a dictionary with the allele names found per locus"""
+    anchors = index["anchors"]
+    exact = index["exact"]
+    hits = {}
+    for _, contig in read_fasta(assembly):
+        for strand in (contig, reverse_complement(contig)):
+            for i in range(len(strand) - KMER_SIZE + 1):
+                lengths = anchors.get(strand[i : i + KMER_SIZE])
+                if lengths is None:
+                    continue
+                for length in lengths:
+                    allele_name = exact.get(strand[i : i + length])
+                    if allele_name is not None:
+                        locus = allele_name.rsplit("_", 1)[0]
+                        hits.setdefault(locus, set()).add(allele_name)
+    return hits
+
+
+def find_alleles_in_reads(index, reads, min_depth=2):
+    """Find the known alleles of which every k-mer is present in at least
+    min_depth reads. To keep this fast, only the non-overlapping k-mers of a
+    read are looked up first, and only the reads with a hit are scanned
+    completely. Returns a dictionary with the allele names found per locus"""
+    kmer_ids = index["kmer_ids"]
+    counts = Counter()
+    for read_file in reads:
+        for read in read_fastq_sequences(read_file):
+            last_kmer = len(read) - KMER_SIZE + 1
+            if not any(
+                read[i : i + KMER_SIZE] in kmer_ids
+                for i in range(0, last_kmer, KMER_SIZE)
+            ):
+                continue
+            for i in range(last_kmer):
+                kmer_id = kmer_ids.get(read[i : i + KMER_SIZE])
+                if kmer_id is not None:
+                    counts[kmer_id] += 1
+    hits = {}
+    for allele_name, ids in index["allele_kmers"].items():
+        if all(counts[kmer_id] >= min_depth for kmer_id in ids):
+            locus = allele_name.rsplit("_", 1)[0]
+            hits.setdefault(locus, set()).add(allele_name)
+    return hits
+
+
+def call_profile(index, hits):
+    """
+    Choose one allele per locus and find the sequence type
+
+    Raises
+    ------
+    FallbackToCgeMlst
+        If a locus has no known allele (novel allele) or more than one
+    """
+    called = {}
+    for locus in index["locus_order"]:
+        alleles = hits.get(locus, set())
+        if len(alleles) == 0:
+            raise FallbackToCgeMlst(f"No exact known allele found for {locus}")
+        if len(alleles) > 1:
+            raise FallbackToCgeMlst(
+                f"More than one allele found for {locus}: {', '.join(sorted(alleles))}"
+            )
+        called[locus] = alleles.pop()
+    sequence_type = index["profiles"].get(get_profile(index, called), "Unknown")
+    return called, sequence_type
+
+
+def get_profile(index, called):
+    """Allele numbers of the called alleles, in the order of the scheme"""
+    return tuple(called[locus].rsplit("_", 1)[1] for locus in index["locus_order"])
+
+
+def find_nearest_sts(index, called):
+    """
+    Find the known profiles closest to a profile without ST
+
+    Returns
+    -------
+    tuple
+        STs of the profiles that differ at the fewest loci (sorted) and the
+        number of loci at which they differ (None if the scheme has no
+        profiles)
+    """
+    profile = get_profile(index, called)
+    sts_per_mismatches = {}
+    for known_profile, sequence_type in index["profiles"].items():
+        mismatches = sum(a != b for a, b in zip(profile, known_profile))
+        sts_per_mismatches.setdefault(mismatches, []).append(sequence_type)
+    if not sts_per_mismatches:
+        return [], None
+    fewest = min(sts_per_mismatches)
+    nearest_sts = sorted(
+        sts_per_mismatches[fewest],
+        key=lambda st: (not st.isdigit(), int(st) if st.isdigit() else 0, st),
+    )
+    return nearest_sts, fewest
+
+
+def write_results(
+    index,
+    called,
+    sequence_type,
+    input_files,
+    file_format,
+    species,
+    organism,
+    out,
+    nearest_sts=(),
+    mismatches=None,
+):
+    out = pathlib.Path(out)
+    out.mkdir(parents=True, exist_ok=True)
+    allele_profile = {}
+    for locus, allele_name in called.items():
+        allele_length = len(index["alleles"][allele_name])
+        allele_profile[locus] = {
+            "identity": 100.0,
+            "coverage": 100.0,
+            "allele": allele_name.rsplit("_", 1)[1],
+            "allele_name": allele_name,
+            "align_len": allele_length,
+            "gaps": 0,
+            "sbj_len": allele_length,
+        }
+    notes = "Called by exact matching of known alleles (mlst7_caller.py)"
+    if nearest_sts:
+        notes += (
+            f". No ST for this profile, the nearest ST(s) differ at {mismatches} "
+            f"of {len(called)} loci"
+        )
+    data = {
+        "mlst": {
+            "user_input": {
+                "filename": [pathlib.Path(file_).name for file_ in input_files],
+                "species": species,
+                "organism": organism,
+                "file_format": file_format,
+            },
+            "run_info": {
+                "date": time.strftime("%d.%m.%Y"),
+                "time": time.strftime("%H:%M:%S"),
+            },
+            "results": {
+                "sequence_type": sequence_type,
+                "allele_profile": allele_profile,
+                "nearest_sts": ", ".join(nearest_sts),
+                "notes": notes,
+            },
+        }
+    }
+    with open(out.joinpath("data.json"), "w") as json_file:
+        json.dump(data, json_file, indent=4)
+
+    with open(out.joinpath("results_tab.tsv"), "w") as tab_file:
+        tab_file.write(
+            "Locus\tIdentity\tCoverage\tAlignment Length\tAllele Length\tGaps\tAllele\n"
+        )
+        for locus, hit in allele_profile.items():
+            tab_file.write(
+                f"{locus}\t{hit['identity']}\t{hit['coverage']}\t{hit['align_len']}"
+                f"\t{hit['sbj_len']}\t{hit['gaps']}\t{hit['allele_name']}\n"
+            )
+
+    with open(out.joinpath("results.txt"), "w") as txt_file:
+        txt_file.write(
+            f"MLST Results\n\nOrganism: {organism}\nSequence Type: {sequence_type}\n"
+        )
+        if nearest_sts:
+            txt_file.write(
+                f"Nearest ST: {', '.join(nearest_sts)} ({mismatches} mismatching "
+                "loci)\n"
+            )
+        txt_file.write("\n")
+        txt_file.write("Locus\tIdentity\tCoverage\tAlignment Length\tAllele\n")
+        for locus, hit in allele_profile.items():
+            txt_file.write(
+                f"{locus}\t{hit['identity']}\t{hit['coverage']}\t{hit['align_len']}"
+                f"\t{hit['allele_name']}\n"
+            )
+
+    for fasta_name in ["MLST_allele_seq.fsa", "Hit_in_genome_seq.fsa"]:
+        with open(out.joinpath(fasta_name), "w") as fasta_file:
+            for allele_name in called.values():
+                fasta_file.write(f">{allele_name}\n{index['alleles'][allele_name]}\n")
+
+
+def main(args):
+    with open_file(args.input[0]) as first_file:
+        file_format = "fastq" if first_file.read(1) == "@" else "fasta"
+    index = load_scheme_index(args.database, args.species, args.index_dir)
+    try:
+        if file_format == "fasta":
+            hits = find_alleles_in_assembly(index, args.input[0])
+        else:
+            hits = find_alleles_in_reads(index, args.input, args.min_depth)
+        called, sequence_type = call_profile(index, hits)
+    except FallbackToCgeMlst as err:
+        print(f"Falling back to cge-mlst: {err}", file=sys.stderr)
+        sys.exit(FALLBACK_EXIT_CODE)
+    nearest_sts, mismatches = [], None
+    if sequence_type == "Unknown":
+        nearest_sts, mismatches = find_nearest_sts(index, called)
+    write_results(
+        index,
+        called,
+        sequence_type,
+        args.input,
+        file_format,
+        args.species,
+        get_scheme_organism(args.database, args.species),
+        args.output,
+        nearest_sts,
+        mismatches,
+    )
+    print(f"Sequence type: {sequence_type}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-i",
+        "--input",
+        nargs="+",
+        required=True,
+        help="Assembly (fasta) or paired reads (fastq) of one sample.",
+    )
+    parser.add_argument("-o", "--output", type=pathlib.Path, required=True)
+    parser.add_argument(
+        "-s", "--species", required=True, help="MLST scheme (e.g. senterica)."
+    )
+    parser.add_argument("--database", type=pathlib.Path, required=True)
+    parser.add_argument(
+        "--index_dir",
+        type=pathlib.Path,
+        required=True,
+        help="Directory where the k-mer indexes of the schemes are cached.",
+    )
+    parser.add_argument(
+        "--min_depth",
+        type=int,
+        default=2,
+        help="Minimum number of reads supporting every k-mer of an allele.",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    main(args)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Index of the sequence type (ST) profiles of all the schemes in the MLST7
+database (CGE mlst_db). The index is a SQLite file next to the database
+(<db_dir>/mlst7_profile_index), keyed by scheme and allele numbers, and it is
+rebuilt whenever the profiles change (or built in memory when the database
+directory is read-only). It is not written inside the database,
+so the database itself (and the version of its staged copies) does not change
+when the index is built. It can be used to re-assign the STs of an existing MLST7 multireport
+after a profile update, without typing the samples again.
+"""
+
+import argparse
+import hashlib
+import os
+import pathlib
+import sqlite3
+
+import pandas as pd
+
+INDEX_DIR = "mlst7_profile_index"
+INDEX_NAME = "st_profile_index.sqlite"
+
+
+def get_index_file(mlst7_db):
+    return pathlib.Path(mlst7_db).parent.joinpath(INDEX_DIR, INDEX_NAME)
+
+
+def get_profiles_version(mlst7_db):
+    """Hash of the config file and the profile tables of every scheme"""
+    mlst7_db = pathlib.Path(mlst7_db)
+    signature = hashlib.sha1()
+    for file_ in [mlst7_db.joinpath("config"), *sorted(mlst7_db.glob("*/*.tsv"))]:
+        if file_.is_file():
+            signature.update(str(file_.relative_to(mlst7_db)).encode())
+            signature.update(file_.read_bytes())
+    return signature.hexdigest()
+
+
+def read_schemes(mlst7_db):
+    """Organism and loci of every scheme (db prefix), as listed in the
+    database config"""
+    schemes = {}
+    with open(pathlib.Path(mlst7_db).joinpath("config")) as config:
+        for line in config:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) > 1:
+                loci = fields[2].split(",") if len(fields) > 2 else []
+                schemes[fields[0]] = (fields[1], [locus.strip() for locus in loci])
+    return schemes
+
+
+def fill_profile_index(connection, mlst7_db, version):
+    """Write the tables with the ST profiles of every scheme"""
+    mlst7_db = pathlib.Path(mlst7_db)
+    with connection:
+        connection.execute("CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute(
+            "CREATE TABLE schemes (scheme TEXT PRIMARY KEY, organism TEXT, loci TEXT)"
+        )
+        connection.execute(
+            "CREATE TABLE profiles (scheme TEXT, alleles TEXT, st TEXT, "
+            "PRIMARY KEY (scheme, alleles))"
+        )
+        connection.execute("INSERT INTO metadata VALUES ('version', ?)", (version,))
+        for scheme, (organism, loci) in read_schemes(mlst7_db).items():
+            profile_file = mlst7_db.joinpath(scheme, f"{scheme}.tsv")
+            if not profile_file.is_file():
+                continue
+            with open(profile_file) as profiles:
+                header = profiles.readline().rstrip("\n").split("\t")
+                # Some profile tables have extra columns after the loci
+                # (e.g. clonal_complex)
+                if not loci or not set(loci).issubset(header):
+                    loci = [col for col in header[1:] if col != "clonal_complex"]
+                locus_columns = [header.index(locus) for locus in loci]
+                connection.execute(
+                    "INSERT INTO schemes VALUES (?, ?, ?)",
+                    (scheme, organism, "-".join(loci)),
+                )
+                for line in profiles:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) <= max(locus_columns):
+                        continue
+                    connection.execute(
+                        "INSERT OR REPLACE INTO profiles VALUES (?, ?, ?)",
+                        (
+                            scheme,
+                            "-".join(fields[col] for col in locus_columns),
+                            fields[0],
+                        ),
+                    )
+
+
+def build_profile_index(mlst7_db, version):
+    """Write the SQLite index file with the ST profiles of every scheme"""
+    index_file = get_index_file(mlst7_db)
+    index_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = index_file.with_suffix(".tmp")
+    tmp_file.unlink(missing_ok=True)
+    connection = sqlite3.connect(tmp_file)
+    fill_profile_index(connection, mlst7_db, version)
+    connection.close()
+    tmp_file.rename(index_file)
+    return index_file
+
+
+def connect_read_only(index_file):
+    return sqlite3.connect(
+        f"{pathlib.Path(index_file).resolve().as_uri()}?mode=ro", uri=True
+    )
+
+
+def is_up_to_date(index_file, version):
+    """Whether the index file exists and was built from the current profiles"""
+    if not index_file.exists():
+        return False
+    connection = connect_read_only(index_file)
+    try:
+        current_version = connection.execute(
+            "SELECT value FROM metadata WHERE key = 'version'"
+        ).fetchone()
+    except sqlite3.DatabaseError:
+        current_version = None
+    finally:
+        connection.close()
+    return current_version is not None and current_version[0] == version
+
+
+def can_write(index_file):
+    """Whether the index file can be (re)built, checking the nearest
+    existing parent if the index directory does not exist yet"""
+    directory = index_file.parent
+    while not directory.exists():
+        directory = directory.parent
+    return os.access(directory, os.W_OK | os.X_OK)
+
+
+def update_profile_index(mlst7_db):
+    """Build the index if it does not exist or if the profiles changed"""
+    index_file = get_index_file(mlst7_db)
+    version = get_profiles_version(mlst7_db)
+    if is_up_to_date(index_file, version):
+        return index_file
+    print(f"Building ST profile index {index_file}")
+    return build_profile_index(mlst7_db, version)
+
+
+def open_profile_index(mlst7_db):
+    """Connection to the ST profile index. An up-to-date index is opened
+    read-only, so it can be used on a read-only (shared) database. A missing
+    or outdated index is rebuilt if possible, and otherwise built in memory"""
+    index_file = get_index_file(mlst7_db)
+    version = get_profiles_version(mlst7_db)
+    if is_up_to_date(index_file, version):
+        return connect_read_only(index_file)
+    if can_write(index_file):
+        print(f"Building ST profile index {index_file}")
+        return connect_read_only(build_profile_index(mlst7_db, version))
+    print(
+        f"The ST profile index {index_file} is missing or outdated and cannot "
+        "be written. Building it in memory instead."
+    )
+    connection = sqlite3.connect(":memory:")
+    fill_profile_index(connection, mlst7_db, version)
+    return connection
+
+
+class StProfileIndex:
+    """Look up sequence types in the ST profile index"""
+
+    def __init__(self, mlst7_db):
+        self.connection = open_profile_index(mlst7_db)
+        self.schemes = {
+            organism: (scheme, loci.split("-"))
+            for scheme, organism, loci in self.connection.execute(
+                "SELECT scheme, organism, loci FROM schemes"
+            )
+        }
+
+    def get_st(self, organism, genes, alleles):
+        """
+        Get the ST for an allele profile
+
+        Parameters
+        ----------
+        organism : str
+            Organism of the scheme, as reported in the multireport (Scheme_used)
+        genes : list
+            Loci in the same order as alleles
+        alleles : list
+            Allele numbers
+
+        Returns
+        -------
+        str or None
+            ST, 'Unknown' if the profile is not in the scheme or None if the
+            ST cannot be re-assigned (unknown scheme or non-exact alleles)
+        """
+        if organism not in self.schemes:
+            return None
+        scheme, loci = self.schemes[organism]
+        allele_per_locus = dict(zip(genes, alleles))
+        if set(allele_per_locus) != set(loci):
+            return None
+        # Alleles can be reported as number or as name (e.g. aroC_10)
+        profile = [
+            allele_per_locus[locus].replace(f"{locus}_", "", 1) for locus in loci
+        ]
+        if not all(allele.isdigit() for allele in profile):
+            return None
+        result = self.connection.execute(
+            "SELECT st FROM profiles WHERE scheme = ? AND alleles = ?",
+            (scheme, "-".join(profile)),
+        ).fetchone()
+        return "Unknown" if result is None else result[0]
+
+
+def reassign_sts(multireport, profile_index):
+    """Re-assign the STs of an MLST7 multireport (as made by
+    mlst7_multireport.py). The previous ST is kept in a new column"""
+    multireport = multireport.copy()
+    multireport["previous_ST_type"] = multireport["ST_type"]
+    new_sts = []
+    for _, row in multireport.iterrows():
+        new_st = profile_index.get_st(
+            row["Scheme_used"],
+            str(row["genes_in_scheme"]).split("-"),
+            str(row["alleles"]).split("-"),
+        )
+        new_sts.append(row["ST_type"] if new_st is None else new_st)
+    multireport["ST_type"] = new_sts
+    return multireport
+
+
+def main(args):
+    profile_index = StProfileIndex(args.database)
+    multireport = pd.read_csv(args.input, dtype=str)
+    updated = reassign_sts(multireport, profile_index)
+    updated.to_csv(args.output, index=False)
+    changed = updated[updated["ST_type"] != updated["previous_ST_type"]]
+    print(f"ST changed for {changed.shape[0]} of {updated.shape[0]} samples.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-d",
+        "--database",
+        type=pathlib.Path,
+        required=True,
+        help="Path to the MLST7 database (<db_dir>/mlst7_db).",
+    )
+    parser.add_argument(
+        "-i",
+        "--input",
+        type=pathlib.Path,
+        required=True,
+        help="MLST7 multireport (mlst7/mlst7_multireport.csv).",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=pathlib.Path,
+        required=True,
+        help="Output csv with the re-assigned STs.",
+    )
+    main(parser.parse_args())
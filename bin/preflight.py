@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Pre-flight check of the input files of juno-typing. Before any job is
+scheduled, the reads and the assembly of every sample are read completely (in
+parallel) to check that gzipped files are not corrupt or truncated, that no
+file is empty and that the reads are fastq and the assembly fasta. Basic
+statistics are collected on the way (number of reads, total bases, assembly
+length, N50 and the uncompressed size of every file). The results are
+remembered per file (by path, size and modification time), so every file is
+only read once.
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import yaml
+
+RESULTS_FILE = "preflight.json"
+
+# Input file in the sample sheet -> expected format
+SAMPLE_FILES = {"R1": "fastq", "R2": "fastq", "assembly": "fasta"}
+
+REPORT_COLUMNS = [
+    "sample",
+    "status",
+    "read_count",
+    "total_bases",
+    "contigs",
+    "assembly_length",
+    "n50",
+    "errors",
+]
+
+
+def is_gzipped(file_path):
+    """Returns True if file is gzipped and False otherwise (same test as in
+    serotypefinder.py: the first two bytes are 1f 8b)"""
+    with open(file_path, mode="rb") as fh:
+        bit_start = fh.read(2)
+    return bit_start == b"\x1f\x8b"
+
+
+def open_input(file_path):
+    if is_gzipped(file_path):
+        return gzip.open(file_path, "rb")
+    return open(file_path, "rb")
+
+
+def get_file_format(file_path):
+    """fasta, fastq, other or empty, from the first character of the
+    (uncompressed) file, as in serotypefinder.py"""
+    with open_input(file_path) as file_:
+        first_char = file_.read(1)
+    if first_char == b"":
+        return "empty"
+    if first_char == b"@":
+        return "fastq"
+    if first_char == b">":
+        return "fasta"
+    return "other"
+
+
+def check_fastq(file_path):
+    """Number of reads, total bases and uncompressed size of a fastq file.
+    Raises a ValueError if a record is incomplete."""
+    reads = 0
+    bases = 0
+    size = 0
+    with open_input(file_path) as fastq:
+        while True:
+            header = fastq.readline()
+            if not header:
+                break
+            sequence = fastq.readline()
+            separator = fastq.readline()
+            quality = fastq.readline()
+            size += len(header) + len(sequence) + len(separator) + len(quality)
+            if (
+                not header.startswith(b"@")
+                or not separator.startswith(b"+")
+                or len(sequence.rstrip()) != len(quality.rstrip())
+            ):
+                raise ValueError(f"invalid or incomplete fastq record {reads + 1}")
+            reads += 1
+            bases += len(sequence.rstrip())
+    return {"read_count": reads, "total_bases": bases, "uncompressed_size": size}
+
+
+def get_n50(lengths):
+    half_length = sum(lengths) / 2
+    cumulative_length = 0
+    for length in sorted(lengths, reverse=True):
+        cumulative_length += length
+        if cumulative_length >= half_length:
+            return length
+    return 0
+
+
+def check_fasta(file_path):
+    """Number of contigs, assembly length, N50 and uncompressed size of a
+    fasta file. Raises a ValueError for empty sequences or an incomplete last
+    line (truncated file)."""
+    lengths = []
+    size = 0
+    line = b""
+    with open_input(file_path) as fasta:
+        for line in fasta:
+            size += len(line)
+            if line.startswith(b">"):
+                lengths.append(0)
+            else:
+                lengths[-1] += len(line.strip())
+    if not line.endswith(b"\n"):
+        raise ValueError("the last line is incomplete (truncated file?)")
+    if 0 in lengths:
+        raise ValueError(f"contig {lengths.index(0) + 1} has no sequence")
+    return {
+        "contigs": len(lengths),
+        "assembly_length": sum(lengths),
+        "n50": get_n50(lengths),
+        "uncompressed_size": size,
+    }
+
+
+def check_file(file_path, expected_format):
+    """
+    Check one input file
+
+    Returns
+    -------
+    tuple
+        Statistics of the file (None if it failed) and error message (None if
+        it passed)
+    """
+    try:
+        file_format = get_file_format(file_path)
+        if file_format == "empty":
+            raise ValueError("empty file")
+        if file_format != expected_format:
+            raise ValueError(f"{file_format} file (expected {expected_format})")
+        if expected_format == "fastq":
+            return check_fastq(file_path), None
+        return check_fasta(file_path), None
+    except (EOFError, gzip.BadGzipFile, zlib.error) as error:
+        return None, f"corrupt gzip file ({error})"
+    except (OSError, ValueError) as error:
+        return None, str(error)
+
+
+def run_preflight(samples, results_file, threads=4):
+    """
+    Check the input files of all samples
+
+    Parameters
+    ----------
+    samples : dict
+        Sample sheet (with the R1, R2 and/or assembly files of every sample)
+    results_file : Path
+        File where the results of every checked file are remembered
+    threads : int
+        Number of files checked in parallel
+
+    Returns
+    -------
+    tuple
+        Statistics per sample ({sample: stats}) and errors of the samples that
+        failed ({sample: [errors]})
+    """
+    results = {}
+    if Path(results_file).exists():
+        with open(results_file) as file_:
+            results = json.load(file_)
+
+    def signature(file_path, expected_format):
+        stat = os.stat(file_path)
+        return (
+            f"{Path(file_path).resolve()}\t{stat.st_size}\t{stat.st_mtime_ns}"
+            f"\t{expected_format}"
+        )
+
+    signatures = {}
+    errors = {}
+    for sample, sample_info in samples.items():
+        for key, expected_format in SAMPLE_FILES.items():
+            if key not in sample_info:
+                continue
+            try:
+                signatures[(sample, key)] = signature(sample_info[key], expected_format)
+            except FileNotFoundError:
+                errors.setdefault(sample, []).append(f"{key}: file not found")
+    to_check = {}
+    for (sample, key), file_signature in signatures.items():
+        if file_signature not in results:
+            to_check[file_signature] = (samples[sample][key], SAMPLE_FILES[key])
+    if to_check:
+        with ProcessPoolExecutor(max_workers=threads) as executor:
+            checked = executor.map(check_file, *zip(*to_check.values()))
+            for file_signature, (stats, error) in zip(to_check, checked):
+                results[file_signature] = {"stats": stats, "error": error}
+        tmp_file = Path(results_file).with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "w") as file_:
+            json.dump(results, file_)
+        tmp_file.rename(results_file)
+
+    stats = {}
+    for (sample, key), file_signature in signatures.items():
+        result = results[file_signature]
+        if result["error"] is not None:
+            errors.setdefault(sample, []).append(f"{key}: {result['error']}")
+            continue
+        sample_stats = stats.setdefault(sample, {"uncompressed_size": {}})
+        sample_stats["uncompressed_size"][key] = result["stats"]["uncompressed_size"]
+        for name, value in result["stats"].items():
+            if name in ["read_count", "total_bases"]:
+                sample_stats[name] = sample_stats.get(name, 0) + value
+            elif name != "uncompressed_size":
+                sample_stats[name] = value
+    for sample in errors:
+        stats.pop(sample, None)
+    for sample in stats:
+        read_counts = {
+            results[signatures[(sample, key)]]["stats"]["read_count"]
+            for key in ["R1", "R2"]
+            if (sample, key) in signatures
+        }
+        if len(read_counts) > 1:
+            errors[sample] = ["R1 and R2 have a different number of reads"]
+    for sample in errors:
+        stats.pop(sample, None)
+    return stats, errors
+
+
+def write_report(samples, stats, errors, output):
+    """One row per sample with its statistics or the reason it failed"""
+    with open(output, "w", newline="") as file_:
+        writer = csv.DictWriter(file_, fieldnames=REPORT_COLUMNS, restval="")
+        writer.writeheader()
+        for sample in samples:
+            row = {"sample": sample}
+            if sample in errors:
+                row.update(status="failed", errors="; ".join(errors[sample]))
+            else:
+                row.update(status="passed", **stats.get(sample, {}))
+                row.pop("uncompressed_size", None)
+            writer.writerow(row)
+
+
+def main(args):
+    with open(args.sample_sheet) as file_:
+        samples = yaml.safe_load(file_)
+    stats, errors = run_preflight(samples, args.results_file, args.threads)
+    write_report(samples, stats, errors, args.output)
+    for sample, sample_errors in errors.items():
+        print(f"{sample}: {'; '.join(sample_errors)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-s",
+        "--sample_sheet",
+        type=Path,
+        required=True,
+        help="Sample sheet (e.g. <output>/audit_trail/sample_sheet.yaml).",
+    )
+    parser.add_argument(
+        "-r",
+        "--results_file",
+        type=Path,
+        default=Path(RESULTS_FILE),
+        help="File where the results of every checked file are remembered.",
+    )
+    parser.add_argument("-t", "--threads", type=int, default=4)
+    parser.add_argument("-o", "--output", type=Path, required=True)
+    main(parser.parse_args())
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Result cache shared between juno-typing runs. The outputs of a typer are
+stored under a key that is the hash of the content of its input files (reads
+or assembly), the conda environment of the tool, the parameters that change
+its results and the versions of the software and databases it uses (as
+listed in audit_trail/database_versions.yaml, or the content of the scheme
+or database used for the sample). Before the pipeline starts,
+the outputs of all the jobs with a cached result are restored in the output
+directory, so Snakemake does not schedule those jobs. The jobs that do run
+store their outputs in the cache.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+MANIFEST = "manifest.json"
+FILE_HASHES = "file_hashes.json"
+
+# Typers whose results are cached. For every rule: the genera it runs for
+# (None for every sample with an MLST7 scheme), the input files in the sample
+# sheet, its conda environment and the keys of the software versions and of
+# the user parameters that affect its results. The databases are included
+# through their content (see db_update_impact.py), so a database update
+# only changes the keys of the samples whose scheme or database changed.
+CACHED_RULES = {
+    "mlst7": {
+        "genera": None,
+        "inputs": ["R1", "R2"],
+        "env": "envs/mlst7.yaml",
+        "versions": ["mlst7"],
+        "parameters": ["mlst7", "subsample"],
+    },
+    "salmonella_serotyper": {
+        "genera": ["salmonella"],
+        "inputs": ["R1", "R2"],
+        "env": "envs/seqsero.yaml",
+        "versions": [],
+        "parameters": ["seqsero", "seqsero_context", "subsample"],
+    },
+    "ecoli_serotyper": {
+        "genera": ["escherichia", "shigella"],
+        "inputs": ["assembly"],
+        "env": "envs/serotypefinder.yaml",
+        "versions": [],
+        "parameters": ["serotypefinder"],
+    },
+    "seroba": {
+        "genera": ["streptococcus"],
+        "inputs": ["R1", "R2"],
+        "env": "envs/seroba.yaml",
+        "versions": [],
+        "parameters": ["seroba", "subsample"],
+    },
+    "shigatyper": {
+        "genera": ["escherichia", "shigella"],
+        "inputs": ["R1", "R2"],
+        "env": "envs/shigatyper.yaml",
+        "versions": [],
+        "parameters": ["subsample"],
+    },
+}
+
+
+def hash_file(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as file_:
+        for block in iter(lambda: file_.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def hash_files(file_paths, store_dir, threads=4):
+    """
+    Content hash of every file. Hashes are remembered in the store (by path,
+    size and modification time), so files are only read once.
+
+    Returns
+    -------
+    dict
+        File path as key and hash as value
+    """
+    memo_file = Path(store_dir).joinpath(FILE_HASHES)
+    memo = {}
+    if memo_file.exists():
+        with open(memo_file) as file_:
+            memo = json.load(file_)
+
+    def signature(file_path):
+        stat = os.stat(file_path)
+        return f"{Path(file_path).resolve()}\t{stat.st_size}\t{stat.st_mtime_ns}"
+
+    signatures = {file_path: signature(file_path) for file_path in set(file_paths)}
+    to_hash = [f for f, sig in signatures.items() if sig not in memo]
+    logging.info(f"Hashing {len(to_hash)} input file(s) for the result cache")
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for file_path, file_hash in zip(to_hash, executor.map(hash_file, to_hash)):
+            memo[signatures[file_path]] = file_hash
+    if to_hash:
+        tmp_file = memo_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "w") as file_:
+            json.dump(memo, file_)
+        tmp_file.rename(memo_file)
+    return {file_path: memo[sig] for file_path, sig in signatures.items()}
+
+
+def get_cache_keys(
+    samples, parameters, versions, get_db_content, store_dir, pipeline_dir
+):
+    """
+    Cache key of every sample for every cached rule
+
+    Parameters
+    ----------
+    samples : dict
+        Sample sheet (with genus and species-mlst7 for every sample)
+    parameters : dict
+        User parameters of the run (Snakemake config)
+    versions : dict
+        Software and database versions (downloaded_versions)
+    get_db_content : callable
+        Function returning the content (hash) of the database used by a rule
+        for a sample, given the rule and the sample info (see
+        db_update_impact.py)
+    store_dir : Path
+        Directory of the result cache
+    pipeline_dir : Path
+        Directory of the pipeline (to find the conda environments)
+
+    Returns
+    -------
+    dict
+        {rule: {sample: key}}
+    """
+    selected = {}
+    for rule, spec in CACHED_RULES.items():
+        input_keys = spec["inputs"]
+        if rule == "mlst7" and parameters["mlst7"]["input"] == "assembly":
+            input_keys = ["assembly"]
+        for sample, sample_info in samples.items():
+            if spec["genera"] is None:
+                if sample_info.get("species-mlst7") is None:
+                    continue
+            elif sample_info["genus"] not in spec["genera"]:
+                continue
+            selected[(rule, sample)] = [sample_info[key] for key in input_keys]
+    file_hashes = hash_files(
+        [f for files in selected.values() for f in files], store_dir
+    )
+    env_hashes = {
+        rule: hash_file(Path(pipeline_dir).joinpath(spec["env"]))
+        for rule, spec in CACHED_RULES.items()
+    }
+    keys = {rule: {} for rule in CACHED_RULES}
+    for (rule, sample), input_files in selected.items():
+        spec = CACHED_RULES[rule]
+        description = {
+            "rule": rule,
+            "inputs": [file_hashes[f] for f in input_files],
+            "env": env_hashes[rule],
+            "versions": {key: str(versions.get(key)) for key in spec["versions"]},
+            "parameters": {key: parameters.get(key) for key in spec["parameters"]},
+            "database": get_db_content(rule, samples[sample]),
+        }
+        if rule == "mlst7":
+            description["species"] = samples[sample]["species-mlst7"]
+        keys[rule][sample] = hashlib.sha256(
+            json.dumps(description, sort_keys=True, default=str).encode()
+        ).hexdigest()
+    return keys
+
+
+def get_entry_dir(store_dir, key):
+    return Path(store_dir).joinpath("entries", key[:2], key)
+
+
+def store(store_dir, key, output_dir, outputs):
+    """Copy the outputs of a job (paths inside output_dir) to the cache"""
+    entry_dir = get_entry_dir(store_dir, key)
+    if entry_dir.exists():
+        return
+    tmp_dir = entry_dir.with_name(f"{key}.{os.getpid()}.tmp")
+    files = []
+    for output in outputs:
+        relative_path = Path(output).resolve().relative_to(Path(output_dir).resolve())
+        tmp_dir.joinpath(relative_path).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(output, tmp_dir.joinpath(relative_path))
+        files.append(str(relative_path))
+    with open(tmp_dir.joinpath(MANIFEST), "w") as manifest:
+        json.dump({"files": files, "created": time.time()}, manifest)
+    try:
+        tmp_dir.rename(entry_dir)
+    except OSError:
+        # Another job stored the same result in the meantime
+        shutil.rmtree(tmp_dir)
+
+
+def restore(store_dir, key, output_dir):
+    """
+    Copy a cached result to the output directory
+
+    Returns
+    -------
+    bool
+        True if the result was restored. Nothing is restored (False) if the
+        key is not cached or if any of its outputs already exists.
+    """
+    entry_dir = get_entry_dir(store_dir, key)
+    manifest_file = entry_dir.joinpath(MANIFEST)
+    if not manifest_file.exists():
+        return False
+    with open(manifest_file) as manifest:
+        files = json.load(manifest)["files"]
+    if any(Path(output_dir).joinpath(file_).exists() for file_ in files):
+        return False
+    for file_ in files:
+        destination = Path(output_dir).joinpath(file_)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        # copy (not copy2) so the restored file is newer than the inputs
+        shutil.copy(entry_dir.joinpath(file_), destination)
+    manifest_file.touch()
+    return True
+
+
+def restore_results(store_dir, keys, output_dir):
+    """Restore all cached results. Returns the number of restored jobs"""
+    restored = 0
+    for rule, sample_keys in keys.items():
+        for sample, key in sample_keys.items():
+            if restore(store_dir, key, output_dir):
+                logging.info(f"Restored cached result of {rule} for {sample}")
+                restored += 1
+    return restored
+
+
+def evict(store_dir, max_size_gb):
+    """Remove the least recently used results until the cache is smaller than
+    max_size_gb"""
+    entries = []
+    for manifest_file in Path(store_dir).glob(f"entries/*/*/{MANIFEST}"):
+        entry_dir = manifest_file.parent
+        size = sum(f.stat().st_size for f in entry_dir.rglob("*") if f.is_file())
+        entries.append((manifest_file.stat().st_mtime, size, entry_dir))
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry_dir in sorted(entries):
+        if total_size <= max_size_gb * 1024**3:
+            break
+        logging.info(f"Removing cached result {entry_dir.name}")
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Store the outputs of a job in the juno-typing result cache."
+    )
+    parser.add_argument("-s", "--store_dir", type=Path, required=True)
+    parser.add_argument(
+        "-k",
+        "--key",
+        default="",
+        help="Cache key of the job. Nothing is stored if it is empty.",
+    )
+    parser.add_argument("-o", "--output_dir", type=Path, required=True)
+    parser.add_argument("outputs", nargs="+", type=Path)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    if args.key:
+        store(args.store_dir, args.key, args.output_dir, args.outputs)
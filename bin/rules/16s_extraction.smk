@@ -1,41 +1,167 @@
 # ---------------------------- 16S extraction --------------------------------#
 
 
-rule barrnap:
-    input:
-        assembly=lambda wildcards: SAMPLES[wildcards.sample]["assembly"],
-    output:
-        OUT + "/16s/{sample}/barrnap_result.fasta",
-        temp(OUT + "/16s/{sample}/temp_barrnap_input.fasta"),
-        temp(OUT + "/16s/{sample}/temp_barrnap_input.fasta.fai"),
-    message:
-        "Running Barrnap for {wildcards.sample}."
-    log:
-        OUT + "/log/16s/{sample}_barrnap.log",
-    conda:
-        "../../envs/16s.yaml"
-    threads: config["threads"]["barrnap"]
-    resources:
-        mem_gb=config["mem_gb"]["barrnap"],
-    shell:
-        """
-        cp {input.assembly:q} {output[1]:q}
-        barrnap {output[1]:q} --outseq {output[0]:q} 2>&1 {log:q}
-        """
-
-
-from Bio import SeqIO
-
-
-rule extract_16s_from_barrnap:
-    input:
-        OUT + "/16s/{sample}/barrnap_result.fasta",
-    output:
-        OUT + "/16s/{sample}/16S_seq.fasta",
-    resources:
-        mem_gb=1,
-    run:
-        records = SeqIO.parse(input[0], "fasta")
-        SeqIO.write(
-            (r for r in records if r.id.startswith("16S_rRNA")), output[0], "fasta"
-        )
+import hashlib
+
+
+def get_barrnap_batch(sample, n_batches):
+    """Batch (0 to n_batches - 1) of a sample, chosen by jump consistent
+    hashing of the sample name. It does not depend on the other samples or
+    their order, and when the number of batches grows only the samples that
+    move to the new batch change batch, so adding samples to a run does not
+    re-run the batches of the samples that were already there."""
+    key = int(hashlib.sha1(sample.encode()).hexdigest()[:16], 16)
+    batch, next_batch = -1, 0
+    while next_batch < n_batches:
+        batch = next_batch
+        key = (key * 2862933555777941757 + 1) % 2**64
+        next_batch = int((batch + 1) * (2**31 / ((key >> 33) + 1)))
+    return batch
+
+
+def samples_regex(samples):
+    """Regular expression matching exactly the given sample names. The names
+    are combined in a trie, so matching a file name takes time proportional to
+    the length of the sample name. Without samples, the expression matches
+    nothing (an empty constraint would let the rule match every sample).
+    Snakemake still scans the whole constraint every time it fills in the
+    wildcards of the rule, so it is only used for subsets of the samples."""
+    if len(samples) == 0:
+        return "(?!)"
+    trie = {}
+    for sample in samples:
+        node = trie
+        for char in sample:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def node_regex(node):
+        branches = [
+            re.escape(char) + node_regex(child)
+            for char, child in sorted(node.items())
+            if char != ""
+        ]
+        if len(branches) == 0:
+            return ""
+        if len(branches) == 1 and "" not in node:
+            return branches[0]
+        regex = "(?:" + "|".join(branches) + ")"
+        # The name can also end here
+        return regex + "?" if "" in node else regex
+
+    return node_regex(trie)
+
+
+if config["barrnap_batch_size"] > 1:
+    # Several assemblies are combined (contig names prefixed with the sample)
+    # in one barrnap run, so the rRNA models are loaded once per batch. The
+    # 16S sequences are split per sample afterwards.
+    N_BARRNAP_BATCHES = max(1, -(-len(BATCHED_SAMPLES) // config["barrnap_batch_size"]))
+    BARRNAP_BATCH = {
+        sample: get_barrnap_batch(sample, N_BARRNAP_BATCHES)
+        for sample in BATCHED_SAMPLES
+    }
+    BARRNAP_BATCHES = {}
+    for sample, batch in BARRNAP_BATCH.items():
+        BARRNAP_BATCHES.setdefault(str(batch), []).append(sample)
+    # In watch mode, the samples of earlier batches (with their 16S sequences
+    # already collected) must not match collect_16s
+    if config.get("batched_samples") is None:
+        COLLECT_16S_SAMPLES = ".+"
+    else:
+        COLLECT_16S_SAMPLES = samples_regex(BARRNAP_BATCH)
+
+    rule extract_16s_batch:
+        input:
+            assemblies=lambda wildcards: [
+                SAMPLES[sample]["assembly"]
+                for sample in BARRNAP_BATCHES[wildcards.batch]
+            ],
+        output:
+            sequences=temp(directory(OUT + "/16s/batches/batch_{batch}")),
+            combined=temp(OUT + "/16s/batches/batch_{batch}.fasta"),
+        wildcard_constraints:
+            batch=r"\d+",
+        message:
+            "Running Barrnap and extracting 16S sequences for batch {wildcards.batch} ({params.n_samples} samples)."
+        log:
+            OUT + "/log/16s/batch_{batch}_barrnap.log",
+        benchmark:
+            OUT + "/log/benchmark/extract_16s_batch/batch_{batch}.tsv"
+        conda:
+            "../../envs/16s.yaml"
+        threads: config["threads"]["barrnap"]
+        resources:
+            mem_gb=config["mem_gb"]["barrnap"],
+        params:
+            samples=lambda wildcards: BARRNAP_BATCHES[wildcards.batch],
+            n_samples=lambda wildcards: len(BARRNAP_BATCHES[wildcards.batch]),
+        shell:
+            """
+            # The sample names are passed through the environment and
+            # prepended by concatenation, so no character in them is
+            # interpreted by awk
+            samples=({params.samples:q})
+            assemblies=({input.assemblies:q})
+            rm -f {output.combined:q}
+            for i in "${{!samples[@]}}"
+            do
+                prefix="${{samples[$i]}}|" awk '/^>/ {{ $0 = ">" ENVIRON["prefix"] substr($0, 2) }} {{ print }}' \
+                    "${{assemblies[$i]}}" >> {output.combined:q}
+            done
+
+            barrnap --threads {threads} {output.combined:q} 2> {log:q} \
+                | python bin/extract_16s.py --assembly {output.combined:q} \
+                    --samples {params.samples:q} \
+                    --output_dir {output.sequences:q} 2>> {log:q}
+            """
+
+    localrules:
+        collect_16s,
+
+    # The 16S sequences of every sample are moved out of the output of its
+    # batch (a local job, no copy)
+    rule collect_16s:
+        input:
+            lambda wildcards: OUT
+            + f"/16s/batches/batch_{BARRNAP_BATCH[wildcards.sample]}",
+        output:
+            OUT + "/16s/{sample}/16S_seq.fasta",
+        wildcard_constraints:
+            sample=COLLECT_16S_SAMPLES,
+        message:
+            "Collecting the 16S sequences of {wildcards.sample}."
+        threads: 1
+        resources:
+            mem_gb=config["mem_gb"]["other"],
+        shell:
+            """
+            mv {input:q}/{wildcards.sample:q}/16S_seq.fasta {output:q}
+            """
+
+else:
+
+    # barrnap only predicts the rRNA genes (GFF3 on stdout) and the 16S sequences
+    # are extracted from the assembly in the same job, without copying or
+    # indexing the assembly
+    rule extract_16s:
+        input:
+            assembly=lambda wildcards: SAMPLES[wildcards.sample]["assembly"],
+        output:
+            OUT + "/16s/{sample}/16S_seq.fasta",
+        message:
+            "Running Barrnap and extracting 16S sequences for {wildcards.sample}."
+        log:
+            OUT + "/log/16s/{sample}_barrnap.log",
+        benchmark:
+            OUT + "/log/benchmark/extract_16s/{sample}.tsv"
+        conda:
+            "../../envs/16s.yaml"
+        threads: config["threads"]["barrnap"]
+        resources:
+            mem_gb=config["mem_gb"]["barrnap"],
+        shell:
+            """
+            barrnap --threads {threads} {input.assembly:q} 2> {log:q} \
+                | python bin/extract_16s.py --assembly {input.assembly:q} --output {output:q} 2>> {log:q}
+            """
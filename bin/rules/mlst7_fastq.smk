@@ -2,14 +2,47 @@
 #####                               MLST7                               #####
 #############################################################################
 
+# Samples of species without a 7-locus MLST scheme get a placeholder result
+# from a local rule, so no cluster job is submitted for them. Both rules have
+# the same outputs: their input functions fail for the samples of the other
+# rule, and Snakemake skips a rule whose input function fails when another
+# rule can make the file. (Wildcard constraints with the sample names would
+# do the same, but Snakemake scans the constraint every time it fills in the
+# wildcards of the rule, which makes building the DAG quadratic in the number
+# of samples.)
+
+
+def has_mlst7_scheme(sample):
+    return SAMPLES[sample]["species-mlst7"] is not None
+
+
+def mlst7_input(wildcards):
+    """The 7-locus MLST can be calculated from the reads (using KMA) or from
+    the assembly (using BLAST)"""
+    if not has_mlst7_scheme(wildcards.sample):
+        raise ValueError(f"Sample {wildcards.sample} has no MLST7 scheme.")
+    if config["mlst7"]["input"] == "assembly":
+        return [SAMPLES[wildcards.sample]["assembly"]]
+    return [typing_reads("R1")(wildcards), typing_reads("R2")(wildcards)]
+
+
+def no_mlst7_input(wildcards):
+    """No input files, only for the samples without a MLST7 scheme"""
+    if has_mlst7_scheme(wildcards.sample):
+        raise ValueError(f"Sample {wildcards.sample} has a MLST7 scheme.")
+    return []
+
 
 rule mlst7:
     input:
-        r1=lambda wildcards: SAMPLES[wildcards.sample]["R1"],
-        r2=lambda wildcards: SAMPLES[wildcards.sample]["R2"],
-        db=config["mlst7_db"] + "/senterica/senterica.length.b",
+        seqs=mlst7_input,
+        # ancient: a database update only re-types the samples whose scheme
+        # changed (see bin/db_update_impact.py), not all samples
+        db=ancient(config["mlst7_db"] + "/senterica/senterica.length.b"),
     output:
-        json=temp(OUT + "/mlst7/{sample}/data.json"),
+        # data.json is kept so the multireport can be made again when only
+        # some samples are re-typed
+        json=OUT + "/mlst7/{sample}/data.json",
         txt=OUT + "/mlst7/{sample}/results.txt",
         fasta=OUT + "/mlst7/{sample}/MLST_allele_seq.fsa",
         hits=temp(OUT + "/mlst7/{sample}/Hit_in_genome_seq.fsa"),
@@ -20,25 +53,75 @@ rule mlst7:
         "../../envs/mlst7.yaml"
     log:
         OUT + "/log/mlst7/{sample}.log",
+    benchmark:
+        OUT + "/log/benchmark/mlst7/{sample}.tsv"
     threads: config["threads"]["cgemlst"]
     resources:
-        mem_gb=config["mem_gb"]["cgemlst"],
+        mem_gb=scaled_mem_gb("cgemlst"),
+    retries: config["resource_scaling"]["retries"]
     params:
         species=lambda wildcards: SAMPLES[wildcards.sample]["species-mlst7"],
         mlst7_db=config["mlst7_db"],
+        db_staging_dir=config["db_staging_dir"],
+        db_version=config["db_versions"].get("mlst7_db", ""),
+        method="blastn" if config["mlst7"]["input"] == "assembly" else "kma",
+        caller=config["mlst7"]["caller"],
+        index_dir=config["mlst7"]["index_dir"],
+        store_in_cache=store_in_cache("mlst7"),
     shell:
         """
-        if [ {params.species} == 'None' ]
+        MLST7_DB=$(python bin/stage_db.py \
+            --db_dir {params.mlst7_db} \
+            --stage_dir "{params.db_staging_dir}" \
+            --db_version "{params.db_version}" \
+            --job_pid $$ \
+            --verbose 2> {log})
+
+        # The native caller only writes results if all the alleles are
+        # exact known alleles, otherwise cge-mlst is used
+        if [ {params.caller} == 'native' ] && python bin/mlst7_caller.py \
+            -i {input.seqs} \
+            -o $(dirname {output.json}) \
+            -s {params.species} \
+            --database $MLST7_DB \
+            --index_dir {params.index_dir} \
+            --verbose &>> {log}
         then
-            echo -e "The species of this sample is not supported by the MLST7 tool." > {log}
-            touch {output}
-            cp files/no_mlst7.json {output.json}
+            echo -e "MLST7 called by exact matching of known alleles." >> {log}
         else
-            python bin/cge-mlst/mlst.py -i {input.r1} {input.r2} \
+            python bin/cge-mlst/mlst.py -i {input.seqs} \
             -o $(dirname {output.json}) \
             -s {params.species} \
-            --database {params.mlst7_db} \
-            -mp kma \
+            --database $MLST7_DB \
+            -mp {params.method} \
             -x &>> {log}
         fi
+
+        {params.store_in_cache} &>> {log} || echo "Result not stored in the cache" >> {log}
+        """
+
+
+rule no_mlst7:
+    input:
+        no_mlst7_input,
+    output:
+        json=OUT + "/mlst7/{sample}/data.json",
+        txt=OUT + "/mlst7/{sample}/results.txt",
+        fasta=OUT + "/mlst7/{sample}/MLST_allele_seq.fsa",
+        hits=temp(OUT + "/mlst7/{sample}/Hit_in_genome_seq.fsa"),
+        tab=temp(OUT + "/mlst7/{sample}/results_tab.tsv"),
+    message:
+        "Skipping 7 locus-MLST for {wildcards.sample} (species not supported)."
+    log:
+        OUT + "/log/mlst7/{sample}.log",
+    benchmark:
+        OUT + "/log/benchmark/no_mlst7/{sample}.tsv"
+    threads: 1
+    resources:
+        mem_gb=config["mem_gb"]["other"],
+    shell:
+        """
+        echo -e "The species of this sample is not supported by the MLST7 tool." > {log}
+        touch {output}
+        cp files/no_mlst7.json {output.json}
         """
@@ -10,6 +10,8 @@ rule mlst7_multireport:
         "Making multireport for 7 locus-MLST results."
     log:
         OUT + "/log/mlst7/mlst7_multireport.log",
+    benchmark:
+        OUT + "/log/benchmark/mlst7_multireport.tsv"
     threads: 1
     resources:
         mem_gb=config["mem_gb"]["other"],
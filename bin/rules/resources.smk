@@ -0,0 +1,67 @@
+# ---------------------- Input-size-aware resources ---------------------------#
+
+from math import ceil
+
+
+# Uncompressed size of the input files, measured by the pre-flight check of
+# juno_typing.py (bin/preflight.py)
+UNCOMPRESSED_SIZE = {
+    SAMPLES[sample][key]: size
+    for sample in SAMPLES
+    for key, size in SAMPLES[sample].get("uncompressed_size", {}).items()
+}
+
+
+def input_size_gb(input):
+    """Size of the input files of a job in GB. Compressed files are counted
+    with their size after decompression (measured by the pre-flight check, or
+    estimated)"""
+    size = 0
+    for file_ in input:
+        if str(file_) in UNCOMPRESSED_SIZE:
+            size += UNCOMPRESSED_SIZE[str(file_)]
+            continue
+        if not exists(file_):
+            continue
+        file_size = getsize(file_)
+        if file_.endswith(".gz"):
+            file_size *= config["resource_scaling"]["gz_expansion"]
+        size += file_size
+    return size / 1024**3
+
+
+def scaled_mem_gb(tool):
+    """Resource function for the memory of a tool. The memory is estimated
+    from the size of the input (see resource_scaling in
+    config/pipeline_parameters.yaml), but never lower than the fixed memory of
+    the tool in config["mem_gb"], and multiplied by the attempt number, so a
+    job that is retried (e.g. after running out of memory) gets more."""
+
+    def get_mem_gb(wildcards, input, attempt):
+        fixed_mem_gb = config["mem_gb"][tool]
+        scaling = config["resource_scaling"]["tools"].get(tool)
+        if scaling is None:
+            return fixed_mem_gb * attempt
+        # The fixed memory is the floor: part of the memory (e.g. the KMA
+        # database) does not depend on the input, so only large inputs get more
+        input_gb = input_size_gb(input)
+        estimate = scaling["mem_gb_base"] + scaling["mem_gb_per_input_gb"] * input_gb
+        mem_gb = max(fixed_mem_gb, estimate) * attempt
+        return min(ceil(mem_gb), max(scaling["mem_gb_max"], fixed_mem_gb))
+
+    return get_mem_gb
+
+
+def scaled_threads(tool):
+    """Threads for a tool, estimated from the size of the input. The number of
+    threads in config["threads"] is the maximum."""
+
+    def get_threads(wildcards, input):
+        max_threads = config["threads"][tool]
+        scaling = config["resource_scaling"]["tools"].get(tool, {})
+        if "input_gb_per_thread" not in scaling:
+            return max_threads
+        threads = ceil(input_size_gb(input) / scaling["input_gb_per_thread"])
+        return max(1, min(threads, max_threads))
+
+    return get_threads
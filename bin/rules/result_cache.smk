@@ -0,0 +1,44 @@
+# ----------------------------- Result cache ----------------------------------#
+
+from shlex import join as shell_join
+
+
+def cache_key(rule):
+    """Key of the result of a job in the result cache (empty if the result
+    should not be stored)"""
+
+    def get_key(wildcards):
+        if not config["result_cache"]["enabled"]:
+            return ""
+        return config["result_cache"]["keys"].get(rule, {}).get(wildcards.sample, "")
+
+    return get_key
+
+
+def store_in_cache(rule):
+    """Params function with the shell command that stores the outputs of a
+    job in the result cache ('true' if the result should not be stored).
+    Use it at the end of the shell command of the rule as:
+    {params.store_in_cache} &>> {log} || echo "Result not stored in the cache" >> {log}
+    """
+    get_key = cache_key(rule)
+
+    def get_command(wildcards, output):
+        key = get_key(wildcards)
+        if not key:
+            return "true"
+        return shell_join(
+            [
+                "python",
+                "bin/result_cache.py",
+                "--store_dir",
+                config["result_cache"]["store_dir"],
+                "--key",
+                key,
+                "--output_dir",
+                OUT,
+                *output,
+            ]
+        )
+
+    return get_command
@@ -0,0 +1,40 @@
+# --------------------------- Per-sample summary -----------------------------#
+
+
+# Written as soon as the typers of the sample are done (it does not wait for
+# the other samples or the multireports). It runs locally to avoid waiting in
+# the queue of the cluster for a job of a fraction of a second.
+# Exception: the typers that run for several samples in one job. The Neisseria
+# capsule, the Bordetella vaccine antigen MLST and barrnap with
+# barrnap_batch_size > 1 make the summary wait for the whole batch.
+rule sample_summary:
+    input:
+        mlst7=OUT + "/mlst7/{sample}/data.json",
+        serotype=choose_serotyper,
+        shigatyper=choose_shigatyper,
+        rrna_16s=OUT + "/16s/{sample}/16S_seq.fasta",
+    output:
+        OUT + "/summary/{sample}.json",
+    message:
+        "Making the summary of the typing results of {wildcards.sample}."
+    log:
+        OUT + "/log/summary/{sample}.log",
+    benchmark:
+        OUT + "/log/benchmark/sample_summary/{sample}.tsv"
+    threads: 1
+    resources:
+        mem_gb=config["mem_gb"]["other"],
+    params:
+        genus=lambda wildcards: SAMPLES[wildcards.sample]["genus"],
+        species=lambda wildcards: SAMPLES[wildcards.sample]["species"],
+    shell:
+        """
+        python bin/sample_summary.py \
+            --sample {wildcards.sample:q} \
+            --genus {params.genus:q} \
+            --species {params.species:q} \
+            --mlst7 {input.mlst7:q} \
+            --serotype {input.serotype:q} {input.shigatyper:q} \
+            --rrna_16s {input.rrna_16s:q} \
+            --output {output:q} &> {log:q}
+        """
@@ -3,6 +3,16 @@
 # --------------- Choose serotyper according to genus/species ----------------#
 
 
+def run_shigatyper(wildcards):
+    """ShigaTyper only runs for Shigella samples and for samples in which the
+    ipaH screen found the Shigella/EIEC marker"""
+    if SAMPLES[wildcards.sample]["genus"] == "shigella":
+        return True
+    screen_result = checkpoints.shigella_screen.get(sample=wildcards.sample).output[0]
+    with open(screen_result) as screen:
+        return screen.read().strip() == "positive"
+
+
 def choose_serotyper(wildcards):
     if SAMPLES[wildcards.sample]["genus"] == "salmonella":
         return [
@@ -13,38 +23,34 @@ def choose_serotyper(wildcards):
         SAMPLES[wildcards.sample]["genus"] == "escherichia"
         or SAMPLES[wildcards.sample]["genus"] == "shigella"
     ):
+        # ShigaTyper is chosen separately (choose_shigatyper), so SerotypeFinder
+        # does not wait for the Shigella screen
         return [
             OUT + "/serotype/{sample}/data.json",
             OUT + "/serotype/{sample}/result_serotype.csv",
-            OUT + "/serotype/{sample}/shigatyper.csv",
-            OUT + "/serotype/{sample}/command.txt",
         ]
     elif SAMPLES[wildcards.sample]["genus"] == "streptococcus":
         return [OUT + "/serotype/{sample}/pred.tsv"]
     elif SAMPLES[wildcards.sample]["genus"] == "neisseria":
-        # TODO is the output folder enough
-        return [OUT + "/serotype/{sample}"]
+        return [OUT + "/serotype/{sample}/neisseriatyper.tab"]
     elif SAMPLES[wildcards.sample]["genus"] == "bordetella":
         return [OUT + "/vaccine_antigen_mlst/{sample}.tsv"]
     else:
         return OUT + "/serotype/{sample}/no_serotype_necessary.txt"
 
 
-# -----------------------------------------------------------------------------#
-# This is just a mock rule to make the multiserotypers work
-# Similar to the aggregate samples of https://snakemake.readthedocs.io/en/stable/snakefiles/rules.html#data-dependent-conditional-execution
-rule aggregate_serotypes:
-    input:
-        choose_serotyper,
-    output:
-        temp(OUT + "/serotype/{sample}_done.txt"),
-    message:
-        "Checking correct serotyper ran properly for {wildcards.sample}"
-    threads: 1
-    resources:
-        mem_gb=config["mem_gb"]["other"],
-    shell:
-        "touch {output}"
+def choose_shigatyper(wildcards):
+    """ShigaTyper output of Escherichia/Shigella samples, or the result of the
+    Shigella screen if ShigaTyper does not need to run. Kept apart from
+    choose_serotyper because it depends on a checkpoint"""
+    if SAMPLES[wildcards.sample]["genus"] not in ["escherichia", "shigella"]:
+        return []
+    if run_shigatyper(wildcards):
+        return [
+            OUT + "/serotype/{sample}/shigatyper.csv",
+            OUT + "/serotype/{sample}/command.txt",
+        ]
+    return [OUT + "/serotype/{sample}/shigella_screen.txt"]
 
 
 # -----------------------------------------------------------------------------#
@@ -53,40 +59,68 @@ rule aggregate_serotypes:
 
 rule salmonella_serotyper:
     input:
-        r1=lambda wildcards: SAMPLES[wildcards.sample]["R1"],
-        r2=lambda wildcards: SAMPLES[wildcards.sample]["R2"],
+        r1=typing_reads("R1"),
+        r2=typing_reads("R2"),
     output:
         seqsero=OUT + "/serotype/{sample}/SeqSero_result.tsv",
         seqsero_tmp1=temp(OUT + "/serotype/{sample}/SeqSero_result.txt"),
         seqsero_tmp2=temp(OUT + "/serotype/{sample}/data_log.txt"),
+        tier=temp(OUT + "/serotype/{sample}/SeqSero_tier.txt"),
     message:
         "Running Salmonella serotyper for {wildcards.sample}."
     log:
         OUT + "/log/serotype/{sample}_salmonella.log",
     params:
         output_dir=OUT + "/serotype/{sample}/",
-    threads: config["threads"]["seqsero2"]
+        mode=config["seqsero"]["mode"],
+        seqsero_context=config["seqsero_context"],
+        store_in_cache=store_in_cache("salmonella_serotyper"),
+    benchmark:
+        OUT + "/log/benchmark/salmonella_serotyper/{sample}.tsv"
+    threads: scaled_threads("seqsero2")
     resources:
-        mem_gb=config["mem_gb"]["seqsero2"],
+        mem_gb=scaled_mem_gb("seqsero2"),
+    retries: config["resource_scaling"]["retries"]
     conda:
         "../../envs/seqsero.yaml"
     shell:
         """
-        # Run seqsero2 
-        # -m 'a' means microassembly mode and -t '2' refers to separated fastq files (no interleaved)
-        SeqSero2_package.py -m 'a' -t '2' -i {input.r1} {input.r2} -d {params.output_dir} -p {threads} &> {log}
+        # In tiered mode, the fast k-mer mode (-m 'k') is run first and the
+        # microassembly mode (-m 'a') only if the k-mer prediction is
+        # ambiguous, partial/monophasic or has extra context to check
+        # -t '2' refers to separated fastq files (no interleaved)
+        TIER="microassembly"
+        if [ {params.mode} == 'tiered' ]
+        then
+            SeqSero2_package.py -m 'k' -t '2' -i {input.r1} {input.r2} -d {params.output_dir} -p {threads} &> {log}
+            TIER=$(python bin/seqsero_tier.py \
+                --input {output.seqsero} \
+                --context {params.seqsero_context} 2>> {log}) \
+                || TIER="microassembly: k-mer result could not be evaluated"
+        fi
+
+        if [ "$TIER" != 'k-mer' ]
+        then
+            SeqSero2_package.py -m 'a' -t '2' -i {input.r1} {input.r2} -d {params.output_dir} -p {threads} &>> {log}
+        fi
+        echo "$TIER" > {output.tier}
+
+        {params.store_in_cache} &>> {log} || echo "Result not stored in the cache" >> {log}
         """
 
 
 rule add_context_salmonella_serotyper:
     input:
         seqsero=OUT + "/serotype/{sample}/SeqSero_result.tsv",
+        tier=OUT + "/serotype/{sample}/SeqSero_tier.txt",
     output:
         seqsero=OUT + "/serotype/{sample}/SeqSero_result_with_context.tsv",
     message:
         "Adding context to salmonella serotype report for {wildcards.sample}"
     log:
         OUT + "/log/add_context_salmonella_serotyper/{sample}.log",
+    benchmark:
+        OUT + "/log/benchmark/add_context_salmonella_serotyper/{sample}.tsv"
     params:
         seqsero_context=config["seqsero_context"],
     threads: config["threads"]["other"]
@@ -100,6 +134,7 @@ rule add_context_salmonella_serotyper:
             --input {input.seqsero} \
             --output {output.seqsero} \
             --context {params.seqsero_context} \
+            --tier {input.tier} \
             --verbose 2>&1>{log}
         """
 
@@ -113,6 +148,8 @@ rule convert_blastxml_to_csv:
         "Converting and filtering blasted_output.xml for {wildcards.sample}"
     log:
         OUT + "/log/convert_blastxml_to_csv/{sample}.log",
+    benchmark:
+        OUT + "/log/benchmark/convert_blastxml_to_csv/{sample}.tsv"
     params:
         mincov=0.6,
         minid=0.8,
@@ -157,23 +194,38 @@ rule ecoli_serotyper:
         OUT + "/log/serotype/{sample}_ecoli.log",
     conda:
         "../../envs/serotypefinder.yaml"
+    benchmark:
+        OUT + "/log/benchmark/ecoli_serotyper/{sample}.tsv"
     threads: config["threads"]["serotypefinder"]
     resources:
-        mem_gb=config["mem_gb"]["serotypefinder"],
+        mem_gb=scaled_mem_gb("serotypefinder"),
+    retries: config["resource_scaling"]["retries"]
     params:
         ecoli_db=config["serotypefinder_db"],
+        db_staging_dir=config["db_staging_dir"],
+        db_version=config["db_versions"].get("serotypefinder_db", ""),
         min_cov=config["serotypefinder"]["min_cov"],
         identity_thresh=config["serotypefinder"]["identity_thresh"],
         output_dir=OUT + "/serotype/{sample}/",
+        store_in_cache=store_in_cache("ecoli_serotyper"),
     shell:
         """
+        ECOLI_DB=$(python bin/stage_db.py \
+            --db_dir {params.ecoli_db} \
+            --stage_dir "{params.db_staging_dir}" \
+            --db_version "{params.db_version}" \
+            --job_pid $$ \
+            --verbose 2> {log})
+
         python bin/serotypefinder/serotypefinder.py -i {input.assembly} \
             -o {params.output_dir} \
-            -p {params.ecoli_db} \
+            -p $ECOLI_DB \
             -l {params.min_cov} \
-            -t {params.identity_thresh} &> {log}
+            -t {params.identity_thresh} &>> {log}
 
         python bin/serotypefinder/extract_alleles_serotypefinder.py {output.json} {output.csv} &>> {log}
+
+        {params.store_in_cache} &>> {log} || echo "Result not stored in the cache" >> {log}
         """
 
 
@@ -183,24 +235,37 @@ rule ecoli_serotyper:
 
 rule build_seroba_db:
     output:
-        config["seroba_db"] + "/database/kmer_size.txt",
+        config["seroba_db_build"] + "/database/kmer_size.txt",
     conda:
         "../../envs/seroba.yaml"
+    benchmark:
+        OUT + "/log/benchmark/build_seroba_db.tsv"
     params:
         seroba_db=config["seroba_db"],
+        seroba_db_build=config["seroba_db_build"],
         kmer_size=config["seroba"]["kmer_size"],
     shell:
         """
-        cd {params.seroba_db}
+        # Every (database commit, kmer size) combination gets its own build
+        # so changing the kmer size does not overwrite an existing build. The
+        # database is only built in place if it was built there before with
+        # the same kmer size (see find_seroba_build_dir in download_dbs.py)
+        if [ {params.seroba_db_build} != {params.seroba_db} ]
+        then
+            rm -rf {params.seroba_db_build}/database
+            mkdir -p {params.seroba_db_build}
+            cp -r {params.seroba_db}/database {params.seroba_db_build}/
+        fi
+        cd {params.seroba_db_build}
         seroba createDBs database {params.kmer_size}
         """
 
 
 rule seroba:
     input:
-        r1=lambda wildcards: SAMPLES[wildcards.sample]["R1"],
-        r2=lambda wildcards: SAMPLES[wildcards.sample]["R2"],
-        check_db=config["seroba_db"] + "/database/kmer_size.txt",
+        r1=typing_reads("R1"),
+        r2=typing_reads("R2"),
+        check_db=config["seroba_db_build"] + "/database/kmer_size.txt",
     output:
         OUT + "/serotype/{sample}/pred.tsv",
     message:
@@ -209,12 +274,16 @@ rule seroba:
         OUT + "/log/serotype/{sample}_spneumoniae.log",
     conda:
         "../../envs/seroba.yaml"
+    benchmark:
+        OUT + "/log/benchmark/seroba/{sample}.tsv"
     threads: config["threads"]["seroba"]
     resources:
-        mem_gb=config["mem_gb"]["seroba"],
+        mem_gb=scaled_mem_gb("seroba"),
+    retries: config["resource_scaling"]["retries"]
     params:
         min_cov=config["seroba"]["min_cov"],
-        seroba_db=config["seroba_db"],
+        seroba_db=config["seroba_db_build"],
+        store_in_cache=store_in_cache("seroba"),
     shell:
         """
         rm -rf {wildcards.sample} 
@@ -224,6 +293,8 @@ rule seroba:
         seroba runSerotyping --coverage {params.min_cov} {params.seroba_db}/database {input.r1} {input.r2} {wildcards.sample} &> {log}
 
         mv {wildcards.sample}/* $OUTPUT_DIR
+
+        {params.store_in_cache} &>> {log} || echo "Result not stored in the cache" >> {log}
         """
 
 
@@ -233,10 +304,38 @@ rule seroba:
 ### Shigella serotyper ###
 
 
+checkpoint shigella_screen:
+    input:
+        assembly=lambda wildcards: SAMPLES[wildcards.sample]["assembly"],
+    output:
+        OUT + "/serotype/{sample}/shigella_screen.txt",
+    message:
+        "Screening {wildcards.sample} for the Shigella marker ipaH."
+    log:
+        OUT + "/log/serotype/{sample}_shigella_screen.log",
+    conda:
+        "../../envs/shigatyper.yaml"
+    benchmark:
+        OUT + "/log/benchmark/shigella_screen/{sample}.tsv"
+    threads: 1
+    resources:
+        mem_gb=config["mem_gb"]["other"],
+    params:
+        min_kmer_fraction=0.5,
+    shell:
+        """
+        python bin/shigella_screen.py \
+            --input {input.assembly} \
+            --output {output} \
+            --min_kmer_fraction {params.min_kmer_fraction} \
+            --verbose &> {log}
+        """
+
+
 rule shigatyper:
     input:
-        r1=lambda wildcards: SAMPLES[wildcards.sample]["R1"],
-        r2=lambda wildcards: SAMPLES[wildcards.sample]["R2"],
+        r1=typing_reads("R1"),
+        r2=typing_reads("R2"),
     output:
         sample_out=OUT + "/serotype/{sample}/shigatyper.csv",
         command_out=OUT + "/serotype/{sample}/command.txt",
@@ -246,10 +345,14 @@ rule shigatyper:
         OUT + "/log/serotype/{sample}_shigella.log",
     conda:
         "../../envs/shigatyper.yaml"
+    benchmark:
+        OUT + "/log/benchmark/shigatyper/{sample}.tsv"
     resources:
-        mem_gb=config["mem_gb"]["shigatyper"],
+        mem_gb=scaled_mem_gb("shigatyper"),
+    retries: config["resource_scaling"]["retries"]
     params:
         output_dir=OUT + "/serotype/{sample}",
+        store_in_cache=store_in_cache("shigatyper"),
     shell:
         """
         CURRENT_DIR=$(pwd)
@@ -264,6 +367,10 @@ rule shigatyper:
             # save header without data in expected output file
             echo ",Hit,Number of reads,Length Covered,reference length,% covered,Number of variants,% accuracy" > shigatyper.csv
         fi
+
+        cd "$CURRENT_DIR"
+
+        {params.store_in_cache} &>> {log} || echo "Result not stored in the cache" >> {log}
         """
 
 
@@ -273,41 +380,55 @@ rule shigatyper:
 ### Neisseria serotyper ###
 
 
+NEISSERIA_SAMPLES = [
+    s for s in BATCHED_SAMPLES if BATCHED_SAMPLES[s]["genus"] == "neisseria"
+]
+
+
+# All Neisseria samples are characterized in one job, so the tool and its
+# database are loaded only once per run
 rule characterize_neisseria_capsule:
     input:
-        assembly=lambda wildcards: SAMPLES[wildcards.sample]["assembly"],
+        assemblies=[SAMPLES[sample]["assembly"] for sample in NEISSERIA_SAMPLES],
     output:
-        output_dir=directory(OUT + "/serotype/{sample}"),
+        expand(OUT + "/serotype/{sample}/neisseriatyper.tab", sample=NEISSERIA_SAMPLES),
     message:
-        "Running characterize neisseria capsule for {wildcards.sample}."
+        "Running characterize neisseria capsule for {params.n_samples} samples."
     log:
-        OUT + "/log/serotype/{sample}_neisseria.log",
+        OUT + "/log/serotype/neisseria.log",
+    benchmark:
+        OUT + "/log/benchmark/characterize_neisseria_capsule.tsv"
     conda:
         "../../envs/characterize_neisseria_capsule.yaml"
     resources:
         mem_gb=config["mem_gb"]["characterize_neisseria_capsule"],
     threads: config["threads"]["characterize_neisseria_capsule"]
     params:
-        fasta_dir=OUT + "/de_novo_assembly_filtered/",
-        output_dir=OUT + "/serotype/{sample}/serogroup",
-        copy_to=OUT + "/serotype/{sample}",
-    # For this tool we need an input directory and not files, so I copied the filtered assemblies to a new directory, with a directory per sample and use that sample directory as the input
+        samples=NEISSERIA_SAMPLES,
+        n_samples=len(NEISSERIA_SAMPLES),
+        fasta_dir=OUT + "/neisseria_capsule/input",
+        output_dir=OUT + "/neisseria_capsule/serogroup",
+        serotype_dir=OUT + "/serotype",
+    # For this tool we need an input directory and not files, so the
+    # assemblies are linked (not copied) into one directory
     shell:
         """
-        sample=$(awk -F/ '{{print $NF}}' <<< {input.assembly})
-        dir_name=$(awk -F. '{{print $1}}' <<< $sample)
-        final_name="{params.fasta_dir}$dir_name" 
-
-        mkdir -p $final_name
-        cp {input.assembly} "$final_name/"
-
-        python3 bin/characterize_neisseria_capsule/characterize_neisseria_capsule.py -d $final_name -o {output.output_dir}
-
-        cd  {params.output_dir}
-        for file in *.tab
+        rm -rf {params.fasta_dir} {params.output_dir}
+        mkdir -p {params.fasta_dir}
+        for assembly in {input.assemblies}
         do
-            cp "${{file}}" "{params.copy_to}/${{file/*/neisseriatyper.tab}}"
+            ln -s "$(realpath "$assembly")" "{params.fasta_dir}/$(basename "$assembly")"
         done
+
+        python3 bin/characterize_neisseria_capsule/characterize_neisseria_capsule.py \
+            -d {params.fasta_dir} \
+            -o {params.output_dir} &> {log}
+
+        python3 bin/split_neisseria_capsule.py \
+            --input_dir {params.output_dir} \
+            --samples {params.samples} \
+            --assemblies {input.assemblies} \
+            --output_dir {params.serotype_dir} &>> {log}
         """
 
 
@@ -317,27 +438,54 @@ rule characterize_neisseria_capsule:
 ### Bordetella vaccine antigen MLST ###
 
 
+BORDETELLA_SAMPLES = [
+    s for s in BATCHED_SAMPLES if BATCHED_SAMPLES[s]["genus"] == "bordetella"
+]
+
+
+# mlst accepts many assemblies at once (one row per assembly), so all
+# Bordetella samples are typed in one call and the rows are split per sample
 rule vaccine_antigen_mlst_bordetella:
     input:
-        assembly=lambda wildcards: SAMPLES[wildcards.sample]["assembly"],
+        assemblies=[SAMPLES[sample]["assembly"] for sample in BORDETELLA_SAMPLES],
     output:
-        OUT + "/vaccine_antigen_mlst/{sample}.tsv",
+        expand(OUT + "/vaccine_antigen_mlst/{sample}.tsv", sample=BORDETELLA_SAMPLES),
     message:
-        "Running vaccine antigen mlst for {wildcards.sample}."
+        "Running vaccine antigen mlst for {params.n_samples} samples."
     log:
-        OUT + "/log/vaccine_antigen_mlst/{sample}_bordetella.log",
+        OUT + "/log/vaccine_antigen_mlst/bordetella.log",
+    benchmark:
+        OUT + "/log/benchmark/vaccine_antigen_mlst_bordetella.tsv"
     conda:
         "../../envs/tseemann_mlst.yaml"
     resources:
         mem_gb=config["mem_gb"]["tseemann_mlst"],
     threads: config["threads"]["tseemann_mlst"]
     params:
+        samples=BORDETELLA_SAMPLES,
+        n_samples=len(BORDETELLA_SAMPLES),
+        combined=OUT + "/vaccine_antigen_mlst/bordetella_combined.tsv",
+        output_dir=OUT + "/vaccine_antigen_mlst",
         datadir=config["db_dir"],
         scheme=config["bordetella_vaccine_antigen_scheme"],
         blastdb=config["bordetella_vaccine_antigen_blastdb"],
+    # The full paths are kept in the combined output (no --nopath) so that
+    # assemblies with the same file name can still be told apart
     shell:
         """
-        mlst --nopath --datadir {params.datadir} --blastdb {params.blastdb} --scheme {params.scheme} {input.assembly} > {output} 2> {log}
+        mlst --threads {threads} --datadir {params.datadir} --blastdb {params.blastdb} --scheme {params.scheme} {input.assemblies:q} > {params.combined:q} 2> {log:q}
+
+        # The paths are passed through the environment (awk -v would
+        # interpret backslashes in them)
+        samples=({params.samples:q})
+        assemblies=({input.assemblies:q})
+        for i in "${{!samples[@]}}"
+        do
+            assembly="${{assemblies[$i]}}" awk -F '\t' -v OFS='\t' \
+                '$1 == ENVIRON["assembly"] {{ n = split($1, path, "/"); $1 = path[n]; print }}' \
+                {params.combined:q} > {params.output_dir:q}/"${{samples[$i]}}.tsv"
+        done
+        rm {params.combined:q}
         """
 
 
@@ -353,6 +501,8 @@ rule no_serotyper:
         temp(OUT + "/serotype/{sample}/no_serotype_necessary.txt"),
     message:
         "Skipping serotyper step for {wildcards.sample}."
+    benchmark:
+        OUT + "/log/benchmark/no_serotyper/{sample}.tsv"
     threads: 1
     resources:
         mem_gb=config["mem_gb"]["other"],
@@ -1,13 +1,59 @@
 # ----------------------- Serotypers multireport -----------------------------#
 
+from types import SimpleNamespace
 
+
+ESCHERICHIA_SAMPLES = [
+    s for s in SAMPLES if SAMPLES[s]["genus"] in ["escherichia", "shigella"]
+]
+
+
+def all_serotyper_outputs(wildcards):
+    """Outputs of the serotypers of all the samples (choose_serotyper). The
+    ShigaTyper results depend on a checkpoint per sample, so they are waited
+    for through aggregate_shigatyper"""
+    serotyper_outputs = []
+    for sample in SAMPLES:
+        sample_outputs = choose_serotyper(SimpleNamespace(sample=sample))
+        if isinstance(sample_outputs, str):
+            sample_outputs = [sample_outputs]
+        serotyper_outputs += [
+            output.replace("{sample}", sample) for output in sample_outputs
+        ]
+    return serotyper_outputs
+
+
+# Waits for the ShigaTyper result (or the negative Shigella screen) of one
+# sample. Only the checkpoint of that sample is read when it finishes, instead
+# of the checkpoints of all the samples in the input of the multireport.
+rule aggregate_shigatyper:
+    input:
+        choose_shigatyper,
+    output:
+        temp(OUT + "/serotype/{sample}/shigatyper_done.txt"),
+    message:
+        "Checking that ShigaTyper is done for {wildcards.sample}."
+    threads: 1
+    resources:
+        mem_gb=config["mem_gb"]["other"],
+    shell:
+        "touch {output:q}"
+
+
+# The multireport only waits for the serotypers, not for the other typers of
+# the samples
 rule serotype_multireports:
     input:
-        expand(OUT + "/serotype/{sample}_done.txt", sample=SAMPLES),
+        serotypers=all_serotyper_outputs,
+        shigatyper=expand(
+            OUT + "/serotype/{sample}/shigatyper_done.txt", sample=ESCHERICHIA_SAMPLES
+        ),
     output:
         OUT + "/serotype/serotyper_multireport.csv",
     message:
         "Making multireport(s) for the serotyping results (if any)."
+    benchmark:
+        OUT + "/log/benchmark/serotype_multireports.tsv"
     threads: config["threads"]["other"]
     resources:
         mem_gb=config["mem_gb"]["other"],
@@ -27,6 +73,7 @@ rule serotype_multireports:
                     -o -name "result_serotype.csv" \
                     -o -name "command.txt" \
                     -o -name "shigatyper.csv" \
+                    -o -name "shigella_screen.txt" \
                     -o -name "neisseriatyper.tab" \
                     -o -name "pred.tsv")
             echo $result_sample &> {log}
@@ -0,0 +1,49 @@
+# ------------------------- Read staging --------------------------------------#
+
+
+def input_reads(read):
+    """Input function for the reads of a sample. If read staging is enabled,
+    the decompressed copy of the reads is used instead of the original one."""
+
+    def get_reads(wildcards):
+        if config["stage_reads"]["enabled"]:
+            return (
+                config["stage_reads"]["staging_dir"]
+                + f"/{wildcards.sample}_{read}.fastq"
+            )
+        return SAMPLES[wildcards.sample][read]
+
+    return get_reads
+
+
+# The staged reads are temporary, so Snakemake removes them as soon as the last
+# rule using them has finished
+rule stage_reads:
+    input:
+        r1=lambda wildcards: SAMPLES[wildcards.sample]["R1"],
+        r2=lambda wildcards: SAMPLES[wildcards.sample]["R2"],
+    output:
+        r1=temp(config["stage_reads"]["staging_dir"] + "/{sample}_R1.fastq"),
+        r2=temp(config["stage_reads"]["staging_dir"] + "/{sample}_R2.fastq"),
+    message:
+        "Decompressing reads of {wildcards.sample}."
+    log:
+        OUT + "/log/stage_reads/{sample}.log",
+    conda:
+        "../../envs/stage_reads.yaml"
+    benchmark:
+        OUT + "/log/benchmark/stage_reads/{sample}.tsv"
+    threads: config["threads"]["stage_reads"]
+    resources:
+        mem_gb=config["mem_gb"]["stage_reads"],
+    shell:
+        """
+        # R1 and R2 are decompressed at the same time. Uncompressed input is
+        # copied as it is (-f)
+        pigz -dcf -p {threads} {input.r1} > {output.r1} 2> {log} &
+        R1_PID=$!
+        pigz -dcf -p {threads} {input.r2} > {output.r2} 2>> {log} &
+        R2_PID=$!
+        wait $R1_PID
+        wait $R2_PID
+        """
@@ -0,0 +1,61 @@
+# ------------------------ Read subsampling -----------------------------------#
+
+
+def subsampled_reads(read):
+    """Path of the subsampled reads. With read staging they are written
+    uncompressed to the staging directory, so the typers do not decompress
+    them again."""
+    if config["stage_reads"]["enabled"]:
+        return (
+            config["stage_reads"]["staging_dir"]
+            + f"/{{sample}}_{read}.subsampled.fastq"
+        )
+    return OUT + f"/subsampled_reads/{{sample}}_{read}.fastq.gz"
+
+
+def typing_reads(read):
+    """Input function for the reads used by the read-based typers. If
+    subsampling is enabled, the subsampled reads are used instead of the
+    original (or staged) ones."""
+
+    def get_reads(wildcards):
+        if config["subsample"]["enabled"]:
+            return subsampled_reads(read).replace("{sample}", wildcards.sample)
+        return input_reads(read)(wildcards)
+
+    return get_reads
+
+
+rule subsample_reads:
+    input:
+        r1=input_reads("R1"),
+        r2=input_reads("R2"),
+    output:
+        r1=temp(subsampled_reads("R1")),
+        r2=temp(subsampled_reads("R2")),
+    message:
+        "Subsampling reads of {wildcards.sample} to {params.coverage}x."
+    log:
+        OUT + "/log/subsampled_reads/{sample}.log",
+    conda:
+        "../../envs/subsample.yaml"
+    benchmark:
+        OUT + "/log/benchmark/subsample_reads/{sample}.tsv"
+    threads: config["threads"]["subsample"]
+    resources:
+        mem_gb=config["mem_gb"]["subsample"],
+    params:
+        coverage=config["subsample"]["coverage"],
+        genome_size=lambda wildcards: SAMPLES[wildcards.sample]["genome_size"],
+        seed=config["subsample"]["seed"],
+        output_type="u" if config["stage_reads"]["enabled"] else "g",
+    shell:
+        """
+        # Samples with less coverage than the target keep all their reads
+        rasusa -i {input.r1} -i {input.r2} \
+            --coverage {params.coverage} \
+            --genome-size {params.genome_size} \
+            --seed {params.seed} \
+            -O {params.output_type} \
+            -o {output.r1} -o {output.r2} &> {log}
+        """
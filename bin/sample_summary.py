@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Combine the MLST7, serotyping and 16S results of one sample in a single JSON
+file. The summary is written as soon as the typers of that sample have
+finished (not when the whole run is done), so it can be picked up by other
+systems (e.g. a LIMS) while the rest of the run is still going. For typers
+that run for a batch of samples in one job (Neisseria capsule, Bordetella
+vaccine antigen MLST, batched barrnap), that is when the whole batch is done.
+"""
+
+import argparse
+import csv
+import json
+import os
+import pathlib
+
+# Serotyper output file -> key in the summary. Files not listed here (e.g.
+# data.json or command.txt) are not included.
+SEROTYPER_FILES = {
+    "SeqSero_result_with_context.tsv": "seqsero2",
+    "SeqSero_extra_hits.csv": "seqsero2_extra_hits",
+    "result_serotype.csv": "serotypefinder",
+    "shigatyper.csv": "shigatyper",
+    "shigella_screen.txt": "shigella_screen",
+    "pred.tsv": "seroba",
+    "neisseriatyper.tab": "neisseria_capsule",
+}
+
+
+def read_mlst7(data_json):
+    """ST, scheme and alleles from the data.json of (CGE-)MLST7"""
+    with open(data_json) as json_file:
+        data = json.load(json_file)["mlst"]
+    return {
+        "sequence_type": data["results"]["sequence_type"],
+        "scheme": data["user_input"]["organism"],
+        "alleles": {
+            locus: result["allele"]
+            for locus, result in data["results"]["allele_profile"].items()
+        },
+    }
+
+
+def read_table(table, delimiter):
+    with open(table, newline="") as table_file:
+        return [dict(row) for row in csv.DictReader(table_file, delimiter=delimiter)]
+
+
+def read_vaccine_antigen_mlst(table):
+    """Rows of mlst (Seemann) output, which has no header"""
+    rows = []
+    with open(table) as table_file:
+        for line in table_file:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 3:
+                continue
+            rows.append(
+                {"scheme": fields[1], "sequence_type": fields[2], "alleles": fields[3:]}
+            )
+    return rows
+
+
+def read_serotype(files):
+    """
+    Results of the serotyper(s) that ran for the sample
+
+    Returns
+    -------
+    dict
+        Serotyper as key and its result table (list of rows) as value. Text
+        files (the Shigella screen) are included as text.
+    """
+    results = {}
+    for file_ in map(pathlib.Path, files):
+        if file_.parent.name == "vaccine_antigen_mlst":
+            results["vaccine_antigen_mlst"] = read_vaccine_antigen_mlst(file_)
+            continue
+        key = SEROTYPER_FILES.get(file_.name)
+        if key is None:
+            continue
+        if file_.suffix == ".txt":
+            results[key] = file_.read_text().strip()
+        else:
+            results[key] = read_table(file_, "," if file_.suffix == ".csv" else "\t")
+    return results
+
+
+def read_16s(fasta):
+    """Names of the 16S sequences found in the assembly"""
+    with open(fasta) as fasta_file:
+        return [line[1:].strip() for line in fasta_file if line.startswith(">")]
+
+
+def make_summary(sample, genus, species, mlst7, serotype, rrna_16s):
+    return {
+        "sample": sample,
+        "genus": genus,
+        "species": species,
+        "mlst7": read_mlst7(mlst7),
+        "serotype": read_serotype(serotype),
+        "16s": {"sequences": read_16s(rrna_16s), "fasta": str(rrna_16s)},
+    }
+
+
+def write_summary(summary, output):
+    """Write the summary through a temporary file, so a complete file appears
+    at once for whoever is watching the output directory"""
+    output = pathlib.Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_output = output.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_output, "w") as file_:
+        json.dump(summary, file_, indent=2)
+    tmp_output.rename(output)
+
+
+def main(args):
+    summary = make_summary(
+        args.sample,
+        args.genus,
+        args.species,
+        args.mlst7,
+        args.serotype,
+        args.rrna_16s,
+    )
+    write_summary(summary, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sample", required=True, help="Sample name.")
+    parser.add_argument("--genus", required=True)
+    parser.add_argument("--species", required=True)
+    parser.add_argument(
+        "--mlst7",
+        type=pathlib.Path,
+        required=True,
+        help="data.json produced by MLST7 for the sample.",
+    )
+    parser.add_argument(
+        "--serotype",
+        type=pathlib.Path,
+        nargs="*",
+        default=[],
+        help="Output files of the serotyper(s) that ran for the sample.",
+    )
+    parser.add_argument(
+        "--rrna_16s",
+        type=pathlib.Path,
+        required=True,
+        help="Fasta file with the 16S sequences of the sample.",
+    )
+    parser.add_argument("-o", "--output", type=pathlib.Path, required=True)
+    main(parser.parse_args())
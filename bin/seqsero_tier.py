@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Decide whether a SeqSero2 k-mer mode (-m k) prediction can be reported or
+whether the sample should be serotyped again in microassembly mode (-m a).
+Prints 'k-mer' or 'microassembly: <reason>'.
+"""
+
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+from add_context_seqsero import add_context
+
+MISSING_VALUES = ["", "-", "N/A", "nan"]
+
+
+def get_column(df, prefix):
+    """Get the value of the first column starting with prefix"""
+    for column in df.columns:
+        if column.startswith(prefix):
+            return str(df[column].values[0]).strip()
+    return ""
+
+
+def needs_microassembly(df, df_context):
+    """
+    Check if a k-mer mode prediction needs to be confirmed in microassembly mode
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        SeqSero2 report (k-mer mode) of a single sample
+    df_context : pd.DataFrame
+        Context file (same as used by add_context_seqsero.py)
+
+    Returns
+    -------
+    str or None
+        Reason to run microassembly mode or None if the k-mer prediction
+        can be used
+    """
+    serotype = get_column(df, "Predicted serotype")
+    if serotype in MISSING_VALUES:
+        return "no serotype predicted in k-mer mode"
+    if " or " in serotype:
+        return f"ambiguous k-mer prediction ({serotype})"
+    for antigen in [
+        "O antigen prediction",
+        "H1 antigen prediction",
+        "H2 antigen prediction",
+    ]:
+        if get_column(df, antigen) in MISSING_VALUES:
+            return f"partial or monophasic k-mer prediction ({antigen} missing)"
+    for column, value in [
+        ("O antigen prediction", get_column(df, "O antigen prediction")),
+        ("Predicted serotype", serotype),
+    ]:
+        if add_context(df_context, value, column) is not None:
+            return f"context available for {column}={value}"
+    return None
+
+
+def main(args):
+    df = pd.read_csv(args.input, sep="\t", dtype=str).fillna("")
+    df_context = pd.read_csv(args.context, sep="\t")
+    if df.shape[0] != 1:
+        print("microassembly: no single sample k-mer report")
+        return
+    reason = needs_microassembly(df, df_context)
+    if reason is None:
+        print("k-mer")
+    else:
+        print(f"microassembly: {reason}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("Choose SeqSero2 tier")
+
+    parser.add_argument("-i", "--input", required=True, type=Path)
+    parser.add_argument("-c", "--context", required=True, type=Path)
+    parser.add_argument("--verbose", action="store_true")
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    main(args)
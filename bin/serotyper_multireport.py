@@ -148,28 +148,59 @@ class ShigatyperMultireport(SerotyperMultireport):
     def make_multireport(self):
         dflist_shigatyper = []
         dflist_command = []
+        screened_out_samples = []
         # We combined ecoli and shigatyper, so now this code wants to run for every output file
         # it only needs to run for the shigella output files
         # this code needs to be changed before the pipeline can function again
         for outfile in self.input_files:
             dirname_splitted = str(outfile).split("/")
 
-            if "command" in str(outfile):
+            if outfile.name == "shigella_screen.txt":
+                # E. coli samples in which ipaH was not found do not have
+                # ShigaTyper output
+                with open(outfile) as screen:
+                    if screen.read().strip() == "negative":
+                        screened_out_samples.append(dirname_splitted[-2])
+                continue
+
+            if outfile.name == "command.txt":
                 df = pd.read_csv(outfile, delimiter="\t")
                 df.drop(columns=["sample"], inplace=True)
                 df.insert(0, "Samplename", dirname_splitted[-2])
                 dflist_command.append(df)
 
-            if "shigatyper" in str(outfile):
+            if outfile.name == "shigatyper.csv":
                 df = pd.read_csv(outfile, delimiter=",")
                 if df.shape[0] == 0:
                     df.loc[len(df)] = "-"
                 df.insert(0, "Samplename", dirname_splitted[-2])
                 dflist_shigatyper.append(df)
 
-        final_df_shigatyper = pd.concat(dflist_shigatyper, axis=0, ignore_index=True)
-        final_df_command = pd.concat(dflist_command, axis=0, ignore_index=True)
-        results_df = pd.merge(final_df_shigatyper, final_df_command, on="Samplename")
+        if len(dflist_shigatyper) > 0:
+            final_df_shigatyper = pd.concat(
+                dflist_shigatyper, axis=0, ignore_index=True
+            )
+            final_df_command = pd.concat(dflist_command, axis=0, ignore_index=True)
+            results_df = pd.merge(
+                final_df_shigatyper, final_df_command, on="Samplename"
+            )
+        else:
+            results_df = pd.DataFrame(columns=["Samplename", "Hit"])
+        screened_out_samples = [
+            sample
+            for sample in screened_out_samples
+            if sample not in results_df["Samplename"].values
+        ]
+        if len(screened_out_samples) > 0:
+            screened_out_df = pd.DataFrame(
+                {
+                    "Samplename": screened_out_samples,
+                    "Hit": "ShigaTyper not run (ipaH not detected in the assembly)",
+                }
+            )
+            results_df = pd.concat(
+                [results_df, screened_out_df], axis=0, ignore_index=True
+            ).fillna("-")
         results_df.to_csv(self.output_file, mode="a", index=False)
         self.multireport = results_df
 
@@ -211,7 +242,11 @@ class ChooseMultireport:
                 input_files["serotypefinder"].append(file_)
             elif file_.endswith("pred.tsv"):
                 input_files["seroba"].append(file_)
-            elif file_.endswith("command.txt") or file_.endswith("shigatyper.csv"):
+            elif (
+                file_.endswith("command.txt")
+                or file_.endswith("shigatyper.csv")
+                or file_.endswith("shigella_screen.txt")
+            ):
                 input_files["shigatyper"].append(file_)
             elif file_.endswith("neisseriatyper.tab"):
                 input_files["neisseriatyper"].append(file_)
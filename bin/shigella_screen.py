@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Quick screen for the Shigella/EIEC marker gene ipaH in an assembly. It is used
+to decide whether ShigaTyper needs to run for an E. coli sample. The ipaH
+reference sequences are taken from the ShigaTyper installation, so this
+script should run in the ShigaTyper environment. If no reference can be
+found, the sample is reported as positive so that ShigaTyper is not skipped.
+"""
+
+import argparse
+import gzip
+import logging
+import pathlib
+
+KMER_SIZE = 31
+COMPLEMENT = str.maketrans("ACGT", "TGCA")
+
+
+def reverse_complement(seq):
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def read_fasta(file_path):
+    """Yield (name, sequence) for every record in a (gzipped) fasta file"""
+    with open(file_path, "rb") as fh:
+        gzipped = fh.read(2) == b"\x1f\x8b"
+    name = None
+    seq = []
+    with gzip.open(file_path, "rt") if gzipped else open(file_path) as fasta:
+        for line in fasta:
+            line = line.strip()
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, "".join(seq).upper()
+                name = line[1:].split()[0]
+                seq = []
+            else:
+                seq.append(line)
+    if name is not None:
+        yield name, "".join(seq).upper()
+
+
+def find_marker_sequences(marker="ipaH"):
+    """Get the sequences of a marker gene from the ShigaTyper references"""
+    import shigatyper
+
+    package_dir = pathlib.Path(shigatyper.__file__).parent
+    sequences = []
+    for pattern in ["*.fa", "*.fasta", "*.fna", "*.fa.gz", "*.fasta.gz"]:
+        for fasta in package_dir.rglob(pattern):
+            sequences.extend(
+                seq for name, seq in read_fasta(fasta) if marker.lower() in name.lower()
+            )
+    return sequences
+
+
+def marker_kmer_fraction(assembly, marker_sequences):
+    """Fraction of the k-mers of the marker gene(s) present in the assembly"""
+    marker_kmers = set()
+    for seq in marker_sequences:
+        for i in range(len(seq) - KMER_SIZE + 1):
+            kmer = seq[i : i + KMER_SIZE]
+            marker_kmers.add(kmer)
+            marker_kmers.add(reverse_complement(kmer))
+    if len(marker_kmers) == 0:
+        return 0.0
+    found = set()
+    for _, contig in read_fasta(assembly):
+        for i in range(len(contig) - KMER_SIZE + 1):
+            kmer = contig[i : i + KMER_SIZE]
+            if kmer in marker_kmers:
+                found.add(kmer)
+                found.add(reverse_complement(kmer))
+    return len(found) / len(marker_kmers)
+
+
+def main(args):
+    marker_sequences = find_marker_sequences()
+    if len(marker_sequences) == 0:
+        logging.warning("No ipaH reference found, ShigaTyper will not be skipped")
+        result = "positive"
+    else:
+        fraction = marker_kmer_fraction(args.input, marker_sequences)
+        logging.info(f"Fraction of ipaH k-mers found in the assembly: {fraction:.2f}")
+        result = "positive" if fraction >= args.min_kmer_fraction else "negative"
+    with open(args.output, "w") as output:
+        output.write(f"{result}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-i", "--input", required=True, type=pathlib.Path)
+    parser.add_argument("-o", "--output", required=True, type=pathlib.Path)
+    parser.add_argument(
+        "--min_kmer_fraction",
+        type=float,
+        default=0.5,
+        help="Minimum fraction of ipaH k-mers in the assembly to consider the "
+        "sample positive.",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    main(args)
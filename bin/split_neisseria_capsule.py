@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Split the combined result table(s) of characterize_neisseria_capsule (run for
+many assemblies at once) into one neisseriatyper.tab file per sample.
+"""
+
+import argparse
+import pathlib
+
+# Result tables written by characterize_neisseria_capsule, relative to its
+# output directory (other .tab files, e.g. BLAST results, are not results)
+RESULT_TABLES = "serogroup/*.tab"
+
+
+def read_combined_tables(input_dir):
+    """Read the header and the rows of the result tables in the output
+    directory of characterize_neisseria_capsule. All the tables should have
+    the same header."""
+    header = None
+    rows = []
+    for table in sorted(pathlib.Path(input_dir).glob(RESULT_TABLES)):
+        with open(table) as table_file:
+            lines = table_file.read().splitlines()
+        if len(lines) == 0:
+            continue
+        if header is not None and lines[0] != header:
+            raise ValueError(
+                f"The header of {table} is different from the header of the "
+                "other characterize_neisseria_capsule result tables"
+            )
+        header = lines[0]
+        rows.extend(line for line in lines[1:] if line.strip())
+    return header, rows
+
+
+def split_tables(input_dir, samples, assemblies, output_dir):
+    """
+    Write the rows of every sample to <output_dir>/<sample>/neisseriatyper.tab
+
+    The first column (Query) of the result table contains the name of the
+    assembly file, with or without extension.
+    """
+    header, rows = read_combined_tables(input_dir)
+    if header is None:
+        raise ValueError(f"No characterize_neisseria_capsule results in {input_dir}")
+    query_to_sample = {}
+    for sample, assembly in zip(samples, assemblies):
+        assembly = pathlib.Path(assembly)
+        query_to_sample[assembly.name] = sample
+        query_to_sample[assembly.stem] = sample
+    rows_per_sample = {sample: [] for sample in samples}
+    for row in rows:
+        query = row.split("\t")[0]
+        if query in query_to_sample:
+            rows_per_sample[query_to_sample[query]].append(row)
+    for sample, sample_rows in rows_per_sample.items():
+        sample_dir = pathlib.Path(output_dir).joinpath(sample)
+        sample_dir.mkdir(parents=True, exist_ok=True)
+        with open(sample_dir.joinpath("neisseriatyper.tab"), "w") as sample_table:
+            sample_table.write("\n".join([header, *sample_rows]) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-i",
+        "--input_dir",
+        type=pathlib.Path,
+        required=True,
+        help="Output directory of characterize_neisseria_capsule.",
+    )
+    parser.add_argument("-s", "--samples", nargs="+", required=True)
+    parser.add_argument(
+        "-a",
+        "--assemblies",
+        nargs="+",
+        required=True,
+        help="Assemblies in the same order as --samples.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_dir",
+        type=pathlib.Path,
+        required=True,
+        help="Directory in which a folder per sample is written.",
+    )
+    args = parser.parse_args()
+    split_tables(args.input_dir, args.samples, args.assemblies, args.output_dir)
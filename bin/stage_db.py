@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+import argparse
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+
+VERSION_FILE = ".juno_typing_db_version"
+
+# How often (s) the background process checks if the job using a staged copy
+# is still running
+POLL_SECONDS = 10
+
+
+def get_db_version(db_dir):
+    """
+    Get a version string for a database directory
+
+    The version is a hash of the relative path, size and modification time of
+    every file in the database (the .git directory is skipped), so any rebuild
+    of the indices results in a new version.
+
+    Parameters
+    ----------
+    db_dir : Path
+        Database directory
+
+    Returns
+    -------
+    str
+        Version of the database
+    """
+    signature = hashlib.sha1()
+    for root, dirs, files in os.walk(db_dir):
+        dirs[:] = sorted(d for d in dirs if d != ".git")
+        for file_ in sorted(files):
+            file_path = Path(root, file_)
+            stat = file_path.stat()
+            signature.update(
+                "{}\t{}\t{}\n".format(
+                    file_path.relative_to(db_dir), stat.st_size, int(stat.st_mtime)
+                ).encode()
+            )
+    return signature.hexdigest()
+
+
+def get_use_lock(staged_db):
+    """Lock file of a staged copy. Every job using the copy holds a shared
+    lock on it."""
+    return staged_db.with_name(staged_db.name + ".use")
+
+
+def is_in_use(staged_db):
+    """True if a job holds the shared lock of a staged copy. Only called while
+    holding the lock of the database, so no job can start using the copy in
+    the meantime."""
+    with open(get_use_lock(staged_db), "a") as use_lock:
+        try:
+            fcntl.flock(use_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+    return False
+
+
+def remove_copy(staged_db):
+    logging.info("Removing staged database {}".format(staged_db))
+    shutil.rmtree(staged_db, ignore_errors=True)
+    get_use_lock(staged_db).unlink(missing_ok=True)
+
+
+def job_is_running(job_pid):
+    try:
+        os.kill(job_pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def release_when_done(staged_db, db_lock_file, use_lock, job_pid, grace_minutes):
+    """
+    Keep the shared lock of a staged copy while the job runs, and remove the
+    copy grace_minutes after the job finished if no other job uses it by
+    then. Otherwise nothing would remove the copies (which take RAM in
+    /dev/shm) after the last job on a node.
+    """
+    while job_is_running(job_pid):
+        time.sleep(POLL_SECONDS)
+    time.sleep(grace_minutes * 60)
+    with open(db_lock_file, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        use_lock.close()
+        if not is_in_use(staged_db):
+            remove_copy(staged_db)
+
+
+def start_release_process(staged_db, db_lock, use_lock, job_pid, grace_minutes):
+    """Run release_when_done in a detached background process (it outlives
+    stage_db.py, which only prints the path of the copy)"""
+    child = os.fork()
+    if child > 0:
+        use_lock.close()
+        os.waitpid(child, 0)
+        return
+    # The background process must not keep the lock of the database or the
+    # output of stage_db.py (read by the job) open
+    db_lock.close()
+    os.setsid()
+    if os.fork() > 0:
+        os._exit(0)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in range(3):
+        os.dup2(devnull, fd)
+    try:
+        release_when_done(
+            staged_db, Path(db_lock.name), use_lock, job_pid, grace_minutes
+        )
+    finally:
+        os._exit(0)
+
+
+def stage_db(db_dir, stage_dir, version=None, job_pid=None, grace_minutes=10):
+    """
+    Copy a database to a node-local directory (e.g. local scratch or /dev/shm)
+
+    The copy is done only once per node and database version. A lock file
+    makes sure that jobs starting at the same time on one node wait for the
+    first one to finish the copy instead of copying the database themselves.
+    If job_pid is given, the job holds a shared lock on the copy until it
+    finishes, so copies are never removed while they are used. Copies of
+    other versions of the same database are removed once no job uses them,
+    and a copy is removed grace_minutes after the last job using it finished.
+
+    Parameters
+    ----------
+    db_dir : Path
+        Database directory on the shared file system
+    stage_dir : Path
+        Node-local directory where the database should be staged
+    version : str, optional
+        Version of the database (see get_db_version). juno_typing.py computes
+        it once per run, so the jobs do not need to walk the whole database on
+        the shared file system. It is computed here if not given.
+    job_pid : int, optional
+        Process of the job that uses the copy
+    grace_minutes : float
+        Time the copy is kept after the last job using it finished
+
+    Returns
+    -------
+    Path
+        Path to the staged copy of the database
+    """
+    db_dir = Path(db_dir).resolve()
+    stage_dir = Path(os.path.expandvars(str(stage_dir)))
+    stage_dir.mkdir(parents=True, exist_ok=True)
+    if not version:
+        version = get_db_version(db_dir)
+    staged_db = stage_dir.joinpath("{}_{}".format(db_dir.name, version[:12]))
+    with open(stage_dir.joinpath("{}.lock".format(db_dir.name)), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        for old_copy in stage_dir.glob("{}_*".format(db_dir.name)):
+            if old_copy != staged_db and old_copy.is_dir():
+                if not is_in_use(old_copy):
+                    remove_copy(old_copy)
+        version_file = staged_db.joinpath(VERSION_FILE)
+        if version_file.exists() and version_file.read_text() == version:
+            logging.info("Using staged copy of {} at {}".format(db_dir, staged_db))
+        else:
+            shutil.rmtree(staged_db, ignore_errors=True)
+            logging.info("Staging {} to {}".format(db_dir, staged_db))
+            tmp_db = stage_dir.joinpath("tmp_{}_{}".format(db_dir.name, os.getpid()))
+            try:
+                shutil.copytree(db_dir, tmp_db, ignore=shutil.ignore_patterns(".git"))
+                tmp_db.joinpath(VERSION_FILE).write_text(version)
+                tmp_db.rename(staged_db)
+            except BaseException:
+                # e.g. the node-local disk is full, do not leave a partial copy
+                shutil.rmtree(tmp_db, ignore_errors=True)
+                raise
+        if job_pid is not None:
+            use_lock = open(get_use_lock(staged_db), "a")
+            fcntl.flock(use_lock, fcntl.LOCK_SH)
+            start_release_process(staged_db, lock, use_lock, job_pid, grace_minutes)
+    return staged_db
+
+
+def main(args):
+    if args.stage_dir:
+        print(
+            stage_db(
+                args.db_dir,
+                args.stage_dir,
+                args.db_version,
+                args.job_pid,
+                args.grace_minutes,
+            )
+        )
+    else:
+        print(args.db_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Stage a database to node-local storage and print the path to use"
+    )
+
+    parser.add_argument("-d", "--db_dir", required=True, type=Path)
+    parser.add_argument(
+        "-s",
+        "--stage_dir",
+        default="",
+        type=str,
+        help="Node-local directory to stage the database to. If empty, the "
+        "database is not staged and its original path is printed.",
+    )
+    parser.add_argument(
+        "--db_version",
+        default="",
+        type=str,
+        help="Version of the database, as computed by get_db_version. If "
+        "empty, it is computed from the files in the database.",
+    )
+    parser.add_argument(
+        "--job_pid",
+        default=None,
+        type=int,
+        help="Process of the job that uses the staged copy (e.g. $$ in the "
+        "shell of the job). The copy is not removed while this process runs.",
+    )
+    parser.add_argument(
+        "--grace_minutes",
+        default=10,
+        type=float,
+        help="Minutes the staged copy is kept after the last job using it " "finished.",
+    )
+    parser.add_argument("--verbose", action="store_true")
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    main(args)
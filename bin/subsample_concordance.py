@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+MULTIREPORTS = [
+    "mlst7/mlst7_multireport.csv",
+    "serotype/serotyper_multireport.csv",
+    "serotype/serotyper_multireport1.csv",
+    "serotype/serotyper_multireport2.csv",
+    "serotype/serotyper_multireport3.csv",
+    "serotype/serotyper_multireport4.csv",
+]
+
+
+def read_multireport(report):
+    """
+    Read a multireport with the sample names as index
+
+    Returns
+    -------
+    DataFrame or None
+        The multireport (empty if the file is empty) or None if the file does
+        not exist
+    """
+    if not Path(report).exists():
+        return None
+    try:
+        df = pd.read_csv(report, dtype=str).fillna("")
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+    # The first column always contains the sample name
+    return df.set_index(df.columns[0])
+
+
+def compare_multireports(reference_report, subsampled_report):
+    """
+    Compare the typing results of two multireports, row by row
+
+    Parameters
+    ----------
+    reference_report : Path
+        Multireport obtained with all the reads
+    subsampled_report : Path
+        Multireport obtained with the subsampled reads
+
+    Returns
+    -------
+    list
+        List of dictionaries, one per result that differs between both reports.
+        If one of the reports is missing, every sample of the other report is
+        reported as different.
+    """
+    df_ref = read_multireport(reference_report)
+    df_sub = read_multireport(subsampled_report)
+    if df_ref is None or df_sub is None:
+        present = df_sub if df_ref is None else df_ref
+        if present is None:
+            return []
+        return [
+            {
+                "report": Path(reference_report).name,
+                "sample": sample,
+                "column": "report",
+                "all_reads": "missing" if df_ref is None else "present",
+                "subsampled_reads": "missing" if df_sub is None else "present",
+            }
+            for sample in present.index
+        ]
+    differences = []
+    for sample in df_ref.index.union(df_sub.index):
+        for column in df_ref.columns.intersection(df_sub.columns):
+            value_ref = df_ref.at[sample, column] if sample in df_ref.index else None
+            value_sub = df_sub.at[sample, column] if sample in df_sub.index else None
+            if value_ref != value_sub:
+                differences.append(
+                    {
+                        "report": Path(reference_report).name,
+                        "sample": sample,
+                        "column": column,
+                        "all_reads": value_ref,
+                        "subsampled_reads": value_sub,
+                    }
+                )
+    return differences
+
+
+def main(args):
+    differences = []
+    for report in MULTIREPORTS:
+        reference_report = args.reference.joinpath(report)
+        subsampled_report = args.subsampled.joinpath(report)
+        if not reference_report.exists() and not subsampled_report.exists():
+            continue
+        logging.info(f"Comparing {reference_report} and {subsampled_report}")
+        differences.extend(compare_multireports(reference_report, subsampled_report))
+
+    df = pd.DataFrame(
+        differences,
+        columns=["report", "sample", "column", "all_reads", "subsampled_reads"],
+    )
+    logging.info(f"Writing to {args.output}")
+    df.to_csv(args.output, index=False)
+    if df.shape[0] > 0:
+        samples = ", ".join(df["sample"].unique())
+        raise SystemExit(f"Typing results differ for the samples: {samples}")
+    print("Typing results are identical with and without subsampling.")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        "Check that the typing results of a run with subsampled reads are the "
+        "same as the results of a run using all the reads"
+    )
+
+    parser.add_argument(
+        "-r",
+        "--reference",
+        required=True,
+        type=Path,
+        help="Output directory of a juno-typing run without --subsample_reads",
+    )
+    parser.add_argument(
+        "-s",
+        "--subsampled",
+        required=True,
+        type=Path,
+        help="Output directory of a juno-typing run with --subsample_reads",
+    )
+    parser.add_argument("-o", "--output", required=True, type=Path)
+    parser.add_argument("--verbose", action="store_true")
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+
+    main(args)
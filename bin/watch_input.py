@@ -0,0 +1,78 @@
+"""
+Helpers for the watch mode of juno-typing (--watch). The input directory and
+the metadata file are polled for changes, and samples are only typed once all
+their files are complete (not modified for a while), so samples can be typed
+while the sequencer is still writing the rest of the run.
+"""
+
+import os
+import pathlib
+import time
+
+SAMPLE_FILES = ["R1", "R2", "assembly"]
+
+
+def snapshot(paths):
+    """
+    Size and modification time of all the files in paths (directories are
+    searched recursively). Two equal snapshots mean nothing was added or
+    changed in between.
+
+    Returns
+    -------
+    dict
+        File path as key and (size, modification time) as value
+    """
+    files = {}
+    for path in paths:
+        path = pathlib.Path(path)
+        if path.is_file():
+            candidates = [path]
+        elif path.is_dir():
+            candidates = [f for f in path.rglob("*") if f.is_file()]
+        else:
+            candidates = []
+        for file_ in candidates:
+            try:
+                stat = os.stat(file_)
+            except FileNotFoundError:
+                continue
+            files[str(file_)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def get_unsettled_samples(samples, settle_seconds, now=None):
+    """
+    Samples with an input file that is missing or that was modified less than
+    settle_seconds ago (probably still being written)
+
+    Parameters
+    ----------
+    samples : dict
+        Sample sheet (with the R1, R2 and/or assembly files of every sample)
+    settle_seconds : int
+        Time that the files of a sample must be unchanged to be typed
+    now : float, optional
+        Current time (seconds since the epoch). Default is time.time()
+
+    Returns
+    -------
+    list
+        Names of the samples that should be left for a later batch
+    """
+    if now is None:
+        now = time.time()
+    unsettled = []
+    for sample, sample_info in samples.items():
+        for key in SAMPLE_FILES:
+            if key not in sample_info:
+                continue
+            try:
+                modified = os.stat(sample_info[key]).st_mtime
+            except FileNotFoundError:
+                unsettled.append(sample)
+                break
+            if now - modified < settle_seconds:
+                unsettled.append(sample)
+                break
+    return unsettled
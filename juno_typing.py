@@ -13,7 +13,11 @@ Documentation: https://rivm-bioinformatics.github.io/ids_bacteriology_man/juno-t
 
 # Dependencies
 import argparse
+import hashlib
+import json
+import sqlite3
 import subprocess
+import time
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional
@@ -22,9 +26,27 @@ import yaml
 from juno_library import Pipeline
 
 # Own scripts
+import bin.db_update_impact
 import bin.download_dbs
+import bin.mlst7_profile_index
+import bin.preflight
+import bin.result_cache
+import bin.stage_db
+import bin.watch_input
 from version import __package_name__, __version__
 
+# Values of the (optional) priority column of the metadata. The jobs of urgent
+# samples are scheduled before those of routine samples.
+PRIORITY_LANES = ["routine", "urgent"]
+
+
+def get_shard(sample: str, shards: int) -> int:
+    """Shard (1 to shards) of a sample. It only depends on the sample name, so
+    a sample is always in the same shard, whatever other samples are in the
+    run"""
+    sample_hash = hashlib.sha1(sample.encode()).hexdigest()
+    return int(sample_hash, 16) % shards + 1
+
 
 def main() -> None:
     juno_typing = JunoTyping()
@@ -54,7 +76,9 @@ class JunoTyping(Pipeline):
             "with the name of the sample (same than file name but removing "
             "the suffix _R1.fastq.gz), a column called "
             "'genus' and a column called 'species'. The genus and species "
-            "provided will be used to choose the serotyper and the MLST schema(s)."
+            "provided will be used to choose the serotyper and the MLST schema(s). "
+            "An optional column called 'priority' (routine or urgent) can be "
+            "used to type urgent samples first."
             "If a metadata file is provided, it will overwrite the --species "
             "argument for the samples present in the metadata file.",
         )
@@ -79,6 +103,27 @@ class JunoTyping(Pipeline):
             default="/mnt/db/juno/typing_db",
             help="Relative or absolute path to the directory that contains the databases for all the tools used in this pipeline or where they should be downloaded. Default is: /mnt/db/juno/typing_db",
         )
+        self.add_argument(
+            "--db_staging_dir",
+            type=str,
+            metavar="DIR",
+            default="",
+            help="Node-local directory (e.g. '$TMPDIR/juno_typing' or '/dev/shm/juno_typing') where the MLST7 and SerotypeFinder databases are copied once per node before they are used. Environment variables are expanded on the node running the job. Default is to use the databases in --db_dir directly.",
+        )
+        self.add_argument(
+            "--mlst7_input",
+            type=str,
+            choices=["reads", "assembly"],
+            default="reads",
+            help="Input used for the 7-locus MLST: the reads (mapped with KMA) or the assembly (aligned with BLAST). Default is reads.",
+        )
+        self.add_argument(
+            "--mlst7_caller",
+            type=str,
+            choices=["cge-mlst", "native"],
+            default="cge-mlst",
+            help="Tool used for the 7-locus MLST. 'native' calls the alleles and ST by exact matching against a k-mer index of the MLST database (cached in <db_dir>/mlst7_kmer_index) and falls back to cge-mlst for samples with novel or ambiguous alleles. 'native' can only be used with --mlst7_input assembly. Default is cge-mlst.",
+        )
         self.add_argument(
             "--serotypefinder_mincov",
             type=float,
@@ -105,7 +150,38 @@ class JunoTyping(Pipeline):
             type=int,
             metavar="INT",
             default=71,
-            help="Minimum coverage to be used for the SerotypeFinder (E. coli serotyping) tool. It accepts values from 0-100. Default is 20",
+            help="Kmer size used to build the Seroba (S. pneumoniae serotyping) database. A separate build is kept for every kmer size and database version. Default is 71",
+        )
+        self.add_argument(
+            "--seroba_db_retention_days",
+            type=int,
+            metavar="INT",
+            default=30,
+            help="Seroba database builds (one per kmer size and database version) that have not been used for this number of days are removed. Default is 30",
+        )
+        self.add_argument(
+            "--stage_reads",
+            action="store_true",
+            help="Decompress the reads of every sample once, before they are used by the read-based typers (MLST7, SeqSero2, Seroba and ShigaTyper). The decompressed reads are removed as soon as the last typer using them has finished. Requires --read_staging_dir; without it the reads are not staged.",
+        )
+        self.add_argument(
+            "--read_staging_dir",
+            type=Path,
+            metavar="DIR",
+            default=None,
+            help="Fast scratch directory where the decompressed reads are written when using --stage_reads (e.g. a local disk when all jobs run on one machine, or a scratch file system close to the nodes). It must be accessible from all the nodes running jobs. Staging is skipped if no directory is given, since writing the decompressed reads next to the output on the shared file system costs more I/O than it saves.",
+        )
+        self.add_argument(
+            "--subsample_reads",
+            action="store_true",
+            help="Subsample the reads of every sample to --subsample_coverage before running the read-based typers (MLST7, SeqSero2, Seroba and ShigaTyper). The coverage is calculated with the expected genome size of the genus (files/expected_genome_size.yaml).",
+        )
+        self.add_argument(
+            "--subsample_coverage",
+            type=int,
+            metavar="INT",
+            default=100,
+            help="Target coverage when using --subsample_reads. Samples with a lower coverage are not subsampled. Default is 100",
         )
         self.add_argument(
             "--bordetella_vaccine_antigen_scheme_name",
@@ -114,11 +190,98 @@ class JunoTyping(Pipeline):
             default="bordetella",
             help="Name for the directory containing the Bordetella vaccine antigen MLST scheme in --db_dir. Should contain a BLAST db with base name bordetella.fa",
         )
+        self.add_argument(
+            "--barrnap_batch_size",
+            type=int,
+            metavar="INT",
+            default=1,
+            help="Number of assemblies combined in one barrnap run for the 16S extraction. The 16S sequences are split per sample afterwards. Default is 1 (one barrnap run per sample).",
+        )
+        self.add_argument(
+            "--no-cache",
+            dest="no_cache",
+            action="store_true",
+            help="Do not use the result cache: all samples are typed again and no results are stored.",
+        )
+        self.add_argument(
+            "--result_cache_dir",
+            type=Path,
+            metavar="DIR",
+            default=None,
+            help="Directory of the result cache, shared between runs. Results are restored from the cache if the input files, tool and database versions and parameters are the same. Default is a 'result_cache' folder inside --db_dir.",
+        )
+        self.add_argument(
+            "--result_cache_max_gb",
+            type=int,
+            metavar="INT",
+            default=100,
+            help="Maximum size of the result cache in GB. The least recently used results are removed at the start of a run when the cache is larger. Default is 100.",
+        )
+        self.add_argument(
+            "--watch",
+            action="store_true",
+            help="Keep running after the samples in the input directory are typed, and type new samples as soon as their files are complete. The multireports are updated after every new batch. Stop with Ctrl+C.",
+        )
+        self.add_argument(
+            "--watch_interval",
+            type=int,
+            metavar="INT",
+            default=60,
+            help="Seconds between checks of the input directory and metadata file for new samples when using --watch. Default is 60.",
+        )
+        self.add_argument(
+            "--watch_settle",
+            type=int,
+            metavar="INT",
+            default=300,
+            help="Seconds that the files of a sample must be unchanged before the sample is typed when using --watch (files that are still being written are skipped). Default is 300.",
+        )
+        self.add_argument(
+            "--watch_timeout",
+            type=float,
+            metavar="HOURS",
+            default=0,
+            help="Stop watching after this number of hours without new samples. Default is 0 (keep watching until stopped).",
+        )
+        self.add_argument(
+            "--no-preflight",
+            dest="no_preflight",
+            action="store_true",
+            help="Do not check the input files before the run. By default, all input files are read once (in parallel) to check that they are not empty, corrupt or truncated and that they have the right format. Samples that fail are not typed and are listed in audit_trail/preflight_report.csv.",
+        )
+        self.add_argument(
+            "--preflight_threads",
+            type=int,
+            metavar="INT",
+            default=8,
+            help="Number of input files checked in parallel before the run. Default is 8.",
+        )
+        self.add_argument(
+            "--shards",
+            type=int,
+            metavar="INT",
+            default=1,
+            help="Split the samples in this number of shards that are run separately (for instance from different submit hosts), each with its own output directory. Only the samples of --shard_index are typed in this run. The results of all shards can be merged with bin/merge_shards.py. Default is 1 (no sharding).",
+        )
+        self.add_argument(
+            "--shard_index",
+            type=int,
+            metavar="INT",
+            default=1,
+            help="Shard that is typed in this run (1 to --shards). Default is 1.",
+        )
         self.add_argument(
             "--update",
             action="store_true",
             help="Force database update even if they are present.",
         )
+        self.add_argument(
+            "--seqsero_mode",
+            type=str,
+            choices=["microassembly", "tiered"],
+            default="microassembly",
+            help="Mode used to run SeqSero2 (Salmonella serotyping). 'tiered' runs the fast k-mer mode first and the microassembly mode only if the k-mer prediction is ambiguous, partial/monophasic or listed in --seqsero_context. Default is microassembly.",
+        )
         self.add_argument(
             "--seqsero_context",
             type=Path,
@@ -134,25 +297,86 @@ class JunoTyping(Pipeline):
 
         args = super()._parse_args()
         self.db_dir: Path = args.db_dir.resolve()
+        self.db_staging_dir: str = args.db_staging_dir
 
         self.genus: Optional[str]
         self.species: Optional[str]
         self.genus, self.species = args.species
         self.metadata_file: Path = args.metadata
+        self.mlst7_input: str = args.mlst7_input
+        self.mlst7_caller: str = args.mlst7_caller
+        # The native caller counts the k-mers of the reads in Python. Until
+        # bin/benchmark_mlst7_caller.py shows it is faster than KMA on real
+        # read sets, it is only used for assemblies
+        if self.mlst7_caller == "native" and self.mlst7_input != "assembly":
+            raise ValueError("--mlst7_caller native requires --mlst7_input assembly.")
         self.serotypefinder_mincov: float = args.serotypefinder_mincov
         self.serotypefinder_identity: float = args.serotypefinder_identity
         self.seroba_mincov: int = args.seroba_mincov
         self.seroba_kmersize: int = args.seroba_kmersize
+        self.seroba_db_retention_days: int = args.seroba_db_retention_days
+        self.read_staging_dir: Optional[Path] = args.read_staging_dir
+        self.stage_reads: bool = args.stage_reads and self.read_staging_dir is not None
+        if args.stage_reads and not self.stage_reads:
+            print(
+                "--stage_reads requires a --read_staging_dir on fast scratch "
+                "storage. The reads will not be staged."
+            )
+        self.subsample_reads: bool = args.subsample_reads
+        self.subsample_coverage: int = args.subsample_coverage
         self.bordetella_vaccine_antigen_scheme: str = (
             args.bordetella_vaccine_antigen_scheme_name
         )
+        self.barrnap_batch_size: int = args.barrnap_batch_size
         self.update_dbs: bool = args.update
+        self.use_cache: bool = not args.no_cache
+        self.result_cache_dir: Path = (
+            args.result_cache_dir.resolve()
+            if args.result_cache_dir is not None
+            else self.db_dir.joinpath("result_cache")
+        )
+        self.result_cache_max_gb: int = args.result_cache_max_gb
+        self.watch: bool = args.watch
+        self.watch_interval: int = args.watch_interval
+        self.watch_settle: int = args.watch_settle
+        self.watch_timeout: float = args.watch_timeout
+        self.preflight: bool = not args.no_preflight
+        self.preflight_threads: int = args.preflight_threads
+        self.shards: int = args.shards
+        self.shard_index: int = args.shard_index
+        if not 1 <= self.shard_index <= self.shards:
+            raise ValueError(
+                f"--shard_index ({self.shard_index}) should be between 1 and "
+                f"--shards ({self.shards})."
+            )
         self.seqsero_context: Path = args.seqsero_context
+        self.seqsero_mode: str = args.seqsero_mode
         return args
 
     def setup(self) -> None:
         super().setup()
+        self.unsettled_samples: list[str] = []
+        if self.watch:
+            self.unsettled_samples = bin.watch_input.get_unsettled_samples(
+                self.sample_dict, self.watch_settle
+            )
+            for sample in self.unsettled_samples:
+                del self.sample_dict[sample]
         self.update_sample_dict_with_metadata()
+        if self.shards > 1:
+            other_shards = [
+                sample
+                for sample in self.sample_dict
+                if get_shard(sample, self.shards) != self.shard_index
+            ]
+            for sample in other_shards:
+                del self.sample_dict[sample]
+            print(
+                f"Shard {self.shard_index} of {self.shards}: typing "
+                f"{len(self.sample_dict)} sample(s)."
+            )
+        if self.preflight and not self.dryrun and not self.unlock:
+            self.check_input_files()
 
         if self.snakemake_args["use_singularity"]:
             self.snakemake_args["singularity_args"] = " ".join(
@@ -167,7 +391,15 @@ class JunoTyping(Pipeline):
             "db_dir": str(self.db_dir),
             "mlst7_db": str(self.db_dir.joinpath("mlst7_db")),
             "seroba_db": str(self.db_dir.joinpath("seroba_db")),
+            "seroba_db_build": str(self.get_seroba_build_dir()),
             "serotypefinder_db": str(self.db_dir.joinpath("serotypefinder_db")),
+            "db_staging_dir": self.db_staging_dir,
+            "db_versions": {},
+            "mlst7": {
+                "input": self.mlst7_input,
+                "caller": self.mlst7_caller,
+                "index_dir": str(self.db_dir.joinpath("mlst7_kmer_index")),
+            },
             "serotypefinder": {
                 "min_cov": self.serotypefinder_mincov,
                 "identity_thresh": self.serotypefinder_identity,
@@ -176,6 +408,21 @@ class JunoTyping(Pipeline):
                 "min_cov": self.seroba_mincov,
                 "kmer_size": self.seroba_kmersize,
             },
+            "stage_reads": {
+                "enabled": self.stage_reads,
+                # The default is never used: staging is disabled without a
+                # staging dir, but the rule needs a path for its outputs
+                "staging_dir": str(
+                    self.read_staging_dir.resolve()
+                    if self.read_staging_dir is not None
+                    else self.output_dir.joinpath("staged_reads")
+                ),
+            },
+            "subsample": {
+                "enabled": self.subsample_reads,
+                "coverage": self.subsample_coverage,
+                "seed": 100,
+            },
             "bordetella_vaccine_antigen_scheme": str(
                 self.bordetella_vaccine_antigen_scheme
             ),
@@ -185,7 +432,17 @@ class JunoTyping(Pipeline):
                     "bordetella.fa",
                 )
             ),
+            "barrnap_batch_size": self.barrnap_batch_size,
+            "batched_samples": None,
+            "result_cache": {
+                "enabled": False,
+                "store_dir": str(self.result_cache_dir),
+                "keys": {},
+            },
             "seqsero_context": str(self.seqsero_context),
+            "seqsero": {
+                "mode": self.seqsero_mode,
+            },
         }
 
         with open(
@@ -193,6 +450,37 @@ class JunoTyping(Pipeline):
         ) as f:
             parameters_dict = yaml.safe_load(f)
         self.snakemake_config.update(parameters_dict)
+        self.snakemake_args["overwrite_groups"] = parameters_dict.get("job_groups")
+        self.snakemake_args["group_components"] = parameters_dict.get(
+            "group_components"
+        )
+        # All the jobs needed for the summary of an urgent sample (which
+        # depends on all its typers) get the highest priority
+        self.snakemake_args["prioritytargets"] = [
+            str(self.output_dir.joinpath("summary", f"{sample}.json"))
+            for sample in self.sample_dict
+            if self.sample_dict[sample]["priority"] == "urgent"
+        ]
+
+    def get_seroba_build_dir(self) -> Path:
+        """Seroba database build used by the pipeline. It is chosen again
+        after the databases are checked (run_batch), but dry runs do not
+        download anything, so it is also chosen here from the database that
+        is already downloaded (if any)."""
+        seroba_db_version = bin.download_dbs.get_downloaded_seroba_version(self.db_dir)
+        if seroba_db_version is None:
+            seroba_db_version = "master"
+            if self.dryrun:
+                print(
+                    "The Seroba database is not downloaded yet. The path of its "
+                    "build in this dry run is a placeholder."
+                )
+        return bin.download_dbs.find_seroba_build_dir(
+            self.db_dir,
+            seroba_db_version,
+            self.seroba_kmersize,
+            self.output_dir.joinpath("seroba_db_builds"),
+        )
 
     def update_sample_dict_with_metadata(self) -> None:
         self.get_metadata_from_csv_file(
@@ -200,6 +488,7 @@ class JunoTyping(Pipeline):
             expected_colnames=["sample", "genus", "species"],
         )
         # Add metadata
+        missing_metadata = []
         for sample in self.sample_dict:
             if self.genus is not None and self.species is not None:
                 self.sample_dict[sample]["genus"] = self.genus
@@ -208,6 +497,10 @@ class JunoTyping(Pipeline):
                 try:
                     self.sample_dict[sample].update(self.juno_metadata[sample])
                 except (KeyError, TypeError, AttributeError):
+                    # In watch mode the metadata can be added later
+                    if self.watch:
+                        missing_metadata.append(sample)
+                        continue
                     raise ValueError(
                         f"One of your samples is not in the metadata file "
                         f"({self.metadata_file}). Please ensure that all "
@@ -220,6 +513,30 @@ class JunoTyping(Pipeline):
                 self.sample_dict[sample]["species"] = (
                     self.sample_dict[sample]["species"].strip().lower()
                 )
+        for sample in missing_metadata:
+            del self.sample_dict[sample]
+        if missing_metadata:
+            print(
+                f"Waiting for the metadata of {len(missing_metadata)} sample(s): "
+                f"{', '.join(missing_metadata)}"
+            )
+        # Priority lane (also read when --species is given)
+        for sample in self.sample_dict:
+            try:
+                priority = self.juno_metadata[sample].get("priority")
+            except (KeyError, TypeError, AttributeError):
+                priority = None
+            # Empty cells are read as NaN
+            if not isinstance(priority, str) or priority.strip() == "":
+                priority = "routine"
+            priority = priority.strip().lower()
+            if priority not in PRIORITY_LANES:
+                raise ValueError(
+                    f"The priority of sample {sample} in the metadata file "
+                    f"({self.metadata_file}) is '{priority}'. It should be one "
+                    f"of: {', '.join(PRIORITY_LANES)} (or empty for routine)."
+                )
+            self.sample_dict[sample]["priority"] = priority
         # Update self.sample_dict
         with open("files/dictionary_correct_species.yaml") as translation_yaml:
             self.mlst7_species_translation_tbl = yaml.safe_load(translation_yaml)
@@ -232,53 +549,246 @@ class JunoTyping(Pipeline):
                     self.sample_dict[sample][
                         "species-mlst7"
                     ] = self.mlst7_species_translation_tbl.get(genus)
+        with open("files/expected_genome_size.yaml") as genome_size_yaml:
+            genome_size_tbl = yaml.safe_load(genome_size_yaml)
+            for sample in self.sample_dict:
+                genus = self.sample_dict[sample]["genus"].lower()
+                self.sample_dict[sample]["genome_size"] = genome_size_tbl.get(
+                    genus, genome_size_tbl["default"]
+                )
+
+    def check_input_files(self) -> None:
+        """Check the input files of all samples before anything is scheduled.
+        Samples with an empty, corrupt or truncated file are not typed. The
+        statistics of the other samples (e.g. the uncompressed size of their
+        files, used to estimate the memory of the jobs) are added to the
+        sample sheet."""
+        self.path_to_audit.mkdir(parents=True, exist_ok=True)
+        stats, errors = bin.preflight.run_preflight(
+            self.sample_dict,
+            self.path_to_audit.joinpath(bin.preflight.RESULTS_FILE),
+            self.preflight_threads,
+        )
+        bin.preflight.write_report(
+            self.sample_dict,
+            stats,
+            errors,
+            self.path_to_audit.joinpath("preflight_report.csv"),
+        )
+        for sample, sample_errors in errors.items():
+            print(
+                f"Sample {sample} will not be typed because of problems with its "
+                f"input files: {'; '.join(sample_errors)}"
+            )
+            del self.sample_dict[sample]
+        for sample, sample_stats in stats.items():
+            self.sample_dict[sample].update(sample_stats)
+
+    def retype_after_db_update(self) -> set[str]:
+        """Remove the results of the samples whose MLST7 scheme or serotyper
+        database changed since the previous run in the same output directory,
+        so only those samples are typed again. Returns the affected samples."""
+        contents_file = self.path_to_audit.joinpath(bin.db_update_impact.CONTENTS_FILE)
+        self.db_contents = bin.db_update_impact.get_database_contents(
+            self.db_dir, self.seroba_kmersize
+        )
+        retyped: set[str] = set()
+        if contents_file.exists():
+            affected = bin.db_update_impact.find_affected_samples(
+                self.sample_dict,
+                bin.db_update_impact.read_contents(contents_file),
+                self.db_contents,
+                self.output_dir,
+            )
+            bin.db_update_impact.remove_outputs(self.output_dir, affected)
+            for rule, samples in affected.items():
+                retyped.update(samples)
+                if samples:
+                    print(
+                        f"The database used by {rule} changed for {len(samples)} "
+                        f"sample(s), these will be typed again: {', '.join(samples)}"
+                    )
+        bin.db_update_impact.write_contents(contents_file, self.db_contents)
+        return retyped
+
+    def restore_cached_results(self) -> None:
+        """Restore the results of the jobs that are in the result cache and
+        pass the cache keys of the other jobs to the pipeline"""
+        try:
+            self.result_cache_dir.mkdir(parents=True, exist_ok=True)
+            bin.result_cache.evict(self.result_cache_dir, self.result_cache_max_gb)
+            keys = bin.result_cache.get_cache_keys(
+                self.sample_dict,
+                self.user_parameters,
+                self.downloads_versions,
+                lambda rule, sample_info: bin.db_update_impact.get_sample_db_content(
+                    self.db_contents, rule, sample_info
+                ),
+                self.result_cache_dir,
+                Path(__file__).parent,
+            )
+            restored = bin.result_cache.restore_results(
+                self.result_cache_dir, keys, self.output_dir
+            )
+        except PermissionError:
+            print(
+                f"No write access to the result cache ({self.result_cache_dir}). "
+                "The pipeline will run without it."
+            )
+            return
+        self.user_parameters["result_cache"] = {
+            "enabled": True,
+            "store_dir": str(self.result_cache_dir),
+            "keys": keys,
+        }
+        print(f"Restored {restored} result(s) from the result cache.")
+
+    def write_sample_sheet_json(self) -> None:
+        """Copy of the sample sheet used by the Snakefile (JSON is parsed much
+        faster than YAML when there are many samples)"""
+        self.path_to_audit.mkdir(parents=True, exist_ok=True)
+        sample_sheet_json = self.path_to_audit.joinpath("sample_sheet.json")
+        with open(sample_sheet_json, "w") as file_:
+            json.dump(self.sample_dict, file_, default=str)
+        self.user_parameters["sample_sheet_json"] = str(sample_sheet_json)
+
+    def watch_input_dir(self) -> None:
+        """Type new samples in batches as they appear in the input directory
+        (or in the metadata file), until no new samples arrive for
+        --watch_timeout hours"""
+        watched_paths = [self.input_dir]
+        if self.metadata_file is not None:
+            watched_paths.append(self.metadata_file)
+        previous_snapshot = bin.watch_input.snapshot(watched_paths)
+        typed_samples = set(self.sample_dict)
+        last_new_sample = time.time()
+        print(f"Watching {self.input_dir} for new samples. Stop with Ctrl+C.")
+        while True:
+            time.sleep(self.watch_interval)
+            if (
+                self.watch_timeout
+                and time.time() - last_new_sample > self.watch_timeout * 3600
+            ):
+                print(f"No new samples in {self.watch_timeout} hours, stopping.")
+                return
+            current_snapshot = bin.watch_input.snapshot(watched_paths)
+            # Samples whose files were still being written are checked again
+            # even if nothing changed
+            if current_snapshot == previous_snapshot and not self.unsettled_samples:
+                continue
+            previous_snapshot = current_snapshot
+            self.setup()
+            new_samples = sorted(set(self.sample_dict) - typed_samples)
+            if not new_samples:
+                continue
+            print(f"Typing {len(new_samples)} new sample(s): {', '.join(new_samples)}")
+            # The databases are only updated (--update) before the first batch.
+            # The rules that type several samples in one job (e.g. the
+            # Neisseria capsule) only get the new samples, otherwise they would
+            # run again for all the samples typed before
+            self.run_batch(update_dbs=False, batched_samples=new_samples)
+            typed_samples.update(self.sample_dict)
+            last_new_sample = time.time()
 
     def run(self) -> None:
         self.setup()
+        self.run_batch(update_dbs=self.update_dbs)
+        if self.watch and not self.dryrun and not self.unlock:
+            self.watch_input_dir()
+
+    def run_batch(
+        self, update_dbs: bool, batched_samples: Optional[list[str]] = None
+    ) -> None:
+        """Run the pipeline for the samples in the sample dict. Samples with
+        results in the output directory are not typed again. If
+        batched_samples is given, the rules that type several samples in one
+        job only get those samples."""
         if not self.dryrun or self.unlock:
             self.path_to_audit.mkdir(parents=True, exist_ok=True)
+            # Read by bin/merge_shards.py
+            with open(self.path_to_audit.joinpath("shard.yaml"), "w") as file_:
+                yaml.dump(
+                    {"shard_index": self.shard_index, "shards": self.shards},
+                    file_,
+                    default_flow_style=False,
+                )
             downloads_juno_typing = bin.download_dbs.DownloadsJunoTyping(
                 self.db_dir,
-                update_dbs=self.update_dbs,
+                update_dbs=update_dbs,
                 cge_mlst_asked_version="2.0.4",
                 mlst7_db_asked_version="master",
                 serotypefinder_db_asked_version="master",
                 seroba_db_asked_version="master",
+                seroba_kmersize=self.seroba_kmersize,
+                seroba_db_retention_days=self.seroba_db_retention_days,
+                seroba_build_fallback_dir=self.output_dir.joinpath("seroba_db_builds"),
             )
             self.downloads_versions = downloads_juno_typing.downloaded_versions
+            # The Seroba build is keyed by the commit that was actually downloaded
+            self.user_parameters["seroba_db_build"] = str(
+                downloads_juno_typing.seroba_build_dir
+            )
             with open(
                 self.path_to_audit.joinpath("database_versions.yaml"), "w"
             ) as file_:
                 yaml.dump(self.downloads_versions, file_, default_flow_style=False)
+            # Computed once per run instead of in every job that stages a
+            # database (it reads the whole database on the shared file system)
+            if self.db_staging_dir:
+                self.user_parameters["db_versions"] = {
+                    db: bin.stage_db.get_db_version(self.db_dir.joinpath(db))
+                    for db in ["mlst7_db", "serotypefinder_db"]
+                }
+            try:
+                bin.mlst7_profile_index.update_profile_index(
+                    self.db_dir.joinpath("mlst7_db")
+                )
+            except (PermissionError, sqlite3.OperationalError):
+                print(
+                    "Could not update the ST profile index of the MLST7 database "
+                    "(no write access). This does not affect the pipeline results."
+                )
 
         if not self.dryrun or self.unlock:
-            subprocess.run(
-                [
-                    "find",
-                    self.output_dir,
-                    "-type",
-                    "f",
-                    "-empty",
-                    "-exec",
-                    "rm",
-                    "{}",
-                    ";",
-                ]
-            )
-            subprocess.run(
-                [
-                    "find",
-                    self.output_dir,
-                    "-type",
-                    "d",
-                    "-empty",
-                    "-exec",
-                    "rm",
-                    "-rf",
-                    "{}",
-                    ";",
-                ]
-            )
+            # Only before the first batch: in watch mode, the later batches
+            # would remove the empty placeholders of the samples typed before
+            # (e.g. of no_mlst7), so their jobs would run again
+            if batched_samples is None:
+                subprocess.run(
+                    [
+                        "find",
+                        self.output_dir,
+                        "-type",
+                        "f",
+                        "-empty",
+                        "-exec",
+                        "rm",
+                        "{}",
+                        ";",
+                    ]
+                )
+                subprocess.run(
+                    [
+                        "find",
+                        self.output_dir,
+                        "-type",
+                        "d",
+                        "-empty",
+                        "-exec",
+                        "rm",
+                        "-rf",
+                        "{}",
+                        ";",
+                    ]
+                )
+            if not self.unlock:
+                retyped = self.retype_after_db_update()
+                if batched_samples is not None:
+                    batched_samples = sorted(set(batched_samples) | retyped)
+                if self.use_cache:
+                    self.restore_cached_results()
+        self.user_parameters["batched_samples"] = batched_samples
+        self.write_sample_sheet_json()
         super().run()
 
 
@@ -3,14 +3,17 @@ import os
 from pathlib import Path
 from sys import path
 import unittest
+from unittest import mock
+
+from snakemake import snakemake
 
 main_script_path = str(Path(Path(__file__).parent.absolute()).parent.absolute())
 downloads_db_path = str(Path(__file__).parent.parent.absolute().joinpath("bin"))
 path.insert(0, main_script_path)
 path.insert(0, downloads_db_path)
 
-from juno_typing import JunoTyping
-from download_dbs import DownloadsJunoTyping
+from juno_typing import JunoTyping, get_shard
+from download_dbs import DownloadsJunoTyping, find_seroba_build_dir
 
 # from ..bin.download_dbs import DownloadsJunoTyping
 
@@ -47,6 +50,14 @@ class TestDownloadDbs(unittest.TestCase):
             seroba_kmersize=50,
         )
         self.assertEqual(downloads.seroba_kmersize, 50)
+        self.assertEqual(downloads.downloaded_versions["seroba_kmersize"], 50)
+        self.assertEqual(
+            downloads.seroba_build_dir,
+            path_to_db.joinpath(
+                "seroba_db_builds", f"{downloads.downloaded_versions['seroba_db']}_k50"
+            ),
+        )
+        self.assertTrue(downloads.seroba_build_dir.joinpath("last_used").exists())
         self.assertEqual(downloads.downloaded_versions["mlst7"], "2.0.4")
         self.assertTrue(path_to_bin.joinpath("cge-mlst", "mlst.py").exists())
         self.assertTrue(
@@ -152,6 +163,148 @@ class TestJunoTypingDryRun(unittest.TestCase):
         juno_typing.run()
 
 
+class TestSerobaBuildDir(unittest.TestCase):
+    """Testing the choice of the Seroba database build"""
+
+    def setUp(self) -> None:
+        self.db_dir = Path("fake_seroba_db_dir")
+        self.db_dir.joinpath("seroba_db", "database").mkdir(parents=True)
+
+    def tearDown(self) -> None:
+        os.system("rm -rf fake_seroba_db_dir")
+
+    def test_versioned_build(self) -> None:
+        """A new build goes to seroba_db_builds if it is writable"""
+        self.assertEqual(
+            find_seroba_build_dir(self.db_dir, "abc", 71, Path("fallback")),
+            self.db_dir.joinpath("seroba_db_builds", "abc_k71"),
+        )
+
+    def test_in_place_build(self) -> None:
+        """A database built in place with the same kmer size is used, one
+        with another kmer size is not"""
+        self.db_dir.joinpath("seroba_db", "database", "kmer_size.txt").write_text(
+            "71\n"
+        )
+        self.assertEqual(
+            find_seroba_build_dir(self.db_dir, "abc", 71, Path("fallback")),
+            self.db_dir.joinpath("seroba_db"),
+        )
+        self.assertEqual(
+            find_seroba_build_dir(self.db_dir, "abc", 50, Path("fallback")),
+            self.db_dir.joinpath("seroba_db_builds", "abc_k50"),
+        )
+
+    def test_read_only_db_dir(self) -> None:
+        """Without write access to the database directory, the database is
+        built in the fallback directory"""
+        with mock.patch("download_dbs.os.access", return_value=False):
+            self.assertEqual(
+                find_seroba_build_dir(self.db_dir, "abc", 71, Path("fallback")),
+                Path("fallback", "abc_k71"),
+            )
+
+
+class TestSharding(unittest.TestCase):
+    """Testing the split of the samples in shards"""
+
+    def test_get_shard(self) -> None:
+        """Every sample is always in the same shard, and the shards have a
+        similar size"""
+        samples = [f"sample{i}" for i in range(1000)]
+        shards = [get_shard(sample, 4) for sample in samples]
+        self.assertEqual(shards, [get_shard(sample, 4) for sample in samples])
+        self.assertEqual(set(shards), {1, 2, 3, 4})
+        for shard in range(1, 5):
+            self.assertGreater(shards.count(shard), 200)
+
+
+class TestPriorityLanes(unittest.TestCase):
+    """Testing that the jobs of urgent samples are scheduled first"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        Path("fake_dir_priority").mkdir(exist_ok=True)
+        for sample in ["sample1", "sample2", "sample3"]:
+            for suffix in ["_R1.fastq.gz", "_R2.fastq.gz", ".fasta"]:
+                Path("fake_dir_priority", f"{sample}{suffix}").write_text("content")
+        # Input of the mlst7 rule (the databases are not needed in a dry run)
+        mlst7_scheme = Path("fake_db_priority", "mlst7_db", "senterica")
+        mlst7_scheme.mkdir(parents=True, exist_ok=True)
+        mlst7_scheme.joinpath("senterica.length.b").touch()
+        with open("fake_dir_priority/fake_metadata.csv", mode="w") as metadata_file:
+            metadata_writer = csv.writer(metadata_file, delimiter=",")
+            metadata_writer.writerow(["sample", "genus", "species", "priority"])
+            metadata_writer.writerow(["sample1", "Salmonella", "enterica", "routine"])
+            metadata_writer.writerow(["sample2", "Escherichia", "coli", ""])
+            metadata_writer.writerow(["sample3", "Salmonella", "enterica", "Urgent"])
+
+        argv = [
+            "-i",
+            "fake_dir_priority",
+            "-o",
+            "test_output_priority",
+            "-n",
+            "--db_dir",
+            "fake_db_priority",
+            "--metadata",
+            "fake_dir_priority/fake_metadata.csv",
+        ]
+        cls.juno_typing = JunoTyping(argv=argv)
+        cls.juno_typing.setup()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        for folder in ["fake_dir_priority", "fake_db_priority", "test_output_priority"]:
+            os.system("rm -rf {}".format(str(folder)))
+
+    def test_priority_from_metadata(self) -> None:
+        """The priority column is read from the metadata (empty is routine)"""
+        self.assertEqual(
+            {
+                sample: sample_info["priority"]
+                for sample, sample_info in self.juno_typing.sample_dict.items()
+            },
+            {"sample1": "routine", "sample2": "routine", "sample3": "urgent"},
+        )
+        self.assertEqual(
+            self.juno_typing.snakemake_args["prioritytargets"],
+            [str(self.juno_typing.output_dir.joinpath("summary", "sample3.json"))],
+        )
+
+    def test_urgent_jobs_get_top_priority(self) -> None:
+        """In a dry run of the pipeline, the typers of the urgent sample (and
+        only those) get the highest priority"""
+        self.juno_typing.write_sample_sheet_json()
+        config = {
+            **self.juno_typing.snakemake_config,
+            **self.juno_typing.user_parameters,
+            "sample_sheet": "",
+        }
+        jobs = []
+        self.assertTrue(
+            snakemake(
+                str(Path(main_script_path).joinpath("Snakefile")),
+                cores=1,
+                config=config,
+                dryrun=True,
+                prioritytargets=self.juno_typing.snakemake_args["prioritytargets"],
+                log_handler=[
+                    lambda msg: jobs.append(msg) if msg["level"] == "job_info" else None
+                ],
+            )
+        )
+        top_priority = {
+            (job["name"], job["wildcards"].get("sample"))
+            for job in jobs
+            if job["priority"] == "highest"
+        }
+        self.assertIn(("mlst7", "sample3"), top_priority)
+        self.assertIn(("salmonella_serotyper", "sample3"), top_priority)
+        self.assertIn(("sample_summary", "sample3"), top_priority)
+        self.assertEqual({sample for _, sample in top_priority}, {"sample3"})
+
+
 @unittest.skipIf(
     not Path(
         "/data/BioGrid/hernanda/test_data_per_pipeline/Enteric/Juno-typing/"
@@ -3,14 +3,34 @@ from numpy import nan
 import os
 import pandas as pd
 import pathlib
+import subprocess
 from sys import path
+import sqlite3
+import time
 import unittest
+from unittest import mock
 
 main_script_path = str(
     pathlib.Path(pathlib.Path(__file__).parent.absolute()).parent.absolute()
 )
 path.insert(0, main_script_path)
+path.insert(0, str(pathlib.Path(main_script_path).joinpath("bin")))
 from bin import serotyper_multireport
+from bin import stage_db
+from bin import subsample_concordance
+import mlst7_caller
+import mlst7_profile_index
+import preflight
+import result_cache
+import sample_summary
+import benchmark_report
+import calibrate_resources
+import db_update_impact
+import extract_16s
+import merge_shards
+import seqsero_tier
+import split_neisseria_capsule
+import watch_input
 
 
 class TestSerotypeFinderMultireport(unittest.TestCase):
@@ -84,5 +104,832 @@ class TestSerotypeFinderMultireport(unittest.TestCase):
         )
 
 
+class TestShigatyperMultireport(unittest.TestCase):
+    """Testing the ShigaTyper multireport when not all samples ran ShigaTyper"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        for sample in ["sample1", "sample2"]:
+            pathlib.Path("test_shiga_multireport", sample).mkdir(
+                parents=True, exist_ok=True
+            )
+        with open("test_shiga_multireport/sample1/shigatyper.csv", "w") as file_:
+            file_.write(",Hit,Number of reads,Length Covered\n")
+            file_.write("0,ipaH_c,120,100.0\n")
+        with open("test_shiga_multireport/sample1/command.txt", "w") as file_:
+            file_.write("sample\tprediction\tipaB\tnotes\n")
+            file_.write("sample1\tShigella sonnei\t+\t\n")
+        with open("test_shiga_multireport/sample2/shigella_screen.txt", "w") as file_:
+            file_.write("negative\n")
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf test_shiga_multireport")
+
+    def test_multireport_with_screened_out_sample(self) -> None:
+        """Samples without ShigaTyper output are reported as not run"""
+        multireport = serotyper_multireport.ShigatyperMultireport(
+            input_files=[
+                "test_shiga_multireport/sample1/shigatyper.csv",
+                "test_shiga_multireport/sample1/command.txt",
+                "test_shiga_multireport/sample2/shigella_screen.txt",
+            ],
+            output_file="test_shiga_multireport/shigatyper_multireport.csv",
+        )
+        multireport.make_multireport()
+        self.assertEqual(
+            multireport.multireport["Samplename"].tolist(), ["sample1", "sample2"]
+        )
+        self.assertEqual(
+            multireport.multireport.loc[0, "prediction"], "Shigella sonnei"
+        )
+        self.assertTrue(
+            multireport.multireport.loc[1, "Hit"].startswith("ShigaTyper not run")
+        )
+
+
+class TestSeqSeroTier(unittest.TestCase):
+    """Testing the choice between the SeqSero2 k-mer and microassembly modes"""
+
+    df_context = pd.read_csv("files/SeqSero2_context.tsv", sep="\t")
+
+    def make_report(self, o_antigen, h1, h2, serotype):
+        return pd.DataFrame(
+            {
+                "Sample name": ["sample1"],
+                "O antigen prediction": [o_antigen],
+                "H1 antigen prediction(fliC)": [h1],
+                "H2 antigen prediction(fljB)": [h2],
+                "Predicted serotype": [serotype],
+            }
+        )
+
+    def test_kmer_prediction_accepted(self) -> None:
+        report = self.make_report("4", "i", "1,2", "Typhimurium")
+        self.assertIsNone(seqsero_tier.needs_microassembly(report, self.df_context))
+
+    def test_monophasic_prediction(self) -> None:
+        report = self.make_report("4", "i", "-", "I 4:i:-")
+        self.assertIn(
+            "monophasic", seqsero_tier.needs_microassembly(report, self.df_context)
+        )
+
+    def test_ambiguous_prediction(self) -> None:
+        report = self.make_report("9", "g,m", "-", "Enteritidis or Blegdam")
+        self.assertIsNotNone(seqsero_tier.needs_microassembly(report, self.df_context))
+
+    def test_prediction_with_context(self) -> None:
+        report = self.make_report("9", "k", "1,5", "Miami")
+        self.assertIn(
+            "context", seqsero_tier.needs_microassembly(report, self.df_context)
+        )
+
+
+class TestStageDb(unittest.TestCase):
+    """Testing the staging of databases to node-local storage"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        pathlib.Path("fake_db/mlst7_db/senterica").mkdir(parents=True, exist_ok=True)
+        pathlib.Path("fake_db/mlst7_db/senterica/senterica.length.b").write_text("x")
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf fake_db fake_stage")
+
+    def test_stage_db_once_per_version(self) -> None:
+        """The database should only be copied again when it changes"""
+        staged = stage_db.stage_db("fake_db/mlst7_db", "fake_stage")
+        self.assertTrue(staged.joinpath("senterica", "senterica.length.b").exists())
+        self.assertEqual(stage_db.stage_db("fake_db/mlst7_db", "fake_stage"), staged)
+
+        pathlib.Path("fake_db/mlst7_db/senterica/senterica.length.b").write_text("xy")
+        staged_new = stage_db.stage_db("fake_db/mlst7_db", "fake_stage")
+        self.assertNotEqual(staged_new, staged)
+        self.assertFalse(staged.exists())
+        self.assertEqual(
+            staged_new.joinpath("senterica", "senterica.length.b").read_text(), "xy"
+        )
+
+    def test_failed_copy_is_removed(self) -> None:
+        """A partial copy should not be left behind if staging fails"""
+        db_dir = pathlib.Path("fake_db/broken_db")
+        db_dir.mkdir(parents=True, exist_ok=True)
+        db_dir.joinpath("index.b").write_text("x")
+        db_dir.joinpath("dangling").symlink_to("does_not_exist")
+        with self.assertRaises(OSError):
+            stage_db.stage_db(db_dir, "fake_stage", version="v1")
+        self.assertEqual(list(pathlib.Path("fake_stage").glob("*broken_db_*")), [])
+
+    def wait_for_removal(self, staged: pathlib.Path) -> bool:
+        for _ in range(50):
+            if not staged.exists():
+                return True
+            time.sleep(0.1)
+        return False
+
+    def test_copy_in_use_is_kept(self) -> None:
+        """A copy used by a running job is not removed when another version
+        is staged, and it is removed once the job finished"""
+        stage_db.POLL_SECONDS = 0.1
+        db_dir = pathlib.Path("fake_db/used_db")
+        db_dir.mkdir(parents=True, exist_ok=True)
+        db_dir.joinpath("index.b").write_text("x")
+        job = subprocess.Popen(["sleep", "30"])
+        staged_v1 = stage_db.stage_db(
+            db_dir, "fake_stage", version="v1", job_pid=job.pid, grace_minutes=0
+        )
+        staged_v2 = stage_db.stage_db(db_dir, "fake_stage", version="v2")
+        self.assertTrue(staged_v1.exists())
+        self.assertTrue(staged_v2.exists())
+        job.kill()
+        job.wait()
+        self.assertTrue(self.wait_for_removal(staged_v1))
+        self.assertTrue(staged_v2.exists())
+
+    def test_copy_removed_after_last_job(self) -> None:
+        """A copy is only removed when the last job using it finished"""
+        stage_db.POLL_SECONDS = 0.1
+        db_dir = pathlib.Path("fake_db/shared_db")
+        db_dir.mkdir(parents=True, exist_ok=True)
+        db_dir.joinpath("index.b").write_text("x")
+        first_job = subprocess.Popen(["sleep", "30"])
+        second_job = subprocess.Popen(["sleep", "30"])
+        for job in [first_job, second_job]:
+            staged = stage_db.stage_db(
+                db_dir, "fake_stage", version="v1", job_pid=job.pid, grace_minutes=0
+            )
+        first_job.kill()
+        first_job.wait()
+        time.sleep(1)
+        self.assertTrue(staged.exists())
+        second_job.kill()
+        second_job.wait()
+        self.assertTrue(self.wait_for_removal(staged))
+
+
+class TestSubsampleConcordance(unittest.TestCase):
+    """Testing the comparison of typing results with and without subsampling"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        pathlib.Path("test_concordance").mkdir(exist_ok=True)
+        pd.DataFrame(
+            {"Sample": ["sample1", "sample2"], "ST_type": ["11", "19"]}
+        ).to_csv("test_concordance/all_reads.csv", index=False)
+        pd.DataFrame(
+            {"Sample": ["sample1", "sample2"], "ST_type": ["11", "Unknown"]}
+        ).to_csv("test_concordance/subsampled.csv", index=False)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf test_concordance")
+
+    def test_compare_identical_reports(self) -> None:
+        differences = subsample_concordance.compare_multireports(
+            "test_concordance/all_reads.csv", "test_concordance/all_reads.csv"
+        )
+        self.assertEqual(differences, [])
+
+    def test_compare_discordant_reports(self) -> None:
+        differences = subsample_concordance.compare_multireports(
+            "test_concordance/all_reads.csv", "test_concordance/subsampled.csv"
+        )
+        self.assertEqual(len(differences), 1)
+        self.assertEqual(differences[0]["sample"], "sample2")
+        self.assertEqual(differences[0]["all_reads"], "19")
+        self.assertEqual(differences[0]["subsampled_reads"], "Unknown")
+
+    def test_compare_missing_report(self) -> None:
+        """A report made in only one of the runs is a difference for all its
+        samples"""
+        differences = subsample_concordance.compare_multireports(
+            "test_concordance/all_reads.csv", "test_concordance/missing.csv"
+        )
+        self.assertEqual([d["sample"] for d in differences], ["sample1", "sample2"])
+        self.assertEqual(differences[0]["subsampled_reads"], "missing")
+
+
+class TestMlst7Caller(unittest.TestCase):
+    """Testing the native 7-locus MLST caller"""
+
+    alleles = {
+        "aroC_1": "ACGTTGCAAGCTTGCAGGTCACGATCGATTACGGCATGCATGCAAGT",
+        "aroC_2": "ACGTTGCAAGCTTGCAGGTCACGATCGTTTACGGCATGCATGCAAGT",
+        "dnaN_1": "TTGACCGGTAACCGTTAGGCATCGATCGGGCTAGCTAAGCTTCGATC",
+        "dnaN_2": "TTGACCGGTAACCGTTAGGCATCGATCCGGCTAGCTAAGCTTCGATC",
+    }
+    flank = "GGGGGGGGGGCCCCCCCCCCAAAAAAAAAA"
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        scheme_dir = pathlib.Path("fake_mlst7_db/sfake")
+        scheme_dir.mkdir(parents=True, exist_ok=True)
+        with open(scheme_dir.joinpath("sfake.fsa"), "w") as fasta:
+            for name, seq in cls.alleles.items():
+                fasta.write(f">{name}\n{seq}\n")
+        with open(scheme_dir.joinpath("sfake.tsv"), "w") as profiles:
+            profiles.write("ST\taroC\tdnaN\tclonal_complex\n")
+            profiles.write("1\t1\t1\t\n2\t2\t1\t\n")
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf fake_mlst7_db fake_mlst7_index fake_mlst7_assembly.fasta")
+
+    def type_assembly(self, contig):
+        with open("fake_mlst7_assembly.fasta", "w") as assembly:
+            assembly.write(f">contig1\n{contig}\n")
+        index = mlst7_caller.load_scheme_index(
+            "fake_mlst7_db", "sfake", "fake_mlst7_index"
+        )
+        hits = mlst7_caller.find_alleles_in_assembly(index, "fake_mlst7_assembly.fasta")
+        return mlst7_caller.call_profile(index, hits)
+
+    def test_call_exact_alleles(self) -> None:
+        """Alleles are found on both strands and the ST is looked up"""
+        contig = (
+            self.flank
+            + self.alleles["aroC_2"]
+            + self.flank
+            + mlst7_caller.reverse_complement(self.alleles["dnaN_1"])
+            + self.flank
+        )
+        called, sequence_type = self.type_assembly(contig)
+        self.assertEqual(called, {"aroC": "aroC_2", "dnaN": "dnaN_1"})
+        self.assertEqual(sequence_type, "2")
+
+    def test_nearest_st_of_unknown_profile(self) -> None:
+        """A profile without ST should report the closest known profile"""
+        contig = (
+            self.flank + self.alleles["aroC_2"] + self.flank + self.alleles["dnaN_2"]
+        )
+        index = mlst7_caller.load_scheme_index(
+            "fake_mlst7_db", "sfake", "fake_mlst7_index"
+        )
+        called, sequence_type = self.type_assembly(contig)
+        self.assertEqual(sequence_type, "Unknown")
+        self.assertEqual(mlst7_caller.find_nearest_sts(index, called), (["2"], 1))
+
+    def test_fallback_novel_allele(self) -> None:
+        """A locus without an exact known allele should fall back to cge-mlst"""
+        novel_dnaN = self.alleles["dnaN_1"].replace("GGGCTA", "GGTCTA")
+        contig = self.flank + self.alleles["aroC_1"] + self.flank + novel_dnaN
+        with self.assertRaises(mlst7_caller.FallbackToCgeMlst):
+            self.type_assembly(contig)
+
+
+class TestMlst7ProfileIndex(unittest.TestCase):
+    """Testing the re-assignment of STs using the ST profile index"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        scheme_dir = pathlib.Path("fake_profile_db/mlst7_db/sfake")
+        scheme_dir.mkdir(parents=True, exist_ok=True)
+        with open("fake_profile_db/mlst7_db/config", "w") as config:
+            config.write("#db_prefix\tname\tdescription\n")
+            config.write("sfake\tSalmonella fake\taroC,dnaN\n")
+        with open(scheme_dir.joinpath("sfake.tsv"), "w") as profiles:
+            profiles.write("ST\taroC\tdnaN\tclonal_complex\n")
+            profiles.write("1\t1\t1\t\n2\t2\t1\t\n")
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf fake_profile_db")
+
+    def test_reassign_sts(self) -> None:
+        """STs are looked up independently of the order of the loci and
+        samples without exact alleles keep their ST"""
+        multireport = pd.DataFrame(
+            {
+                "Sample": ["sample1", "sample2", "sample3"],
+                "ST_type": ["Unknown", "1", "Unknown"],
+                "Scheme_used": ["Salmonella fake"] * 3,
+                "genes_in_scheme": ["dnaN-aroC", "aroC-dnaN", "aroC-dnaN"],
+                "alleles": ["1-2", "3-3", "2*-1"],
+            }
+        )
+        profile_index = mlst7_profile_index.StProfileIndex("fake_profile_db/mlst7_db")
+        updated = mlst7_profile_index.reassign_sts(multireport, profile_index)
+        self.assertEqual(updated["ST_type"].tolist(), ["2", "Unknown", "Unknown"])
+        self.assertEqual(
+            updated["previous_ST_type"].tolist(), ["Unknown", "1", "Unknown"]
+        )
+
+    def test_up_to_date_index_is_opened_read_only(self) -> None:
+        """An existing index is used without writing to the database dir"""
+        mlst7_profile_index.update_profile_index("fake_profile_db/mlst7_db")
+        profile_index = mlst7_profile_index.StProfileIndex("fake_profile_db/mlst7_db")
+        with self.assertRaises(sqlite3.OperationalError):
+            profile_index.connection.execute("DELETE FROM profiles")
+        self.assertEqual(
+            profile_index.get_st("Salmonella fake", ["aroC", "dnaN"], ["2", "1"]),
+            "2",
+        )
+
+    def test_index_built_in_memory_if_not_writable(self) -> None:
+        """A missing index on a read-only database is built in memory"""
+        os.system("rm -rf fake_profile_db/mlst7_profile_index")
+        with mock.patch.object(mlst7_profile_index, "can_write", return_value=False):
+            profile_index = mlst7_profile_index.StProfileIndex(
+                "fake_profile_db/mlst7_db"
+            )
+        self.assertFalse(pathlib.Path("fake_profile_db/mlst7_profile_index").exists())
+        self.assertEqual(
+            profile_index.get_st("Salmonella fake", ["aroC", "dnaN"], ["1", "1"]),
+            "1",
+        )
+
+
+class TestSplitNeisseriaCapsule(unittest.TestCase):
+    """Testing the splitting of the batched characterize_neisseria_capsule
+    results into one table per sample"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        pathlib.Path("fake_neisseria_output/serogroup").mkdir(
+            parents=True, exist_ok=True
+        )
+        with open(
+            "fake_neisseria_output/serogroup/serogroup_results.tab", "w"
+        ) as table:
+            table.write("Query\tSG\tGenes\n")
+            table.write("sample1\tB\tcsb\n")
+            table.write("sample2.fasta\tW\tcsw\n")
+        # Other .tab files of the tool are not result tables
+        pathlib.Path("fake_neisseria_output/blast").mkdir(exist_ok=True)
+        with open("fake_neisseria_output/blast/sample1_blast.tab", "w") as table:
+            table.write("qseqid\tsseqid\nsample1\tcsb\n")
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf fake_neisseria_output fake_neisseria_serotype")
+
+    def test_split_tables(self) -> None:
+        """Every sample gets the header and its own rows, also if the query
+        name contains the extension of the assembly"""
+        split_neisseria_capsule.split_tables(
+            "fake_neisseria_output",
+            ["sample1", "sample2"],
+            ["assemblies/sample1.fasta", "assemblies/sample2.fasta"],
+            "fake_neisseria_serotype",
+        )
+        for sample, serogroup in [("sample1", "B"), ("sample2", "W")]:
+            result = pd.read_csv(
+                f"fake_neisseria_serotype/{sample}/neisseriatyper.tab", sep="\t"
+            )
+            self.assertEqual(result.shape[0], 1)
+            self.assertEqual(result["SG"].values[0], serogroup)
+
+    def test_different_headers(self) -> None:
+        """Result tables with different headers cannot be combined"""
+        with open("fake_neisseria_output/serogroup/other.tab", "w") as table:
+            table.write("Query\tSerogroup\n")
+            table.write("sample3\tC\n")
+        try:
+            with self.assertRaises(ValueError):
+                split_neisseria_capsule.read_combined_tables("fake_neisseria_output")
+        finally:
+            os.remove("fake_neisseria_output/serogroup/other.tab")
+
+
+class TestExtract16s(unittest.TestCase):
+    """Testing the extraction of the 16S sequences predicted by barrnap"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        pathlib.Path("fake_16s").mkdir(exist_ok=True)
+        with open("fake_16s/assembly.fasta", "w") as assembly:
+            assembly.write(">contig_1\nAAAACCCCGGGGTTTT\n>contig_2\nACGTACGTAAAAAAAA\n")
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf fake_16s")
+
+    def test_extract_16s(self) -> None:
+        """Only 16S predictions are kept and the minus strand is reverse
+        complemented"""
+        gff = [
+            "##gff-version 3\n",
+            "contig_1\tbarrnap:0.9\trRNA\t5\t8\t0\t+\t.\tName=16S_rRNA;product=16S ribosomal RNA\n",
+            "contig_1\tbarrnap:0.9\trRNA\t9\t12\t0\t+\t.\tName=23S_rRNA;product=23S ribosomal RNA\n",
+            "contig_2\tbarrnap:0.9\trRNA\t1\t4\t0\t-\t.\tName=16S_rRNA;product=16S ribosomal RNA\n",
+        ]
+        locations = extract_16s.read_gff(gff)
+        records = list(
+            extract_16s.extract_records("fake_16s/assembly.fasta", locations)
+        )
+        self.assertEqual(
+            [(r.id, str(r.seq)) for r in records],
+            [
+                ("16S_rRNA::contig_1:4-8(+)", "CCCC"),
+                ("16S_rRNA::contig_2:0-4(-)", "ACGT"),
+            ],
+        )
+
+    def test_write_per_sample(self) -> None:
+        """Sequences of a batched run are split per sample and the sample
+        prefix is removed from the contig names"""
+        with open("fake_16s/batch.fasta", "w") as batch:
+            batch.write(">sample1|contig_1\nAAAACCCC\n>sample2|contig_1\nGGGGTTTT\n")
+        locations = extract_16s.read_gff(
+            [
+                "sample2|contig_1\tbarrnap:0.9\trRNA\t1\t4\t0\t+\t.\tName=16S_rRNA\n",
+            ]
+        )
+        extract_16s.write_per_sample(
+            extract_16s.extract_records("fake_16s/batch.fasta", locations),
+            ["sample1", "sample2"],
+            "fake_16s/output",
+        )
+        sample1 = list(SeqIO.parse("fake_16s/output/sample1/16S_seq.fasta", "fasta"))
+        sample2 = list(SeqIO.parse("fake_16s/output/sample2/16S_seq.fasta", "fasta"))
+        self.assertEqual(sample1, [])
+        self.assertEqual(
+            [(r.id, str(r.seq)) for r in sample2],
+            [("16S_rRNA::contig_1:0-4(+)", "GGGG")],
+        )
+
+
+class TestCalibrateResources(unittest.TestCase):
+    """Testing the calibration of the input-size-aware memory coefficients"""
+
+    def test_fit_memory(self) -> None:
+        """The slope follows the benchmarks and no job is underestimated"""
+        benchmarks = pd.DataFrame(
+            {"input_gb": [1.0, 2.0, 3.0, 4.0], "mem_gb": [3.0, 5.5, 7.0, 9.0]}
+        )
+        fit = calibrate_resources.fit_memory(benchmarks)
+        self.assertAlmostEqual(fit["mem_gb_per_input_gb"], 1.95)
+        estimated = (
+            fit["mem_gb_base"] + fit["mem_gb_per_input_gb"] * benchmarks["input_gb"]
+        )
+        self.assertTrue((estimated >= benchmarks["mem_gb"]).all())
+
+
+class TestBenchmarkReport(unittest.TestCase):
+    """Testing the summary of the benchmark files of a run"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        header = "s\th:m:s\tmax_rss\tmax_vms\tmax_uss\tmax_pss\tio_in\tio_out\tmean_load\tcpu_time\n"
+        benchmarks = {
+            "seroba/sample1.tsv": "10\t0:00:10\t100\t0\t0\t0\t0\t0\t0\t5\n",
+            "seroba/sample2.tsv": "30\t0:00:30\t300\t0\t0\t0\t0\t0\t0\t15\n",
+            "mlst7_multireport.tsv": "2\t0:00:02\t50\t0\t0\t0\t0\t0\t0\t1\n",
+        }
+        for file_, values in benchmarks.items():
+            benchmark = pathlib.Path("fake_benchmark").joinpath(file_)
+            benchmark.parent.mkdir(parents=True, exist_ok=True)
+            benchmark.write_text(header + values)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf fake_benchmark")
+
+    def test_report_per_tool_and_genus(self) -> None:
+        """Jobs are summarized per rule and per rule and genus, with the CPU
+        efficiency relative to the threads of the rule"""
+        samples = {
+            "sample1": {"genus": "streptococcus"},
+            "sample2": {"genus": "streptococcus"},
+        }
+        jobs = benchmark_report.read_benchmarks(
+            "fake_benchmark", samples, {"seroba": 2, "other": 1}
+        )
+        report = benchmark_report.make_report(jobs).set_index(["rule", "genus"])
+        self.assertEqual(report.loc[("seroba", "all"), "jobs"], 2)
+        self.assertEqual(
+            report.loc[("seroba", "streptococcus"), "max_rss_peak_mb"], 300
+        )
+        self.assertEqual(report.loc[("seroba", "all"), "wall_time_p50_s"], 20)
+        self.assertEqual(report.loc[("seroba", "all"), "cpu_efficiency_mean"], 0.25)
+        self.assertEqual(report.loc[("mlst7_multireport", "-"), "jobs"], 1)
+
+
+class TestResultCache(unittest.TestCase):
+    """Testing the result cache shared between runs"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        pathlib.Path("fake_cache_run/input").mkdir(parents=True, exist_ok=True)
+        pathlib.Path("fake_cache_run/envs").mkdir(parents=True, exist_ok=True)
+        for env in ["mlst7", "seqsero", "serotypefinder", "seroba", "shigatyper"]:
+            pathlib.Path(f"fake_cache_run/envs/{env}.yaml").write_text(env)
+        for sample in ["sample1", "sample2"]:
+            for suffix in [".fasta", "_R1.fastq", "_R2.fastq"]:
+                pathlib.Path(f"fake_cache_run/input/{sample}{suffix}").write_text(
+                    f"{sample}{suffix}\n"
+                )
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf fake_cache_run")
+
+    def get_keys(self, parameters):
+        samples = {
+            sample: {
+                "R1": f"fake_cache_run/input/{sample}_R1.fastq",
+                "R2": f"fake_cache_run/input/{sample}_R2.fastq",
+                "assembly": f"fake_cache_run/input/{sample}.fasta",
+                "genus": "escherichia",
+                "species-mlst7": "ecoli",
+            }
+            for sample in ["sample1", "sample2"]
+        }
+        return result_cache.get_cache_keys(
+            samples,
+            parameters,
+            {"mlst7": "2.0.4"},
+            lambda rule, sample_info: None,
+            "fake_cache_run/store",
+            "fake_cache_run",
+        )
+
+    def test_store_and_restore(self) -> None:
+        """A stored result is restored in a new output directory, and the keys
+        depend on the input content and the parameters"""
+        pathlib.Path("fake_cache_run/store").mkdir(exist_ok=True)
+        parameters = {"mlst7": {"input": "assembly"}, "serotypefinder": {}}
+        keys = self.get_keys(parameters)
+        self.assertNotEqual(keys["mlst7"]["sample1"], keys["mlst7"]["sample2"])
+        self.assertEqual(keys["seroba"], {})
+        parameters["mlst7"]["caller"] = "native"
+        self.assertNotEqual(
+            keys["mlst7"]["sample1"], self.get_keys(parameters)["mlst7"]["sample1"]
+        )
+
+        result = pathlib.Path("fake_cache_run/output1/mlst7/sample1/results.txt")
+        result.parent.mkdir(parents=True)
+        result.write_text("ST 1")
+        result_cache.store(
+            "fake_cache_run/store",
+            keys["mlst7"]["sample1"],
+            "fake_cache_run/output1",
+            [result],
+        )
+        restored = result_cache.restore_results(
+            "fake_cache_run/store", keys, "fake_cache_run/output2"
+        )
+        self.assertEqual(restored, 1)
+        self.assertEqual(
+            pathlib.Path(
+                "fake_cache_run/output2/mlst7/sample1/results.txt"
+            ).read_text(),
+            "ST 1",
+        )
+        result_cache.evict("fake_cache_run/store", 0)
+        self.assertFalse(
+            result_cache.restore(
+                "fake_cache_run/store",
+                keys["mlst7"]["sample1"],
+                "fake_cache_run/output3",
+            )
+        )
+
+
+class TestDbUpdateImpact(unittest.TestCase):
+    """Testing which samples are re-typed after a database update"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        db = pathlib.Path("fake_impact/db")
+        for scheme in ["senterica", "ecoli"]:
+            db.joinpath("mlst7_db", scheme).mkdir(parents=True, exist_ok=True)
+            db.joinpath("mlst7_db", scheme, f"{scheme}.tsv").write_text("ST\taroC\n")
+        db.joinpath("mlst7_db", "config").write_text(
+            "#db_prefix\tname\tdescription\n"
+            "senterica\tSalmonella enterica\taroC\n"
+            "ecoli\tEscherichia coli#1\taroC\n"
+        )
+        db.joinpath("serotypefinder_db").mkdir(exist_ok=True)
+        db.joinpath("serotypefinder_db", "O_type.fsa").write_text(">O1\nACGT\n")
+        for sample in ["sample1", "sample2"]:
+            sample_dir = pathlib.Path("fake_impact/output/mlst7", sample)
+            sample_dir.mkdir(parents=True, exist_ok=True)
+            sample_dir.joinpath("data.json").write_text("{}")
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf fake_impact")
+
+    def test_only_changed_scheme_is_retyped(self) -> None:
+        """Only the samples of the scheme with new profiles are affected"""
+        samples = {
+            "sample1": {"genus": "salmonella", "species-mlst7": "senterica"},
+            "sample2": {"genus": "escherichia", "species-mlst7": "ecoli"},
+        }
+        old_contents = db_update_impact.get_database_contents("fake_impact/db", 71)
+        pathlib.Path("fake_impact/db/mlst7_db/ecoli/ecoli.tsv").write_text(
+            "ST\taroC\n1\t1\n"
+        )
+        new_contents = db_update_impact.get_database_contents("fake_impact/db", 71)
+        affected = db_update_impact.find_affected_samples(
+            samples, old_contents, new_contents, "fake_impact/output"
+        )
+        self.assertEqual(affected["mlst7"], ["sample2"])
+        db_update_impact.remove_outputs("fake_impact/output", affected)
+        self.assertTrue(
+            pathlib.Path("fake_impact/output/mlst7/sample1/data.json").exists()
+        )
+        self.assertFalse(
+            pathlib.Path("fake_impact/output/mlst7/sample2/data.json").exists()
+        )
+
+
+class TestWatchInput(unittest.TestCase):
+    """Testing which samples are complete in watch mode"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        pathlib.Path("fake_watch").mkdir(exist_ok=True)
+        for file_ in ["sample1_R1.fastq.gz", "sample1_R2.fastq.gz", "sample1.fasta"]:
+            pathlib.Path("fake_watch", file_).write_text("content")
+            os.utime(pathlib.Path("fake_watch", file_), (1000, 1000))
+        pathlib.Path("fake_watch", "sample2_R1.fastq.gz").write_text("content")
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf fake_watch")
+
+    def test_unsettled_samples(self) -> None:
+        """Samples with recently modified or missing files are not typed yet"""
+        samples = {
+            "sample1": {
+                "R1": "fake_watch/sample1_R1.fastq.gz",
+                "R2": "fake_watch/sample1_R2.fastq.gz",
+                "assembly": "fake_watch/sample1.fasta",
+            },
+            "sample2": {
+                "R1": "fake_watch/sample2_R1.fastq.gz",
+                "R2": "fake_watch/sample2_R2.fastq.gz",
+            },
+        }
+        self.assertEqual(
+            watch_input.get_unsettled_samples(samples, 300, now=2000), ["sample2"]
+        )
+        self.assertEqual(
+            watch_input.get_unsettled_samples(samples, 1500, now=2000),
+            ["sample1", "sample2"],
+        )
+
+    def test_snapshot_changes_with_new_files(self) -> None:
+        before = watch_input.snapshot(["fake_watch", "fake_watch/missing.csv"])
+        pathlib.Path("fake_watch", "sample3.fasta").write_text(">contig\nACGT\n")
+        after = watch_input.snapshot(["fake_watch", "fake_watch/missing.csv"])
+        self.assertNotEqual(before, after)
+        self.assertIn("fake_watch/sample3.fasta", after)
+        pathlib.Path("fake_watch", "sample3.fasta").unlink()
+
+
+class TestSampleSummary(unittest.TestCase):
+    """Testing the per-sample summary of the typing results"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        sample_dir = pathlib.Path("fake_summary/serotype/sample1")
+        sample_dir.mkdir(parents=True, exist_ok=True)
+        sample_dir.joinpath("result_serotype.csv").write_text(
+            ",O1_wzx,H7_fliC\nserotype,O1,H7\n"
+        )
+        sample_dir.joinpath("shigella_screen.txt").write_text("negative\n")
+        sample_dir.joinpath("data.json").write_text("{}")
+        pathlib.Path("fake_summary/16S_seq.fasta").write_text(
+            ">16S_rRNA::contig1:1-1500(+)\nACGT\n"
+        )
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf fake_summary")
+
+    def test_make_summary(self) -> None:
+        summary = sample_summary.make_summary(
+            "sample1",
+            "escherichia",
+            "coli",
+            "files/no_mlst7.json",
+            [
+                "fake_summary/serotype/sample1/data.json",
+                "fake_summary/serotype/sample1/result_serotype.csv",
+                "fake_summary/serotype/sample1/shigella_screen.txt",
+            ],
+            "fake_summary/16S_seq.fasta",
+        )
+        self.assertEqual(summary["mlst7"]["sequence_type"], "not_calculated")
+        self.assertEqual(len(summary["mlst7"]["alleles"]), 7)
+        self.assertEqual(
+            summary["serotype"],
+            {
+                "serotypefinder": [{"": "serotype", "O1_wzx": "O1", "H7_fliC": "H7"}],
+                "shigella_screen": "negative",
+            },
+        )
+        self.assertEqual(summary["16s"]["sequences"], ["16S_rRNA::contig1:1-1500(+)"])
+        sample_summary.write_summary(summary, "fake_summary/summary/sample1.json")
+        self.assertEqual(
+            [f.name for f in pathlib.Path("fake_summary/summary").iterdir()],
+            ["sample1.json"],
+        )
+
+
+class TestMergeShards(unittest.TestCase):
+    """Testing the merge of the results of a sharded run"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        shards = {1: ["sample3", "sample1"], 2: ["sample2"]}
+        for shard_index, samples in shards.items():
+            audit_dir = pathlib.Path(f"fake_shards/shard_{shard_index}/audit_trail")
+            audit_dir.mkdir(parents=True, exist_ok=True)
+            audit_dir.joinpath("shard.yaml").write_text(
+                f"shard_index: {shard_index}\nshards: 2\n"
+            )
+            audit_dir.joinpath("sample_sheet.yaml").write_text(
+                "".join(f"{sample}:\n  genus: other\n" for sample in samples)
+            )
+            for sample in samples:
+                mlst7_dir = audit_dir.parent.joinpath("mlst7", sample)
+                mlst7_dir.mkdir(parents=True, exist_ok=True)
+                mlst7_dir.joinpath("data.json").write_text(
+                    pathlib.Path("files/no_mlst7.json").read_text()
+                )
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf fake_shards")
+
+    def test_merge_is_sorted_by_sample(self) -> None:
+        sample_dirs = merge_shards.read_shards(
+            ["fake_shards/shard_2", "fake_shards/shard_1"]
+        )
+        merge_shards.merge_mlst7(
+            sample_dirs, pathlib.Path("fake_shards/merged/mlst7_multireport.csv")
+        )
+        multireport = pd.read_csv("fake_shards/merged/mlst7_multireport.csv")
+        self.assertEqual(
+            multireport["Sample"].tolist(), ["sample1", "sample2", "sample3"]
+        )
+
+    def test_missing_shard(self) -> None:
+        with self.assertRaisesRegex(ValueError, "shard\\(s\\) 2 of 2 are missing"):
+            merge_shards.read_shards(["fake_shards/shard_1"])
+
+
+class TestPreflight(unittest.TestCase):
+    """Testing the check of the input files before a run"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        import gzip
+
+        input_dir = pathlib.Path("fake_preflight")
+        input_dir.mkdir(exist_ok=True)
+        reads = b"@read1\nACGT\n+\nIIII\n@read2\nACG\n+\nIII\n"
+        for sample in ["sample1", "sample2", "sample3"]:
+            for read in ["R1", "R2"]:
+                fastq = input_dir.joinpath(f"{sample}_{read}.fastq.gz")
+                with gzip.open(fastq, "wb") as file_:
+                    file_.write(reads)
+        input_dir.joinpath("sample1.fasta").write_text(
+            ">contig1\nACGTACGTAC\n>contig2\nACGT\nAC\n>contig3\nACG\n"
+        )
+        input_dir.joinpath("sample2.fasta").write_text(">contig1\nACGT\n")
+        # Truncated gzip file
+        truncated = input_dir.joinpath("sample2_R2.fastq.gz").read_bytes()
+        input_dir.joinpath("sample2_R2.fastq.gz").write_bytes(truncated[:-10])
+        # Truncated assembly
+        input_dir.joinpath("sample3.fasta").write_text(">contig1\nACGT\n>cont")
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        os.system("rm -rf fake_preflight")
+
+    def test_run_preflight(self) -> None:
+        samples = {
+            sample: {
+                "R1": f"fake_preflight/{sample}_R1.fastq.gz",
+                "R2": f"fake_preflight/{sample}_R2.fastq.gz",
+                "assembly": f"fake_preflight/{sample}.fasta",
+            }
+            for sample in ["sample1", "sample2", "sample3"]
+        }
+        stats, errors = preflight.run_preflight(
+            samples, "fake_preflight/preflight.json", threads=2
+        )
+        self.assertEqual(list(stats), ["sample1"])
+        self.assertEqual(stats["sample1"]["read_count"], 4)
+        self.assertEqual(stats["sample1"]["total_bases"], 14)
+        self.assertEqual(stats["sample1"]["contigs"], 3)
+        self.assertEqual(stats["sample1"]["assembly_length"], 19)
+        self.assertEqual(stats["sample1"]["n50"], 10)
+        self.assertEqual(stats["sample1"]["uncompressed_size"]["R1"], 36)
+        self.assertRegex(errors["sample2"][0], "^R2: corrupt gzip file")
+        self.assertRegex(errors["sample3"][0], "^assembly: .*truncated")
+        # The results are remembered
+        self.assertEqual(
+            preflight.run_preflight(samples, "fake_preflight/preflight.json"),
+            (stats, errors),
+        )
+
+
 if __name__ == "__main__":
     unittest.main()